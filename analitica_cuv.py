@@ -0,0 +1,173 @@
+# analitica_cuv.py
+import argparse
+import csv
+import datetime
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from procesador_cuv import buscar_archivos_cuv, extraer_proceso_id
+from recorrido_paralelo import normalizar_raices
+
+CLASE_RECHAZADO = 'RECHAZADO'
+
+
+def resumir_cuv(archivo_cuv):
+    """Lee un CUV y devuelve solo lo necesario para la analítica.
+
+    Las validaciones se reducen a un Counter de (Clase, Codigo) más una
+    observación de ejemplo por código, así el resultado es pequeño aunque el
+    CUV tenga miles de entradas.
+    """
+    with open(archivo_cuv, 'r', encoding='utf-8') as f:
+        datos = json.load(f)
+
+    conteos = Counter()
+    ejemplos = {}
+    proceso_id = datos.get('ProcesoId')
+    for r in datos.get('ResultadosValidacion') or []:
+        if not isinstance(r, dict):
+            continue
+        clase = r.get('Clase') or ''
+        codigo = r.get('Codigo') or ''
+        observaciones = r.get('Observaciones') or ''
+        conteos[(clase, codigo)] += 1
+        if codigo not in ejemplos and observaciones:
+            ejemplos[codigo] = observaciones
+        if not proceso_id:
+            proceso_id = extraer_proceso_id(observaciones)
+
+    return {
+        'archivo': archivo_cuv,
+        'num_factura': str(datos.get('NumFactura') or ''),
+        'proceso_id': str(proceso_id or ''),
+        'conteos': conteos,
+        'ejemplos': ejemplos,
+    }
+
+
+class AnaliticaGlosas:
+    """Acumula los resúmenes de CUV por código, clase, carpeta y factura"""
+
+    def __init__(self):
+        self.archivos = 0
+        self.errores = []
+        self.por_clase = Counter()
+        self.por_codigo = Counter()          # (clase, codigo) -> ocurrencias
+        self.facturas_por_codigo = Counter()  # (clase, codigo) -> facturas afectadas
+        self.ejemplos = {}
+        self.por_carpeta = {}
+        self.facturas = []
+
+    def agregar(self, carpeta, resumen):
+        self.archivos += 1
+        carpeta_stats = self.por_carpeta.setdefault(
+            carpeta, {'archivos': 0, 'facturas_rechazadas': 0, 'rechazos': 0, 'notificaciones': 0})
+        carpeta_stats['archivos'] += 1
+
+        rechazos = 0
+        for (clase, codigo), n in resumen['conteos'].items():
+            self.por_clase[clase] += n
+            self.por_codigo[(clase, codigo)] += n
+            self.facturas_por_codigo[(clase, codigo)] += 1
+            if clase == CLASE_RECHAZADO:
+                rechazos += n
+            else:
+                carpeta_stats['notificaciones'] += n
+        for codigo, obs in resumen['ejemplos'].items():
+            self.ejemplos.setdefault(codigo, obs)
+
+        if rechazos:
+            carpeta_stats['rechazos'] += rechazos
+            carpeta_stats['facturas_rechazadas'] += 1
+        if resumen['conteos']:
+            # Solo lo que va al CSV, para no retener las observaciones de cada CUV
+            self.facturas.append((carpeta, os.path.basename(resumen['archivo']), resumen['num_factura'],
+                                  resumen['proceso_id'], resumen['conteos']))
+
+    def codigos_ordenados(self):
+        return sorted(self.por_codigo.items(), key=lambda kv: (-kv[1], kv[0]))
+
+    def escribir_reporte(self, ruta_base):
+        """Escribe <ruta_base>.json (agregados) y <ruta_base>.csv (por factura)"""
+        ruta_base = os.path.splitext(ruta_base)[0]
+        reporte = {
+            'generado': datetime.datetime.now().isoformat(timespec='seconds'),
+            'archivos_analizados': self.archivos,
+            'errores': self.errores,
+            'por_clase': dict(self.por_clase),
+            'por_codigo': [
+                {'clase': clase, 'codigo': codigo, 'ocurrencias': n,
+                 'facturas': self.facturas_por_codigo[(clase, codigo)],
+                 'ejemplo': self.ejemplos.get(codigo, '')}
+                for (clase, codigo), n in self.codigos_ordenados()
+            ],
+            'por_carpeta': self.por_carpeta,
+        }
+        with open(ruta_base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+
+        # utf-8-sig para que Excel abra bien las tildes
+        with open(ruta_base + '.csv', 'w', encoding='utf-8-sig', newline='') as f:
+            w = csv.writer(f, delimiter=';')
+            w.writerow(['Carpeta', 'Archivo', 'NumFactura', 'ProcesoId', 'Clase', 'Codigo', 'Cantidad'])
+            for carpeta, archivo, num_factura, proceso_id, conteos in self.facturas:
+                for (clase, codigo), n in sorted(conteos.items()):
+                    w.writerow([carpeta, archivo, num_factura, proceso_id, clase, codigo, n])
+        return ruta_base + '.json', ruta_base + '.csv'
+
+
+def analizar_carpetas(carpetas, max_workers=None, progreso=None, reglas=None):
+    """Recorre todas las carpetas en paralelo y agrega sus CUV en una pasada.
+
+    La lectura de miles de archivos pequeños está dominada por E/S (y en
+    recursos compartidos por la latencia de red), por eso se usa un pool de
+    hilos. progreso(hechos, total) se invoca a medida que se completan.
+    """
+    analitica = AnaliticaGlosas()
+    # Una carpeta anidada en otra de la lista contaría sus CUV dos veces
+    carpetas, _ = normalizar_raices(carpetas, reglas)
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        listados = pool.map(lambda carpeta: buscar_archivos_cuv(carpeta, reglas), carpetas)
+        tareas = [(carpeta, archivo)
+                  for carpeta, archivos in zip(carpetas, listados)
+                  for archivo in archivos]
+        total = len(tareas)
+
+        def _resumir(tarea):
+            carpeta, archivo = tarea
+            try:
+                return carpeta, resumir_cuv(archivo), None
+            except Exception as e:
+                return carpeta, None, f"Error leyendo CUV {archivo}: {e}"
+
+        for hechos, (carpeta, resumen, error) in enumerate(pool.map(_resumir, tareas), 1):
+            if error:
+                analitica.errores.append(error)
+            else:
+                analitica.agregar(carpeta, resumen)
+            if progreso and (hechos % 200 == 0 or hechos == total):
+                progreso(hechos, total)
+
+    return analitica
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analítica de glosas/rechazos de los archivos CUV")
+    parser.add_argument("carpetas", nargs="+", help="Carpetas a analizar (recursivo)")
+    parser.add_argument("-o", "--salida", default=f"Reporte_Glosas_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                        help="Ruta base del reporte (se generan .json y .csv)")
+    args = parser.parse_args()
+
+    analitica = analizar_carpetas(args.carpetas)
+    ruta_json, ruta_csv = analitica.escribir_reporte(args.salida)
+    print(f"CUV analizados: {analitica.archivos} (errores: {len(analitica.errores)})")
+    for (clase, codigo), n in analitica.codigos_ordenados()[:10]:
+        print(f"  {clase:<14} {codigo:<10} {n}")
+    print(f"Reporte: {ruta_json} / {ruta_csv}")
+
+if __name__ == "__main__":
+    main()
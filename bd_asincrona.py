@@ -0,0 +1,109 @@
+# bd_asincrona.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from database_manager import contador_consultas
+
+
+class AccesoBD(QObject):
+    """Llamadas a la base de datos fuera del hilo de la interfaz.
+
+    Todo pasa por un único hilo de trabajo: la conexión de DatabaseManager es
+    una sola y no se puede usar desde dos hilos a la vez, así las consultas
+    se ejecutan en orden, una tras otra. llamar() devuelve el Future y
+    entrega el resultado a al_terminar (o la excepción a al_fallar) en el
+    hilo de la interfaz.
+
+    Con clave, las llamadas repetidas se fusionan: si llega otra con la misma
+    clave, la anterior se salta si aún no empezó y su resultado se descarta
+    si ya estaba en curso. Recorrer el combo de configuraciones con las
+    flechas consulta solo la última.
+
+    ocupado(True/False) avisa cuando empieza y cuando termina la actividad.
+    Cada llamada es una acción del contador de consultas (con el nombre de
+    la clave o de la función): el diagnóstico de conexión muestra cuántas
+    consultas costó cada una.
+    """
+    ocupado = pyqtSignal(bool)
+    # (callback o None, valor); se emite desde el hilo de trabajo
+    _listo = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._versiones = {}   # clave -> número de la última llamada con esa clave
+        self._lock = threading.Lock()
+        self._pendientes = 0   # solo se toca desde el hilo de la interfaz
+        self._listo.connect(self._entregar)
+
+    def llamar(self, funcion, *args, al_terminar=None, al_fallar=None, clave=None):
+        version = self.descartar(clave) if clave is not None else None
+        self._pendientes += 1
+        if self._pendientes == 1:
+            self.ocupado.emit(True)
+        return self._pool.submit(self._ejecutar, funcion, args, al_terminar, al_fallar, clave, version)
+
+    def esperar(self, funcion, *args):
+        """Ejecuta funcion en el hilo de trabajo y espera su resultado.
+
+        Para los pasos que no pueden seguir sin el dato (iniciar un
+        procesamiento); la consulta no se cruza con las que están en curso.
+        """
+        return self.llamar(funcion, *args).result()
+
+    def descartar(self, clave):
+        """Invalida las llamadas pendientes con clave; devuelve la versión nueva"""
+        with self._lock:
+            version = self._versiones.get(clave, 0) + 1
+            self._versiones[clave] = version
+            return version
+
+    def _vigente(self, clave, version):
+        if clave is None:
+            return True
+        with self._lock:
+            return self._versiones.get(clave) == version
+
+    def _ejecutar(self, funcion, args, al_terminar, al_fallar, clave, version):
+        if not self._vigente(clave, version):
+            self._listo.emit(None, None)
+            return None
+        try:
+            with contador_consultas.accion(clave or getattr(funcion, '__name__', str(funcion))):
+                valor = funcion(*args)
+        except Exception as e:
+            if al_fallar is None:
+                print(f"Error de base de datos en {getattr(funcion, '__name__', funcion)}: {e}")
+            self._listo.emit(al_fallar if self._vigente(clave, version) else None, e)
+            raise
+        self._listo.emit(al_terminar if self._vigente(clave, version) else None, valor)
+        return valor
+
+    def _entregar(self, callback, valor):
+        try:
+            if callback is not None:
+                callback(valor)
+        finally:
+            self._pendientes -= 1
+            if self._pendientes == 0:
+                self.ocupado.emit(False)
+
+    def cerrar(self, al_final=None):
+        """Termina el hilo de trabajo; al_final (p. ej. cerrar la conexión)
+        se ejecuta en él después de las llamadas pendientes"""
+        if al_final is not None:
+            self._pool.submit(al_final)
+        self._pool.shutdown(wait=False)
+
+
+_acceso = None
+
+
+def acceso_bd():
+    """AccesoBD compartido por toda la interfaz (se crea al primer uso)"""
+    global _acceso
+    if _acceso is None:
+        _acceso = AccesoBD()
+    return _acceso
@@ -0,0 +1,340 @@
+# cola_trabajo.py
+import os
+import random
+import socket
+import threading
+import time
+
+from database_manager import DatabaseManager
+from ejecutor_renombrado import EjecutorRenombrado
+from motor_procesamiento import ResultadoProcesamiento, procesar_carpetas
+from recorrido_paralelo import normalizar_raices
+
+TABLA_COLA = 'SERAF_COLA_TRABAJO'
+DURACION_RESERVA = 120      # segundos que una carpeta queda reservada sin latidos
+MAX_INTENTOS = 3            # reservas vencidas antes de dar la carpeta por fallida
+CANDIDATAS = 8              # carpetas que se leen por intento de tomar una
+ESPERA_COLA = 5.0           # segundos entre consultas mientras otros equipos terminan
+
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_EN_CURSO = 'en_curso'
+ESTADO_HECHO = 'hecho'
+ESTADO_ERROR = 'error'
+
+COLA_SQL = f"""
+CREATE TABLE {TABLA_COLA} (
+    ID {{identidad}},
+    COLA VARCHAR(100) NOT NULL,
+    CARPETA VARCHAR(1000) NOT NULL,
+    CONFIG_ID INTEGER,
+    ESTADO VARCHAR(20) NOT NULL,
+    TRABAJADOR VARCHAR(100),
+    VENCE TIMESTAMP,
+    INTENTOS INTEGER DEFAULT 0,
+    ALTA TIMESTAMP,
+    FIN TIMESTAMP,
+    DETALLE VARCHAR(1000)
+)
+"""
+INDICE_COLA_SQL = f"CREATE INDEX IX_COLA_ESTADO ON {TABLA_COLA} (COLA, ESTADO)"
+
+# Disponible: pendiente, o en curso con la reserva vencida (el equipo que la tenía se cayó)
+_DISPONIBLE = "(ESTADO = '{pendiente}' OR (ESTADO = '{en_curso}' AND VENCE < {ahora}))"
+
+
+class TareaCola:
+    """Una carpeta reservada por este equipo"""
+    __slots__ = ('id', 'carpeta', 'config_id', 'intentos')
+
+    def __init__(self, id_, carpeta, config_id, intentos):
+        self.id = id_
+        self.carpeta = carpeta
+        self.config_id = config_id
+        self.intentos = intentos
+
+
+class ColaTrabajo:
+    """Cola de carpetas compartida en la BD para repartir una entrega entre equipos.
+
+    Cada equipo toma una carpeta a la vez con una reserva que vence a los
+    `duracion` segundos; un hilo de latidos la renueva mientras se procesa.
+    Si el equipo se cae los latidos paran, la reserva vence y otro equipo
+    la vuelve a tomar (hasta MAX_INTENTOS veces; después queda en error).
+    Tomar es un UPDATE condicionado al estado que se leyó: si dos equipos
+    eligen la misma carpeta, solo a uno le actualiza la fila.
+
+    Las carpetas se guardan con su ruta absoluta: todos los equipos deben
+    verla con la misma ruta (recurso compartido UNC, no letras de unidad).
+
+    Usa conexiones propias (DatabaseManager.conexion_aparte), una para el
+    hilo que procesa y otra para los latidos, y no la del singleton: así
+    los latidos no esperan a la interfaz ni se cruzan con bd_asincrona.
+    """
+
+    def __init__(self, nombre, trabajador=None, duracion=DURACION_RESERVA, intervalo_latido=None):
+        self.nombre = nombre
+        self.trabajador = (trabajador or f"{socket.gethostname()}:{os.getpid()}")[:100]
+        self.duracion = duracion
+        self.intervalo_latido = intervalo_latido or duracion / 3
+        self._sentencias = None
+        self._en_curso = {}      # id -> TareaCola reservada por este equipo
+        self.perdidas = set()    # ids cuya reserva venció y tomó otro equipo
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo_latidos = None
+
+    # --- Conexión y tabla ---
+    def _bd(self):
+        if self._sentencias is None:
+            self._sentencias = DatabaseManager().conexion_aparte()
+            self._asegurar_tabla(self._sentencias)
+        return self._sentencias
+
+    @staticmethod
+    def _asegurar_tabla(sentencias):
+        if sentencias.ejecutar(sentencias.motor.SQL_TABLA_EXISTE, (TABLA_COLA,)).fetchone()[0] == 0:
+            sentencias.ejecutar_directo(COLA_SQL.format(identidad=sentencias.motor.COLUMNA_IDENTIDAD))
+            sentencias.conexion.commit()
+            try:
+                sentencias.ejecutar_directo(INDICE_COLA_SQL)
+            except Exception:
+                # Otro equipo la creó a la vez
+                pass
+        sentencias.conexion.commit()
+
+    def _disponible(self, motor):
+        return _DISPONIBLE.format(pendiente=ESTADO_PENDIENTE, en_curso=ESTADO_EN_CURSO, ahora=motor.SQL_AHORA)
+
+    def _transaccion(self, funcion):
+        """Ejecuta funcion(sentencias) y confirma; si falla, deshace y relanza"""
+        sentencias = self._bd()
+        try:
+            valor = funcion(sentencias)
+            sentencias.conexion.commit()
+            return valor
+        except Exception:
+            try:
+                sentencias.conexion.rollback()
+            except Exception:
+                pass
+            raise
+
+    # --- Operaciones ---
+    def encolar(self, carpetas, config_id=None, reglas=None):
+        """Agrega las carpetas que no queden cubiertas por otra pendiente o en
+        curso de la cola; devuelve cuántas agregó.
+
+        Repetidas y anidadas se unen con normalizar_raices, también contra las
+        que ya están en la cola: dos equipos no deben recorrer los mismos
+        archivos a la vez. Una carpeta nueva que contiene otras aún pendientes
+        las reemplaza; si contiene una en curso, no se agrega.
+        """
+        def agregar(s):
+            activas = {carpeta: (id_, estado) for id_, carpeta, estado in s.ejecutar(
+                f"SELECT ID, CARPETA, ESTADO FROM {TABLA_COLA} WHERE COLA = ? AND ESTADO IN (?, ?) ORDER BY ID",
+                (self.nombre, ESTADO_PENDIENTE, ESTADO_EN_CURSO)).fetchall()}
+            # Las de la cola van primero: una repetida se une a la que ya estaba
+            raices, fusiones = normalizar_raices(
+                list(activas) + [os.path.abspath(c)[:1000] for c in carpetas], reglas)
+            absorbidas = {}   # carpeta nueva -> carpetas de la cola que contiene
+            for carpeta, cubierta_por, motivo in fusiones:
+                if carpeta in activas and cubierta_por not in activas:
+                    absorbidas.setdefault(cubierta_por, []).append(carpeta)
+                elif carpeta not in activas:
+                    print(f"Cola {self.nombre}: {carpeta} no se agrega ({motivo}: {cubierta_por})")
+
+            nuevas = []
+            reemplazadas = []
+            for raiz in raices:
+                if raiz in activas:
+                    continue
+                hijas = absorbidas.get(raiz, [])
+                en_curso = [h for h in hijas if activas[h][1] == ESTADO_EN_CURSO]
+                if en_curso:
+                    print(f"Cola {self.nombre}: {raiz} no se agrega, un equipo está procesando {en_curso[0]}")
+                    continue
+                reemplazadas.extend(activas[h][0] for h in hijas)
+                nuevas.append((self.nombre, raiz, config_id, ESTADO_PENDIENTE))
+            for id_ in reemplazadas:
+                if s.ejecutar(f"DELETE FROM {TABLA_COLA} WHERE ID = ? AND ESTADO = ?",
+                              (id_, ESTADO_PENDIENTE)).rowcount != 1:
+                    # Otro equipo la tomó entre la lectura y el borrado: se deshace todo
+                    raise Exception("La cola cambió mientras se agregaban carpetas; vuelve a intentarlo")
+            s.ejecutar_lote(f"INSERT INTO {TABLA_COLA} (COLA, CARPETA, CONFIG_ID, ESTADO, INTENTOS, ALTA) "
+                            f"VALUES (?, ?, ?, ?, 0, {s.motor.SQL_AHORA})", nuevas)
+            return len(nuevas)
+        return self._transaccion(agregar)
+
+    def tomar(self):
+        """Reserva la siguiente carpeta disponible; None si no hay ninguna por ahora"""
+        while True:
+            candidatas = self._transaccion(lambda s: s.ejecutar(s.motor.primeras_filas(
+                f"SELECT ID, CARPETA, CONFIG_ID, INTENTOS FROM {TABLA_COLA} "
+                f"WHERE COLA = ? AND {self._disponible(s.motor)} ORDER BY ID", CANDIDATAS),
+                (self.nombre,)).fetchall())
+            if not candidatas:
+                return None
+            # En orden distinto en cada equipo, para no pelear todos por la primera
+            random.shuffle(candidatas)
+            for id_, carpeta, config_id, intentos in candidatas:
+                tarea = self._reservar(TareaCola(id_, carpeta, config_id, intentos or 0))
+                if tarea is not None:
+                    return tarea
+
+    def _reservar(self, tarea):
+        def reservar(s):
+            if tarea.intentos >= MAX_INTENTOS:
+                # Ya se venció varias veces: probablemente tumba al equipo que la procesa
+                s.ejecutar(f"UPDATE {TABLA_COLA} SET ESTADO = ?, DETALLE = ? "
+                           f"WHERE ID = ? AND {self._disponible(s.motor)}",
+                           (ESTADO_ERROR, f"Abandonada tras {tarea.intentos} reservas vencidas", tarea.id))
+                return False
+            cur = s.ejecutar(f"UPDATE {TABLA_COLA} SET ESTADO = ?, TRABAJADOR = ?, "
+                             f"VENCE = {s.motor.SQL_AHORA_MAS_SEGUNDOS}, INTENTOS = INTENTOS + 1 "
+                             f"WHERE ID = ? AND {self._disponible(s.motor)}",
+                             (ESTADO_EN_CURSO, self.trabajador, int(self.duracion), tarea.id))
+            return cur.rowcount == 1
+        try:
+            if not self._transaccion(reservar):
+                return None
+        except Exception as e:
+            # Firebird rechaza la actualización si otro equipo tocó la fila a la vez
+            print(f"Cola {self.nombre}: carpeta {tarea.carpeta} tomada por otro equipo ({str(e).splitlines()[0]})")
+            return None
+        tarea.intentos += 1
+        with self._lock:
+            self._en_curso[tarea.id] = tarea
+        self._iniciar_latidos()
+        return tarea
+
+    def terminar(self, tarea, error=None):
+        """Marca la carpeta hecha (o en error). False si la reserva ya no era de este equipo"""
+        with self._lock:
+            self._en_curso.pop(tarea.id, None)
+        estado = ESTADO_ERROR if error else ESTADO_HECHO
+        detalle = str(error)[:1000] if error else None
+        cur = self._transaccion(lambda s: s.ejecutar(
+            f"UPDATE {TABLA_COLA} SET ESTADO = ?, FIN = {s.motor.SQL_AHORA}, DETALLE = ?, VENCE = NULL "
+            f"WHERE ID = ? AND TRABAJADOR = ? AND ESTADO = ?",
+            (estado, detalle, tarea.id, self.trabajador, ESTADO_EN_CURSO)).rowcount)
+        return cur == 1
+
+    def liberar(self, tarea):
+        """Devuelve la carpeta a pendiente sin contar el intento (se canceló)"""
+        with self._lock:
+            self._en_curso.pop(tarea.id, None)
+        self._transaccion(lambda s: s.ejecutar(
+            f"UPDATE {TABLA_COLA} SET ESTADO = ?, TRABAJADOR = NULL, VENCE = NULL, INTENTOS = INTENTOS - 1 "
+            f"WHERE ID = ? AND TRABAJADOR = ? AND ESTADO = ?",
+            (ESTADO_PENDIENTE, tarea.id, self.trabajador, ESTADO_EN_CURSO)))
+
+    def resumen(self):
+        """{estado: cantidad} de la cola"""
+        filas = self._transaccion(lambda s: s.ejecutar(
+            f"SELECT ESTADO, COUNT(*) FROM {TABLA_COLA} WHERE COLA = ? GROUP BY ESTADO", (self.nombre,)).fetchall())
+        return {estado: n for estado, n in filas}
+
+    def vigente(self, tarea):
+        """False si la reserva venció y la carpeta pasó a otro equipo"""
+        return tarea.id not in self.perdidas
+
+    # --- Latidos ---
+    def _iniciar_latidos(self):
+        if self._hilo_latidos is None:
+            self._hilo_latidos = threading.Thread(target=self._latidos, name=f"latidos-{self.nombre}", daemon=True)
+            self._hilo_latidos.start()
+
+    def _latidos(self):
+        sentencias = None
+        while not self._parar.wait(self.intervalo_latido):
+            with self._lock:
+                ids = list(self._en_curso)
+            if not ids:
+                continue
+            try:
+                if sentencias is None:
+                    sentencias = DatabaseManager().conexion_aparte()
+                for id_ in ids:
+                    cur = sentencias.ejecutar(
+                        f"UPDATE {TABLA_COLA} SET VENCE = {sentencias.motor.SQL_AHORA_MAS_SEGUNDOS} "
+                        f"WHERE ID = ? AND TRABAJADOR = ? AND ESTADO = ?",
+                        (int(self.duracion), id_, self.trabajador, ESTADO_EN_CURSO))
+                    if cur.rowcount != 1:
+                        self.perdidas.add(id_)
+                sentencias.conexion.commit()
+            except Exception as e:
+                # Sin latidos la reserva vence sola; se reintenta en el siguiente
+                print(f"Cola {self.nombre}: no se pudo renovar la reserva: {str(e).splitlines()[0]}")
+                if sentencias is not None:
+                    sentencias.cerrar(cerrar_conexion=True)
+                    sentencias = None
+        if sentencias is not None:
+            sentencias.cerrar(cerrar_conexion=True)
+
+    def cerrar(self):
+        """Detiene los latidos, devuelve lo reservado y cierra las conexiones"""
+        self._parar.set()
+        if self._hilo_latidos is not None:
+            self._hilo_latidos.join(timeout=5)
+        with self._lock:
+            pendientes = list(self._en_curso.values())
+        for tarea in pendientes:
+            try:
+                self.liberar(tarea)
+            except Exception as e:
+                print(f"Cola {self.nombre}: no se pudo liberar {tarea.carpeta}: {e}")
+        if self._sentencias is not None:
+            self._sentencias.cerrar(cerrar_conexion=True)
+            self._sentencias = None
+
+
+def procesar_cola(cola, opciones_para, progreso=None, esperar_ajenas=True, espera=ESPERA_COLA):
+    """Procesa carpetas de la cola hasta que no quede ninguna.
+
+    opciones_para(tarea) da las OpcionesProcesamiento de cada carpeta (la
+    configuración viaja en la cola). Con esperar_ajenas, si solo quedan
+    carpetas en curso en otros equipos se sigue consultando: si alguno se
+    cae, su carpeta se retoma al vencer la reserva. progreso(hechas, total)
+    cuenta toda la cola. Devuelve el ResultadoProcesamiento de lo que
+    procesó este equipo.
+    """
+    total = ResultadoProcesamiento()
+    ejecutor = None
+
+    def avisar():
+        if progreso:
+            estado = cola.resumen()
+            progreso(estado.get(ESTADO_HECHO, 0) + estado.get(ESTADO_ERROR, 0), sum(estado.values()))
+            return estado
+        return None
+
+    try:
+        while True:
+            tarea = cola.tomar()
+            if tarea is None:
+                estado = avisar() or cola.resumen()
+                if esperar_ajenas and estado.get(ESTADO_EN_CURSO):
+                    time.sleep(espera)
+                    continue
+                break
+            avisar()
+            print(f"Cola {cola.nombre}: procesando {tarea.carpeta} (intento {tarea.intentos})")
+            try:
+                opciones = opciones_para(tarea)
+                if ejecutor is None:
+                    ejecutor = EjecutorRenombrado(presupuesto=opciones.presupuesto)
+                parcial = procesar_carpetas([tarea.carpeta], opciones, ejecutor=ejecutor)
+            except Exception as e:
+                total.errores.append(f"Error procesando {tarea.carpeta} desde la cola: {e}")
+                cola.terminar(tarea, error=e)
+                continue
+            total.sumar(parcial)
+            error = parcial.errores[0] if parcial.errores and not parcial.carpetas_procesadas else None
+            if not cola.terminar(tarea, error=error) or not cola.vigente(tarea):
+                total.errores.append(f"La reserva de {tarea.carpeta} venció mientras se procesaba; "
+                                     "otro equipo pudo procesarla a la vez")
+    finally:
+        if ejecutor is not None:
+            ejecutor.cerrar()
+            total.llamadas_fs = ejecutor.resumen()
+    return total
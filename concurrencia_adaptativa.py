@@ -0,0 +1,163 @@
+# concurrencia_adaptativa.py
+import threading
+import time
+
+# Calibración: en los primeros segundos se duplica el límite mientras el
+# rendimiento mejore; después se corrige de a poco según la latencia
+SEGUNDOS_CALIBRACION = 5.0
+SEGUNDOS_VENTANA = 0.5
+MIN_OPERACIONES_VENTANA = 8
+MEJORA_MINIMA = 1.10          # +10% de rendimiento para seguir subiendo
+FACTOR_CONGESTION = 2.0       # latencia > 2x la base: el recurso está saturado
+FACTOR_ESTABLE = 1.3          # latencia < 1.3x la base: hay margen para +1
+FACTOR_REDUCCION = 0.75
+DERIVA_BASE = 0.05
+
+
+class ControlConcurrencia:
+    """Límite de operaciones simultáneas que se ajusta solo.
+
+    Cada operación informa su duración con medir(). Por ventanas de
+    SEGUNDOS_VENTANA se calcula el rendimiento (operaciones/s) y la
+    latencia relativa a la mejor observada para ese tipo de operación:
+
+    - calibración (primeros SEGUNDOS_CALIBRACION): el límite se duplica
+      mientras el rendimiento suba al menos un 10%; si deja de subir se
+      vuelve al mejor valor visto y termina la calibración;
+    - después: si la latencia pasa de FACTOR_CONGESTION veces la base se
+      reduce un 25% (disco o NAS saturado); si está cerca de la base y hubo
+      operaciones esperando turno, se sube de a uno.
+
+    Cada cambio queda en historial con su motivo. Se puede usar desde
+    varios hilos (adquirir/liberar) o desde asyncio (hay_cupo/entrar/salir
+    bajo una asyncio.Condition propia).
+    """
+
+    def __init__(self, nombre, inicial, minimo=1, maximo=64, adaptativo=True, reloj=time.monotonic):
+        self.nombre = nombre
+        self.minimo = minimo
+        self.maximo = maximo
+        self.limite = max(minimo, min(maximo, inicial))
+        self.adaptativo = adaptativo
+        self.historial = []
+        self._reloj = reloj
+        self._inicio = None
+        self._calibrando = adaptativo
+        self._mejor = (0.0, self.limite)   # (rendimiento, límite) durante la calibración
+        self._base = {}                    # tipo -> mejor latencia media por ventana
+        self._en_curso = 0
+        self._saturado = False
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._nueva_ventana(None)
+        if adaptativo:
+            self._anotar(f"inicio con {self.limite} (mín {minimo}, máx {maximo})")
+
+    # --- Cupo ---
+    def hay_cupo(self):
+        if self._en_curso < self.limite:
+            return True
+        self._saturado = True
+        return False
+
+    def entrar(self):
+        self._en_curso += 1
+
+    def salir(self):
+        self._en_curso -= 1
+
+    def adquirir(self):
+        with self._cond:
+            self._cond.wait_for(self.hay_cupo)
+            self.entrar()
+
+    def liberar(self):
+        with self._cond:
+            self.salir()
+            self._cond.notify()
+
+    @property
+    def disponibles(self):
+        return max(0, self.limite - self._en_curso)
+
+    # --- Medición ---
+    def _nueva_ventana(self, ahora):
+        self._ventana_inicio = ahora
+        self._ventana = {}   # tipo -> [operaciones, segundos]
+        self._ventana_ops = 0
+        self._saturado = False
+
+    def medir(self, duracion, tipo='', operaciones=1):
+        """Registra una operación terminada (o un lote de operaciones)"""
+        if not self.adaptativo:
+            return
+        with self._cond:
+            ahora = self._reloj()
+            if self._inicio is None:
+                self._inicio = ahora
+            if self._ventana_inicio is None:
+                self._ventana_inicio = ahora - duracion
+            datos = self._ventana.setdefault(tipo, [0, 0.0])
+            datos[0] += operaciones
+            datos[1] += duracion
+            self._ventana_ops += operaciones
+            transcurrido = ahora - self._ventana_inicio
+            if transcurrido >= SEGUNDOS_VENTANA and self._ventana_ops >= MIN_OPERACIONES_VENTANA:
+                anterior = self.limite
+                self._evaluar(ahora, transcurrido)
+                if self.limite > anterior:
+                    self._cond.notify_all()
+                self._nueva_ventana(ahora)
+
+    def _evaluar(self, ahora, transcurrido):
+        rendimiento = self._ventana_ops / transcurrido
+        relativas = []
+        for tipo, (n, segundos) in self._ventana.items():
+            media = segundos / n
+            base = self._base.get(tipo)
+            if base is None or media < base:
+                self._base[tipo] = base = media
+            elif not self._saturado:
+                # Sin cola propia la base sube despacio: archivos más grandes no son congestión
+                self._base[tipo] = base + (media - base) * DERIVA_BASE
+            relativas.append((media / base if base > 0 else 1.0, n))
+        latencia = sum(r * n for r, n in relativas) / sum(n for _, n in relativas)
+        latencia_ms = sum(s for _, s in self._ventana.values()) / self._ventana_ops * 1000
+
+        if self._calibrando:
+            mejor_rendimiento = self._mejor[0]
+            if rendimiento >= mejor_rendimiento * MEJORA_MINIMA and self.limite < self.maximo:
+                self._mejor = (rendimiento, self.limite)
+                self._cambiar(min(self.maximo, self.limite * 2),
+                              f"calibración: {rendimiento:.0f} op/s ({latencia_ms:.2f} ms/op), sigue mejorando")
+            else:
+                # Sin mejora clara se vuelve al último límite que sí mejoró:
+                # el mismo rendimiento con más operaciones solo alarga la cola
+                self._calibrando = False
+                self._cambiar(self._mejor[1],
+                              f"calibración terminada: mejor {self._mejor[0]:.0f} op/s "
+                              f"(ahora {rendimiento:.0f} op/s, {latencia_ms:.2f} ms/op)", anotar_siempre=True)
+            if self._calibrando and ahora - self._inicio >= SEGUNDOS_CALIBRACION:
+                self._calibrando = False
+                self._anotar(f"calibración terminada por tiempo con {self.limite}")
+            return
+
+        if latencia > FACTOR_CONGESTION:
+            self._cambiar(max(self.minimo, int(self.limite * FACTOR_REDUCCION)),
+                          f"latencia {latencia:.1f}x la base ({latencia_ms:.2f} ms/op): recurso saturado")
+        elif latencia < FACTOR_ESTABLE and self._saturado and self.limite < self.maximo:
+            self._cambiar(self.limite + 1,
+                          f"latencia estable ({latencia:.1f}x la base) y operaciones en espera")
+
+    def _cambiar(self, nuevo, motivo, anotar_siempre=False):
+        if nuevo == self.limite:
+            if anotar_siempre:
+                self._anotar(f"se mantiene en {self.limite}: {motivo}")
+            return
+        self._anotar(f"{self.limite} -> {nuevo}: {motivo}")
+        self.limite = nuevo
+
+    def _anotar(self, texto):
+        linea = f"[{self.nombre}] {texto}"
+        self.historial.append(linea)
+        print(f"  - Concurrencia {linea}")
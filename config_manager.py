@@ -5,7 +5,7 @@ from database_manager import DatabaseManager
 
 TABLA_SQL = """
 CREATE TABLE CONFIGURACIONES_NOMBRE_ARCHIVOS (
-    ID INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    ID {identidad},
     NOMBRE_CONFIG VARCHAR(100) NOT NULL,
     FORMATO_XML VARCHAR(255),
     FORMATO_PDF VARCHAR(255),
@@ -21,189 +21,187 @@ CREATE_INDEX_UNIQUE = """
 CREATE UNIQUE INDEX UX_CONFIG_NOMBRE ON CONFIGURACIONES_NOMBRE_ARCHIVOS (NOMBRE_CONFIG)
 """
 
+TABLA = 'CONFIGURACIONES_NOMBRE_ARCHIVOS'
+
+# (columna SQL, clave del dict, conversión) en el orden del SELECT
+COL_ID = ('ID', 'id', None)
+COL_NOMBRE = ('NOMBRE_CONFIG', 'nombre', None)
+COL_FORMATOS = (('FORMATO_XML', 'formato_xml', None), ('FORMATO_PDF', 'formato_pdf', None),
+                ('FORMATO_CUV', 'formato_cuv', None), ('FORMATO_JSON', 'formato_json', None))
+COL_ACTIVA = ('ACTIVA', 'activa', bool)
+COL_FECHAS = (('FECHA_CREACION', 'fecha_creacion', None), ('FECHA_ACTUALIZACION', 'fecha_actualizacion', None))
+
+COLUMNAS_LISTA = (COL_ID, COL_NOMBRE) + COL_FORMATOS + (COL_ACTIVA,) + COL_FECHAS
+COLUMNAS_CONFIG = (COL_ID, COL_NOMBRE) + COL_FORMATOS + (COL_ACTIVA,)
+COLUMNAS_ACTIVA = (COL_ID, COL_NOMBRE) + COL_FORMATOS
+
+
+def _select(columnas, resto):
+    return f"SELECT {', '.join(c[0] for c in columnas)} FROM {TABLA} {resto}"
+
+
+SQL_LISTA = _select(COLUMNAS_LISTA, "ORDER BY ID")
+SQL_POR_ID = _select(COLUMNAS_CONFIG, "WHERE ID = ?")
+SQL_ACTIVA = _select(COLUMNAS_ACTIVA, "WHERE ACTIVA = 1")
+
+
+def _a_dict(fila, columnas):
+    """Fila del SELECT -> dict con las claves de columnas"""
+    return {clave: (convertir(valor) if convertir else valor)
+            for (_, clave, convertir), valor in zip(columnas, fila)}
+
+
+def _sentencias():
+    """Sentencias preparadas de la conexión, con la tabla ya verificada.
+
+    La consulta al catálogo se hace una vez por conexión, no en cada
+    llamada.
+    """
+    sentencias = DatabaseManager().sentencias()
+    if TABLA not in sentencias.verificadas:
+        ensure_table_exists()
+    return sentencias
+
+
+def _leer(sql, columnas, params=(), uno=False):
+    db = DatabaseManager()
+    try:
+        cur = _sentencias().ejecutar(sql, params)
+        if uno:
+            fila = cur.fetchone()
+            return _a_dict(fila, columnas) if fila else None
+        return [_a_dict(fila, columnas) for fila in cur.fetchall()]
+    except Exception as e:
+        db.registrar_falla_consulta(e)
+        raise
+
+
+def _escribir(sentencias_sql):
+    """Ejecuta [(sql, params), ...] en una transacción"""
+    db = DatabaseManager()
+    sentencias = _sentencias()
+    try:
+        for sql, params in sentencias_sql:
+            sentencias.ejecutar(sql, params)
+        sentencias.conexion.commit()
+        return True
+    except Exception as e:
+        # Con la conexión caída no hay nada que deshacer: se descarta
+        if not db.registrar_falla_consulta(e):
+            sentencias.conexion.rollback()
+        raise
+
+
 def ensure_table_exists():
     db = DatabaseManager()
-    conn = None
-    cur = None
     try:
-        conn = db.get_connection()
-        cur = conn.cursor()
-        # Consulta adaptada para Firebird
-        cur.execute("SELECT COUNT(*) FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = 'CONFIGURACIONES_NOMBRE_ARCHIVOS'")
+        sentencias = db.sentencias()
+        conn = sentencias.conexion
+        # Consulta del catálogo según el motor (RDB$RELATIONS en Firebird)
+        cur = sentencias.ejecutar(sentencias.motor.SQL_TABLA_EXISTE, (TABLA,))
         if cur.fetchone()[0] == 0:
-            cur.execute(TABLA_SQL)
+            sentencias.ejecutar_directo(TABLA_SQL.format(identidad=sentencias.motor.COLUMNA_IDENTIDAD))
             try:
-                cur.execute(CREATE_INDEX_UNIQUE)
+                sentencias.ejecutar_directo(CREATE_INDEX_UNIQUE)
             except Exception:
                 # Ignorar si el índice ya existe
                 pass
             conn.commit()
+        sentencias.verificadas.add(TABLA)
     except Exception as e:
+        db.registrar_falla_consulta(e)
         raise
-    finally:
-        if cur:
-            cur.close()
 
 def create_config(nombre, formato_xml=None, formato_pdf=None, formato_cuv=None, formato_json=None, activar=False):
-    ensure_table_exists()
-    db = DatabaseManager()
-    conn = db.get_connection()
-    cur = None
-    try:
-        cur = conn.cursor()
-        now = datetime.datetime.now()
-        cur.execute("""
-            INSERT INTO CONFIGURACIONES_NOMBRE_ARCHIVOS
+    now = datetime.datetime.now()
+    sql = [(f"""
+            INSERT INTO {TABLA}
             (NOMBRE_CONFIG, FORMATO_XML, FORMATO_PDF, FORMATO_CUV, FORMATO_JSON, ACTIVA, FECHA_CREACION, FECHA_ACTUALIZACION)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (nombre, formato_xml, formato_pdf, formato_cuv, formato_json, 1 if activar else 0, now, now))
-        
-        if activar:
-            cur.execute("UPDATE CONFIGURACIONES_NOMBRE_ARCHIVOS SET ACTIVA = 0 WHERE NOMBRE_CONFIG <> ?", (nombre,))
-        
-        conn.commit()
-        return True
-    except Exception as e:
-        conn.rollback()
-        raise
-    finally:
-        if cur:
-            cur.close()
+        """, (nombre, formato_xml, formato_pdf, formato_cuv, formato_json, 1 if activar else 0, now, now))]
+    if activar:
+        sql.append((f"UPDATE {TABLA} SET ACTIVA = 0 WHERE NOMBRE_CONFIG <> ?", (nombre,)))
+    return _escribir(sql)
 
 def update_config(id_, nombre=None, formato_xml=None, formato_pdf=None, formato_cuv=None, formato_json=None, activar=None):
-    ensure_table_exists()
-    db = DatabaseManager()
-    conn = db.get_connection()
-    cur = None
-    try:
-        cur = conn.cursor()
-        now = datetime.datetime.now()
-        # construir update dinámico
-        updates = []
-        params = []
-        if nombre is not None:
-            updates.append("NOMBRE_CONFIG = ?"); params.append(nombre)
-        if formato_xml is not None:
-            updates.append("FORMATO_XML = ?"); params.append(formato_xml)
-        if formato_pdf is not None:
-            updates.append("FORMATO_PDF = ?"); params.append(formato_pdf)
-        if formato_cuv is not None:
-            updates.append("FORMATO_CUV = ?"); params.append(formato_cuv)
-        if formato_json is not None:
-            updates.append("FORMATO_JSON = ?"); params.append(formato_json)
-        updates.append("FECHA_ACTUALIZACION = ?"); params.append(now)
-        if updates:
-            sql = "UPDATE CONFIGURACIONES_NOMBRE_ARCHIVOS SET " + ", ".join(updates) + " WHERE ID = ?"
-            params.append(id_)
-            cur.execute(sql, params)
-        if activar is True:
-            cur.execute("UPDATE CONFIGURACIONES_NOMBRE_ARCHIVOS SET ACTIVA = 0 WHERE ID <> ?", (id_,))
-            cur.execute("UPDATE CONFIGURACIONES_NOMBRE_ARCHIVOS SET ACTIVA = 1 WHERE ID = ?", (id_,))
-        elif activar is False:
-            cur.execute("UPDATE CONFIGURACIONES_NOMBRE_ARCHIVOS SET ACTIVA = 0 WHERE ID = ?", (id_,))
-        conn.commit()
-        return True
-    except Exception as e:
-        conn.rollback()
-        raise
-    finally:
-        if cur:
-            cur.close()
+    now = datetime.datetime.now()
+    # construir update dinámico (cada combinación de campos se prepara una vez)
+    updates = []
+    params = []
+    if nombre is not None:
+        updates.append("NOMBRE_CONFIG = ?"); params.append(nombre)
+    if formato_xml is not None:
+        updates.append("FORMATO_XML = ?"); params.append(formato_xml)
+    if formato_pdf is not None:
+        updates.append("FORMATO_PDF = ?"); params.append(formato_pdf)
+    if formato_cuv is not None:
+        updates.append("FORMATO_CUV = ?"); params.append(formato_cuv)
+    if formato_json is not None:
+        updates.append("FORMATO_JSON = ?"); params.append(formato_json)
+    updates.append("FECHA_ACTUALIZACION = ?"); params.append(now)
+    params.append(id_)
+    sql = [(f"UPDATE {TABLA} SET " + ", ".join(updates) + " WHERE ID = ?", tuple(params))]
+    if activar is True:
+        sql.append((f"UPDATE {TABLA} SET ACTIVA = 0 WHERE ID <> ?", (id_,)))
+        sql.append((f"UPDATE {TABLA} SET ACTIVA = 1 WHERE ID = ?", (id_,)))
+    elif activar is False:
+        sql.append((f"UPDATE {TABLA} SET ACTIVA = 0 WHERE ID = ?", (id_,)))
+    return _escribir(sql)
 
 def delete_config(id_):
-    ensure_table_exists()
-    db = DatabaseManager()
-    conn = db.get_connection()
-    cur = None
-    try:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM CONFIGURACIONES_NOMBRE_ARCHIVOS WHERE ID = ?", (id_,))
-        conn.commit()
-        return True
-    except Exception as e:
-        conn.rollback()
-        raise
-    finally:
-        if cur:
-            cur.close()
+    return _escribir([(f"DELETE FROM {TABLA} WHERE ID = ?", (id_,))])
 
 def list_configs():
-    ensure_table_exists()
-    db = DatabaseManager()
-    conn = db.get_connection()
-    cur = None
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT ID, NOMBRE_CONFIG, FORMATO_XML, FORMATO_PDF, FORMATO_CUV, FORMATO_JSON, ACTIVA, FECHA_CREACION, FECHA_ACTUALIZACION FROM CONFIGURACIONES_NOMBRE_ARCHIVOS ORDER BY ID")
-        rows = cur.fetchall()
-        # mapear a dicts
-        results = []
-        for r in rows:
-            results.append({
-                'id': r[0],
-                'nombre': r[1],
-                'formato_xml': r[2],
-                'formato_pdf': r[3],
-                'formato_cuv': r[4],
-                'formato_json': r[5],
-                'activa': bool(r[6]),
-                'fecha_creacion': r[7],
-                'fecha_actualizacion': r[8]
-            })
-        return results
-    except Exception as e:
-        raise
-    finally:
-        if cur:
-            cur.close()
+    return _leer(SQL_LISTA, COLUMNAS_LISTA)
 
 def get_config_by_id(id_):
-    ensure_table_exists()
-    db = DatabaseManager()
-    conn = db.get_connection()
-    cur = None
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT ID, NOMBRE_CONFIG, FORMATO_XML, FORMATO_PDF, FORMATO_CUV, FORMATO_JSON, ACTIVA FROM CONFIGURACIONES_NOMBRE_ARCHIVOS WHERE ID = ?", (id_,))
-        r = cur.fetchone()
-        if r:
-            return {
-                'id': r[0],
-                'nombre': r[1],
-                'formato_xml': r[2],
-                'formato_pdf': r[3],
-                'formato_cuv': r[4],
-                'formato_json': r[5],
-                'activa': bool(r[6])
-            }
-        return None
-    except Exception as e:
-        raise
-    finally:
-        if cur:
-            cur.close()
+    return _leer(SQL_POR_ID, COLUMNAS_CONFIG, (id_,), uno=True)
 
 def get_active_config():
-    ensure_table_exists()
+    return _leer(SQL_ACTIVA, COLUMNAS_ACTIVA, uno=True)
+
+def importar_configs(configs, actualizar_existentes=True):
+    """Crea (o actualiza, por nombre) muchas configuraciones en una sola transacción.
+
+    configs son dicts con nombre, formato_xml, formato_pdf, formato_cuv,
+    formato_json y activa, ya validados (ver intercambio_configs). Cada
+    sentencia se prepara una vez para todo el lote; si algo falla no queda
+    nada a medias. Devuelve {'insertadas', 'actualizadas', 'omitidas'}.
+    """
     db = DatabaseManager()
-    conn = db.get_connection()
-    cur = None
+    sentencias = _sentencias()
+    now = datetime.datetime.now()
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT ID, NOMBRE_CONFIG, FORMATO_XML, FORMATO_PDF, FORMATO_CUV, FORMATO_JSON FROM CONFIGURACIONES_NOMBRE_ARCHIVOS WHERE ACTIVA = 1")
-        r = cur.fetchone()
-        if r:
-            return {
-                'id': r[0],
-                'nombre': r[1],
-                'formato_xml': r[2],
-                'formato_pdf': r[3],
-                'formato_cuv': r[4],
-                'formato_json': r[5]
-            }
-        return None
+        existentes = {fila[1]: fila[0] for fila in sentencias.ejecutar(f"SELECT ID, NOMBRE_CONFIG FROM {TABLA}").fetchall()}
+        nuevas, actualizar, omitidas = [], [], 0
+        for c in configs:
+            formatos = tuple(c.get(clave) or None for _, clave, _ in COL_FORMATOS)
+            if c['nombre'] not in existentes:
+                nuevas.append((c['nombre'],) + formatos + (0, now, now))
+            elif actualizar_existentes:
+                actualizar.append(formatos + (now, existentes[c['nombre']]))
+            else:
+                omitidas += 1
+
+        sentencias.ejecutar_lote(f"""
+            INSERT INTO {TABLA}
+            (NOMBRE_CONFIG, FORMATO_XML, FORMATO_PDF, FORMATO_CUV, FORMATO_JSON, ACTIVA, FECHA_CREACION, FECHA_ACTUALIZACION)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, nuevas)
+        sentencias.ejecutar_lote(f"""
+            UPDATE {TABLA} SET FORMATO_XML = ?, FORMATO_PDF = ?, FORMATO_CUV = ?, FORMATO_JSON = ?,
+            FECHA_ACTUALIZACION = ? WHERE ID = ?
+        """, actualizar)
+
+        # La activa del archivo pasa a ser la única activa (si se importó)
+        activa = next((c['nombre'] for c in configs if c.get('activa')), None)
+        if activa is not None and (activa not in existentes or actualizar_existentes):
+            sentencias.ejecutar(f"UPDATE {TABLA} SET ACTIVA = 0 WHERE NOMBRE_CONFIG <> ?", (activa,))
+            sentencias.ejecutar(f"UPDATE {TABLA} SET ACTIVA = 1 WHERE NOMBRE_CONFIG = ?", (activa,))
+        sentencias.conexion.commit()
+        return {'insertadas': len(nuevas), 'actualizadas': len(actualizar), 'omitidas': omitidas}
     except Exception as e:
+        # Con la conexión caída no hay nada que deshacer: se descarta
+        if not db.registrar_falla_consulta(e):
+            sentencias.conexion.rollback()
         raise
-    finally:
-        if cur:
-            cur.close()
\ No newline at end of file
@@ -0,0 +1,163 @@
+# configuracion_offline.py
+import configparser
+import datetime
+import hashlib
+import hmac
+import json
+import os
+
+import config_manager
+import database_manager
+from licencia import get_machine_uuid
+
+ARCHIVO_INSTANTANEA = 'configuracion_offline.json'
+VERSION_INSTANTANEA = 1
+SECCION_INI = 'procesamiento'
+
+# Instantánea en uso cuando se trabaja sin conexión (None: se consulta la BD)
+_instantanea = None
+_clave = None
+
+
+class InstantaneaInvalida(Exception):
+    """El archivo no existe, está dañado, fue modificado o es de otro equipo"""
+
+
+def _clave_firma():
+    """Clave HMAC atada al equipo, como la licencia: una instantánea copiada
+    de otro equipo o editada a mano no se acepta"""
+    global _clave
+    if _clave is None:
+        uuid_equipo = get_machine_uuid() or "UUID_DESCONOCIDO"
+        _clave = hashlib.sha256(f"INSTANTANEA_SERAF_{uuid_equipo}".encode()).digest()
+    return _clave
+
+
+def _firmar(datos):
+    contenido = json.dumps(datos, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hmac.new(_clave_firma(), contenido.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _serializable(valor):
+    return valor.isoformat() if isinstance(valor, (datetime.date, datetime.datetime)) else valor
+
+
+class InstantaneaConfig:
+    """Configuraciones de nombres y datos IPS guardados para trabajar sin BD"""
+
+    def __init__(self, configs, datos_ips, generada):
+        self.configs = configs
+        self.datos_ips = datos_ips
+        self.generada = generada
+
+    def fecha_texto(self):
+        try:
+            return datetime.datetime.fromisoformat(self.generada).strftime('%d/%m/%Y %H:%M')
+        except ValueError:
+            return self.generada
+
+    # Mismas respuestas que config_manager / database_manager
+    def list_configs(self):
+        return [dict(c) for c in self.configs]
+
+    def get_config_by_id(self, id_):
+        for c in self.configs:
+            if c['id'] == id_:
+                return dict(c)
+        return None
+
+    def obtener_datos_ips(self):
+        return dict(self.datos_ips)
+
+
+def guardar_instantanea(configs, datos_ips, ruta=ARCHIVO_INSTANTANEA):
+    """Escribe la instantánea firmada (reemplazo atómico: nunca queda a medias)"""
+    datos = {
+        'version': VERSION_INSTANTANEA,
+        'generada': datetime.datetime.now().isoformat(timespec='seconds'),
+        'configs': [{k: _serializable(v) for k, v in c.items()} for c in configs],
+        'datos_ips': dict(datos_ips),
+    }
+    datos['firma'] = _firmar(datos)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+    return InstantaneaConfig(datos['configs'], datos['datos_ips'], datos['generada'])
+
+
+def leer_instantanea(ruta=ARCHIVO_INSTANTANEA):
+    if not os.path.exists(ruta):
+        raise InstantaneaInvalida(f"No hay configuración guardada para trabajar sin conexión ({ruta})")
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+    except (OSError, ValueError) as e:
+        raise InstantaneaInvalida(f"No se pudo leer {ruta}: {e}")
+    firma = datos.pop('firma', None) if isinstance(datos, dict) else None
+    if not firma or not hmac.compare_digest(firma, _firmar(datos)):
+        raise InstantaneaInvalida(f"La configuración guardada en {ruta} fue alterada o es de otro equipo")
+    if datos.get('version') != VERSION_INSTANTANEA:
+        raise InstantaneaInvalida(f"Versión de {ruta} no soportada: {datos.get('version')}")
+    return InstantaneaConfig(datos['configs'], datos['datos_ips'], datos['generada'])
+
+
+def instantanea_disponible(ruta=ARCHIVO_INSTANTANEA):
+    """La instantánea válida, o None (con el motivo en consola)"""
+    try:
+        return leer_instantanea(ruta)
+    except InstantaneaInvalida as e:
+        print(f"Sin instantánea offline: {e}")
+        return None
+
+
+def offline_forzado(ruta='database.ini'):
+    """True si database.ini pide arrancar sin conexión ([procesamiento] modo_offline = si)"""
+    if not os.path.exists(ruta):
+        return False
+    config = configparser.ConfigParser()
+    config.read(ruta)
+    if SECCION_INI not in config:
+        return False
+    valor = config[SECCION_INI].get('modo_offline', '').strip().lower()
+    return valor in ('si', 'sí', 'true', '1', 'yes')
+
+
+# -------------------------
+# Modo offline
+# -------------------------
+def activar_modo_offline(instantanea):
+    global _instantanea
+    _instantanea = instantanea
+    print(f"Trabajando sin conexión con la configuración guardada el {instantanea.fecha_texto()}")
+
+
+def modo_offline():
+    """InstantaneaConfig en uso, o None si se trabaja con la BD"""
+    return _instantanea
+
+
+# Lecturas que usa la interfaz: de la instantánea sin conexión, de la BD con ella
+def list_configs():
+    if _instantanea is not None:
+        return _instantanea.list_configs()
+    return config_manager.list_configs()
+
+
+def get_config_by_id(id_):
+    if _instantanea is not None:
+        return _instantanea.get_config_by_id(id_)
+    return config_manager.get_config_by_id(id_)
+
+
+def obtener_datos_ips():
+    if _instantanea is not None:
+        return _instantanea.obtener_datos_ips()
+    return database_manager.obtener_datos_ips()
+
+
+def leer_datos_ips():
+    """Como obtener_datos_ips, pero None si la BD no dio datos (en vez de los valores por defecto)"""
+    if _instantanea is not None:
+        return _instantanea.obtener_datos_ips()
+    return database_manager.leer_datos_ips()
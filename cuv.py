@@ -2,18 +2,48 @@ import os
 import sys
 import json
 import datetime
+import multiprocessing
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QFileDialog,
     QMessageBox, QLabel, QGroupBox, QHBoxLayout, QListWidget,
     QAbstractItemView, QMainWindow, QAction, QMenu, QStatusBar,
     QFrame, QProgressBar, QCheckBox, QScrollArea, QComboBox, QListWidgetItem,
-    QTabWidget, QFormLayout, QLineEdit, QDialog, QGridLayout
+    QTabWidget, QFormLayout, QLineEdit, QDialog, QGridLayout, QSpinBox, QListView,
+    QTableView, QHeaderView, QInputDialog
 )
 from PyQt5.QtGui import QFont, QIcon, QPalette, QColor
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QAbstractListModel, QAbstractTableModel, QModelIndex
 from PyQt5.QtWidgets import QGraphicsDropShadowEffect
-from database_manager import obtener_datos_ips
-from config_manager import list_configs, create_config, update_config, delete_config, get_active_config, get_config_by_id
+from bd_asincrona import acceso_bd
+from config_manager import create_config, update_config, delete_config, importar_configs
+from intercambio_configs import exportar_configs, leer_configs, ArchivoConfigsInvalido
+from historial_procesamiento import historial_activo, guardar_ejecucion, buscar_factura
+from cola_trabajo import ColaTrabajo, procesar_cola
+# Lecturas de configuración: de la BD o, sin conexión, de la instantánea guardada
+from database_manager import DATOS_IPS_POR_DEFECTO
+from configuracion_offline import (
+    list_configs, get_config_by_id, obtener_datos_ips, leer_datos_ips, modo_offline, activar_modo_offline,
+    guardar_instantanea, instantanea_disponible, offline_forzado
+)
+from procesador_cuv import (
+    extraer_proceso_id, modificar_cuv, buscar_archivos_cuv, CUV_MODIFICADO,
+    MODO_ELIMINAR_RECHAZADOS, MODO_VACIAR
+)
+from respaldo_cuv import RespaldoCUV, restaurar_respaldo
+from presupuesto_io import (
+    PRIORIDAD_NORMAL, PRIORIDAD_SEGUNDO_PLANO, leer_presupuesto_ini, iniciar_segundo_plano, terminar_segundo_plano
+)
+from analitica_cuv import analizar_carpetas
+from recorrido_paralelo import ReglasRecorrido, leer_reglas_ini
+from preescaneo import Preescaneo
+from plantillas_nombre import apply_format, needs_placeholder, validar_formatos
+from identidad_factura import extraer_num_factura_de_nombre
+from motor_procesamiento import (
+    OpcionesProcesamiento, PipelineAsync, procesar_carpetas, buscar_archivos_por_ext,
+    obtener_archivos_asociados, mover_o_escribir_json, previsualizar_plan, COLUMNA_FORMATO,
+    ESTADO_RENOMBRAR, ESTADO_COLISION, ESTADO_ERROR
+)
 
 # -------------------------
 # Licencia (tu implementación sin parámetros)
@@ -32,16 +62,22 @@ except Exception:
 # -------------------------
 _CONFIG_MANAGER_OK = False
 _CONFIG_MANAGER_ERROR_MSG = ""  # <-- nueva variable para almacenar el detalle del error
-try:
-    # Verificar conexión intentando listar configuraciones
-    list_configs()
-    _CONFIG_MANAGER_OK = True
-except Exception as e:
-    _CONFIG_MANAGER_OK = False
-    _CONFIG_MANAGER_ERROR_MSG = str(e)
-    # imprimir en consola para depuración; NO mostrar QMessageBox aquí (aún no hay QApplication seguro)
-    print(f"Error de conexión a BD: {_CONFIG_MANAGER_ERROR_MSG}")
-    # No hacer sys.exit aquí para permitir que main() maneje la alerta cuando la UI exista
+if __name__ == "__main__":
+    # Los procesos de trabajo del procesamiento por lotes vuelven a ejecutar este
+    # script (como __mp_main__, o como __main__ en el ejecutable de PyInstaller):
+    # freeze_support los atiende y termina aquí, antes de conectar a la BD.
+    multiprocessing.freeze_support()
+    try:
+        # Verificar conexión intentando listar configuraciones (salvo que se pida trabajar sin conexión)
+        if not offline_forzado():
+            list_configs()
+            _CONFIG_MANAGER_OK = True
+    except Exception as e:
+        _CONFIG_MANAGER_OK = False
+        _CONFIG_MANAGER_ERROR_MSG = str(e)
+        # imprimir en consola para depuración; NO mostrar QMessageBox aquí (aún no hay QApplication seguro)
+        print(f"Error de conexión a BD: {_CONFIG_MANAGER_ERROR_MSG}")
+        # No hacer sys.exit aquí para permitir que main() maneje la alerta cuando la UI exista
 
 # -------------------------
 # UI helpers
@@ -87,6 +123,128 @@ class ElegantListWidget(QListWidget):
         self.setDragEnabled(False)
         self.setDragDropMode(QAbstractItemView.DropOnly)
 
+class ElegantListView(QListView):
+    """Igual que ElegantListWidget, para listas con modelo propio"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet("""
+            QListView {
+                background-color: #fbfbfb;
+                border: 1px solid #ddd;
+                border-radius: 6px;
+                padding: 6px;
+                font-family: Segoe UI;
+            }
+            QListView::item { padding: 8px; }
+            QListView::item:selected { background: #e8f4ff; color: #0b63b7; }
+        """)
+        # Todas las filas miden lo mismo: la vista no tiene que medir cada una
+        self.setUniformItemSizes(True)
+        self.setAcceptDrops(True)
+        self.setDragEnabled(False)
+        self.setDragDropMode(QAbstractItemView.DropOnly)
+
+class ModeloCarpetas(QAbstractListModel):
+    """Carpetas seleccionadas, en orden de llegada y sin repetir.
+
+    Conjunto ordenado: la lista guarda el orden y un diccionario ruta -> fila
+    responde en O(1) si una carpeta ya está. agregar() inserta un lote entero
+    con un solo aviso a la vista, así soltar 10.000 carpetas no redibuja
+    10.000 veces. El detalle de cada fila (archivos, CUV detectados, estado)
+    se completa después con lo que informa el preescaneo.
+    """
+    # (carpeta, texto del detalle); se emite desde los hilos del preescaneo
+    # y Qt lo entrega en el hilo de la interfaz
+    detalle_listo = pyqtSignal(str, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._carpetas = []
+        self._filas = {}     # clave -> fila
+        self._detalle = {}   # clave -> texto
+        self.detalle_listo.connect(self.actualizar_detalle)
+
+    @staticmethod
+    def _clave(carpeta):
+        return os.path.normcase(os.path.normpath(carpeta))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._carpetas)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._carpetas):
+            return None
+        carpeta = self._carpetas[index.row()]
+        if role == Qt.DisplayRole:
+            detalle = self._detalle.get(self._clave(carpeta))
+            return f"{carpeta}   —   {detalle}" if detalle else carpeta
+        if role in (Qt.ToolTipRole, Qt.UserRole):
+            return carpeta
+        return None
+
+    def carpetas(self):
+        return list(self._carpetas)
+
+    def __contains__(self, carpeta):
+        return self._clave(carpeta) in self._filas
+
+    def agregar(self, carpetas):
+        """Agrega las carpetas que no estén ya; devuelve las agregadas"""
+        nuevas = []
+        claves = set()
+        for carpeta in carpetas:
+            clave = self._clave(carpeta)
+            if clave in self._filas or clave in claves:
+                continue
+            claves.add(clave)
+            nuevas.append(carpeta)
+        if not nuevas:
+            return []
+        inicio = len(self._carpetas)
+        self.beginInsertRows(QModelIndex(), inicio, inicio + len(nuevas) - 1)
+        for fila, carpeta in enumerate(nuevas, inicio):
+            self._carpetas.append(carpeta)
+            self._filas[self._clave(carpeta)] = fila
+        self.endInsertRows()
+        return nuevas
+
+    def quitar_filas(self, filas):
+        """Quita las filas indicadas; devuelve las carpetas quitadas"""
+        filas = sorted(set(f for f in filas if 0 <= f < len(self._carpetas)), reverse=True)
+        quitadas = []
+        # Tramos contiguos de abajo hacia arriba: las filas de arriba no se mueven
+        i = 0
+        while i < len(filas):
+            fin = inicio = filas[i]
+            i += 1
+            while i < len(filas) and filas[i] == inicio - 1:
+                inicio = filas[i]
+                i += 1
+            self.beginRemoveRows(QModelIndex(), inicio, fin)
+            quitadas.extend(self._carpetas[inicio:fin + 1])
+            del self._carpetas[inicio:fin + 1]
+            self.endRemoveRows()
+        for carpeta in quitadas:
+            self._detalle.pop(self._clave(carpeta), None)
+        self._filas = {self._clave(c): fila for fila, c in enumerate(self._carpetas)}
+        return quitadas
+
+    def limpiar(self):
+        self.beginResetModel()
+        self._carpetas = []
+        self._filas = {}
+        self._detalle = {}
+        self.endResetModel()
+
+    def actualizar_detalle(self, carpeta, texto):
+        clave = self._clave(carpeta)
+        fila = self._filas.get(clave)
+        if fila is None:
+            return  # se quitó mientras se preescaneaba
+        self._detalle[clave] = texto
+        indice = self.index(fila)
+        self.dataChanged.emit(indice, indice)
+
 class DragDropLabel(QLabel):
     def __init__(self, text, parent=None):
         super().__init__(text, parent)
@@ -240,50 +398,206 @@ class CampoConSelector(QWidget):
         self.campo_texto.setText(text)
 
 # -------------------------
-# Formateo seguro
+# Configuración de base de datos (REAL desde BD)
 # -------------------------
-class _SafeDict(dict):
-    def __missing__(self, key):
-        return "{" + key + "}"
-
-def apply_format(format_str, context):
-    if not format_str:
-        return None
-    try:
-        safe = _SafeDict(**context)
-        return format_str.format_map(safe)
-    except Exception:
-        out = format_str
-        for k, v in context.items():
-            out = out.replace("{" + k + "}", v)
-        return out
-
-def needs_placeholder(format_str, placeholder):
-    return ("{" + placeholder + "}") in (format_str or "")
+def _leer_config_y_datos_ips(config_id, datos_ips=None):
+    """Configuración y datos IPS en una sola llamada al hilo de la BD (los
+    datos IPS solo se consultan si no vienen ya leídos)"""
+    return get_config_by_id(config_id), datos_ips if datos_ips is not None else obtener_datos_ips()
+
+def _cargar_configs_y_datos_ips():
+    """Configuraciones y datos IPS para el renombrador. Con conexión renueva
+    además la instantánea para trabajar sin ella, con lo mismo que se leyó
+    (solo si LST_IPS dio datos: los valores por defecto no se guardan como
+    si fueran los de la IPS)"""
+    configs = list_configs()
+    datos_ips = leer_datos_ips()
+    if modo_offline() is None:
+        if datos_ips is None:
+            print("No se renueva la instantánea offline: LST_IPS no devolvió datos")
+        else:
+            try:
+                guardar_instantanea(configs, datos_ips)
+            except Exception as e:
+                print(f"No se pudo guardar la instantánea offline: {e}")
+    return configs, datos_ips if datos_ips is not None else dict(DATOS_IPS_POR_DEFECTO)
 
 # -------------------------
-# Configuración de base de datos (REAL desde BD)
+# Vista previa del plan completo
 # -------------------------
-def obtener_configuracion_db():
+class ModeloPlan(QAbstractTableModel):
+    """Filas del plan (FilaPlan) para un QTableView.
+
+    La vista solo pide las filas visibles, así 100.000 renombrados se
+    muestran sin demora. agregar() inserta cada lote de una vez y marca como
+    colisión los nombres nuevos que se repiten dentro del plan, también en
+    la fila que lo usaba primero, y los archivos que el plan renombra dos
+    veces (la segunda fallaría: el archivo ya no tiene ese nombre).
     """
-    Obtiene la configuración real desde la base de datos.
+    COLUMNAS = ("Tipo", "Nombre actual", "Nombre nuevo", "Carpeta", "Estado")
+    TIPOS = {'cuv': "CUV", 'fact': "Factura", 'xml': "XML", 'pdf': "PDF"}
+    COLORES = {ESTADO_COLISION: QColor('#ffcdd2'), ESTADO_ERROR: QColor('#fff3e0')}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._filas = []
+        self._destinos = {}   # destino normalizado -> fila que lo usa primero
+        self._origenes = {}   # origen normalizado -> fila que lo renombra primero
+        self.colisiones = 0
+        self.errores = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._filas)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNAS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNAS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        fila = self._filas[index.row()]
+        if role == Qt.DisplayRole:
+            columna = index.column()
+            if columna == 0:
+                return self.TIPOS.get(fila.tipo, "")
+            if columna == 1:
+                return os.path.basename(fila.origen)
+            if columna == 2:
+                return os.path.basename(fila.destino)
+            if columna == 3:
+                return os.path.dirname(fila.origen)
+            if fila.estado == ESTADO_RENOMBRAR:
+                return "Renombrar"
+            return f"⚠️ {fila.detalle}" if fila.estado == ESTADO_COLISION else f"❌ {fila.detalle}"
+        if role == Qt.ToolTipRole:
+            return fila.detalle or fila.origen
+        if role == Qt.BackgroundRole:
+            return self.COLORES.get(fila.estado)
+        return None
+
+    @property
+    def renombrados(self):
+        return len(self._filas) - self.errores
+
+    def _marcar(self, fila, detalle):
+        if fila.estado == ESTADO_COLISION:
+            return False
+        fila.estado = ESTADO_COLISION
+        fila.detalle = detalle
+        self.colisiones += 1
+        return True
+
+    def agregar(self, filas):
+        if not filas:
+            return
+        inicio = len(self._filas)
+        anteriores = []
+        self.beginInsertRows(QModelIndex(), inicio, inicio + len(filas) - 1)
+        for n, fila in enumerate(filas, inicio):
+            self._filas.append(fila)
+            if fila.estado == ESTADO_ERROR:
+                self.errores += 1
+                continue
+            if fila.estado == ESTADO_COLISION:
+                self.colisiones += 1
+            previa = self._origenes.setdefault(os.path.normcase(fila.origen), n)
+            if previa != n:
+                self._marcar(fila, f"el archivo ya se renombra en la fila {previa + 1}")
+            previa = self._destinos.setdefault(os.path.normcase(fila.destino), n)
+            if previa != n:
+                self._marcar(fila, f"mismo nombre nuevo que la fila {previa + 1}")
+                if self._marcar(self._filas[previa], f"mismo nombre nuevo que la fila {n + 1}") and previa < inicio:
+                    anteriores.append(previa)
+        self.endInsertRows()
+        for n in anteriores:
+            self.dataChanged.emit(self.index(n, 0), self.index(n, len(self.COLUMNAS) - 1))
+
+
+class DialogoPlanCompleto(QDialog):
+    """Todos los renombrados que haría una configuración sobre carpetas reales.
+
+    El plan se calcula en un hilo (previsualizar_plan, sin tocar disco) y
+    las filas se van agregando por lotes mientras sigue el recorrido.
     """
-    try:
-        return obtener_datos_ips()
-    except Exception as e:
-        QMessageBox.critical(None, "Error de Base de Datos", 
-                           f"No se pudieron obtener los datos de configuración:\n{str(e)}")
-        sys.exit(1)
+    # Se emiten desde el hilo de la vista previa; Qt los entrega en el de la interfaz
+    filas_listas = pyqtSignal(object)
+    terminado = pyqtSignal(object, object)   # (ResultadoProcesamiento, error)
+
+    def __init__(self, carpetas, opciones, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Plan completo de renombrado")
+        self.resize(1000, 600)
+        self.modelo = ModeloPlan(self)
+        self._cancelar = threading.Event()
+
+        layout = QVBoxLayout(self)
+        self.lbl_estado = QLabel("⏳ Recorriendo carpetas...")
+        layout.addWidget(self.lbl_estado)
+        self.tabla = QTableView()
+        self.tabla.setModel(self.modelo)
+        self.tabla.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Alto fijo: la vista no mide cada fila
+        self.tabla.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tabla.verticalHeader().setDefaultSectionSize(22)
+        self.tabla.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.tabla)
+        btn_cerrar = ElegantButton("Cerrar")
+        btn_cerrar.clicked.connect(self.reject)
+        layout.addWidget(btn_cerrar)
+
+        self.filas_listas.connect(self.agregar_filas)
+        self.terminado.connect(self.al_terminar)
+        threading.Thread(target=self._calcular, args=(list(carpetas), opciones), daemon=True).start()
+
+    def _calcular(self, carpetas, opciones):
+        try:
+            resultado = previsualizar_plan(carpetas, opciones, self.filas_listas.emit, self._cancelar)
+        except Exception as e:
+            self.terminado.emit(None, e)
+            return
+        self.terminado.emit(resultado, None)
+
+    def _resumen(self):
+        return (f"{self.modelo.renombrados} renombrados, {self.modelo.colisiones} colisiones, "
+                f"{self.modelo.errores} errores")
+
+    def agregar_filas(self, filas):
+        self.modelo.agregar(filas)
+        self.lbl_estado.setText(f"⏳ {self._resumen()} (recorriendo...)")
+
+    def al_terminar(self, resultado, error):
+        if error is not None:
+            self.lbl_estado.setText(f"❌ Error calculando el plan: {error}")
+            return
+        texto = f"✅ {self._resumen()}; {sum(resultado.ya_correctos.values())} ya tenían el nombre correcto"
+        if resultado.errores:
+            texto += f"; {len(resultado.errores)} avisos"
+            self.lbl_estado.setToolTip("\n".join(resultado.errores))
+        self.lbl_estado.setText(texto)
+
+    def done(self, r):
+        self._cancelar.set()
+        super().done(r)
 
 # -------------------------
 # Widget: Configuración (pestaña) - MEJORADO CON SELECTOR VISUAL
 # -------------------------
 class ConfiguracionWidget(QWidget):
+    # Se guardó, activó o eliminó una configuración (el renombrador recarga su lista)
+    configuraciones_cambiadas = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.pagina = 0
         self.page_size = 12
         self.busqueda_actual = ""
+        self.configs = []  # última lista leída de la BD; el filtro y la paginación trabajan sobre ella
+        self.bd = acceso_bd()
         self.init_ui()
         self.cargar_lista()
 
@@ -357,21 +671,42 @@ class ConfiguracionWidget(QWidget):
         self.btn_activar = ElegantButton("✅ Activar")
         self.btn_eliminar = ElegantButton("🗑️ Eliminar")
         self.btn_preview = ElegantButton("🔍 Previsualizar")
+        self.btn_plan = ElegantButton("📂 Plan en carpeta...")
+        self.btn_plan.setToolTip("Muestra todos los renombrados que haría esta configuración en una carpeta, sin ejecutarlos")
         actions.addWidget(self.btn_guardar); actions.addWidget(self.btn_activar)
         actions.addWidget(self.btn_eliminar); actions.addWidget(self.btn_preview)
+        actions.addWidget(self.btn_plan)
         layout.addLayout(actions)
 
+        intercambio = QHBoxLayout()
+        self.btn_importar = ElegantButton("📥 Importar...")
+        self.btn_importar.setToolTip("Crea o actualiza muchas configuraciones desde un archivo JSON o CSV")
+        self.btn_exportar = ElegantButton("📤 Exportar...")
+        self.btn_exportar.setToolTip("Guarda todas las configuraciones en JSON o CSV para llevarlas a otra sede")
+        intercambio.addStretch()
+        intercambio.addWidget(self.btn_importar); intercambio.addWidget(self.btn_exportar)
+        layout.addLayout(intercambio)
+
         # conexiones
         self.btn_guardar.clicked.connect(self.guardar_config)
         self.btn_activar.clicked.connect(self.activar_config)
         self.btn_eliminar.clicked.connect(self.eliminar_config)
         self.btn_preview.clicked.connect(self.previsualizar)
+        self.btn_plan.clicked.connect(self.previsualizar_en_carpeta)
+        self.btn_importar.clicked.connect(self.importar_configuraciones)
+        self.btn_exportar.clicked.connect(self.exportar_configuraciones)
+
+        # Sin conexión solo se consultan las configuraciones guardadas
+        if modo_offline() is not None:
+            for boton in (self.btn_guardar, self.btn_activar, self.btn_eliminar, self.btn_importar):
+                boton.setEnabled(False)
+                boton.setToolTip("No disponible sin conexión a la base de datos")
 
     def aplicar_filtro_tiempo_real(self):
-        """Aplicar filtro en tiempo real mientras se escribe"""
+        """Aplicar filtro en tiempo real mientras se escribe (sin consultar la BD)"""
         self.busqueda_actual = self.txt_buscar.text().strip()
         self.pagina = 0
-        self.cargar_lista()
+        self.mostrar_pagina()
 
     def buscar(self):
         """Buscar configuraciones"""
@@ -380,14 +715,23 @@ class ConfiguracionWidget(QWidget):
         self.cargar_lista()
 
     def cargar_lista(self):
-        """Cargar lista de configuraciones con filtro y paginación"""
+        """Leer de nuevo las configuraciones (en segundo plano) y mostrarlas"""
+        self.bd.llamar(list_configs, al_terminar=self._lista_cargada, al_fallar=self._lista_no_cargada,
+                       clave='configuracion_lista')
+
+    def _lista_cargada(self, configs):
+        self.configs = configs
+        self.mostrar_pagina()
+
+    def _lista_no_cargada(self, e):
+        QMessageBox.critical(self, "Error", f"No se pudo cargar la lista: {e}")
+        self._lista_cargada([])
+
+    def mostrar_pagina(self):
+        """Mostrar la lista con filtro y paginación"""
         self.tabla.clear()
-        try:
-            configs = list_configs()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo cargar la lista: {e}")
-            configs = []
-        
+        configs = self.configs
+
         # Aplicar filtro si hay búsqueda
         if self.busqueda_actual:
             configs = [c for c in configs if self.busqueda_actual.lower() in (c.get('nombre') or "").lower()]
@@ -409,13 +753,13 @@ class ConfiguracionWidget(QWidget):
     def siguiente_pagina(self):
         """Ir a la siguiente página"""
         self.pagina += 1
-        self.cargar_lista()
+        self.mostrar_pagina()
 
     def anterior_pagina(self):
         """Ir a la página anterior"""
         if self.pagina > 0:
             self.pagina -= 1
-            self.cargar_lista()
+            self.mostrar_pagina()
 
     def _item_id(self):
         """Obtener ID del item seleccionado"""
@@ -432,11 +776,11 @@ class ConfiguracionWidget(QWidget):
         id_ = self._item_id()
         if not id_:
             return
-        try:
-            cfg = get_config_by_id(id_)
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo leer la config: {e}")
-            return
+        self.bd.llamar(get_config_by_id, id_, al_terminar=self._config_seleccionada,
+                       al_fallar=lambda e: QMessageBox.critical(self, "Error", f"No se pudo leer la config: {e}"),
+                       clave='configuracion_seleccion')
+
+    def _config_seleccionada(self, cfg):
         if cfg:
             self.txt_nombre.setText(cfg.get('nombre') or "")
             self.txt_xml.setText(cfg.get('formato_xml') or "")
@@ -445,25 +789,13 @@ class ConfiguracionWidget(QWidget):
             self.txt_json.setText(cfg.get('formato_json') or "")
 
     def validar_formatos(self):
-        """Valida que los formatos tengan extensiones correctas"""
-        formatos = {
-            'XML': self.txt_xml.text().strip(),
-            'PDF': self.txt_pdf.text().strip(), 
-            'CUV': self.txt_cuv.text().strip(),
-            'JSON Factura': self.txt_json.text().strip()
-        }
-        
-        errores = []
-        for tipo, formato in formatos.items():
-            if formato:  # Si el campo no está vacío
-                if tipo == 'XML' and not formato.endswith('.xml'):
-                    errores.append(f"Formato XML debe terminar en .xml: {formato}")
-                elif tipo == 'PDF' and not formato.endswith('.pdf'):
-                    errores.append(f"Formato PDF debe terminar en .pdf: {formato}")
-                elif tipo in ['CUV', 'JSON Factura'] and not formato.endswith('.json'):
-                    errores.append(f"Formato {tipo} debe terminar en .json: {formato}")
-        
-        return errores
+        """Valida extensiones y variables de los formatos del formulario"""
+        return validar_formatos({
+            'formato_xml': self.txt_xml.text(),
+            'formato_pdf': self.txt_pdf.text(),
+            'formato_cuv': self.txt_cuv.text(),
+            'formato_json': self.txt_json.text(),
+        })
 
     def guardar_config(self):
         """Guardar configuración"""
@@ -479,23 +811,34 @@ class ConfiguracionWidget(QWidget):
             QMessageBox.warning(self, "Validación de formatos", "\n".join(errores))
             return
         
-        try:
-            if id_:
-                update_config(id_, nombre=nombre,
-                              formato_xml=self.txt_xml.text(),
-                              formato_pdf=self.txt_pdf.text(),
-                              formato_cuv=self.txt_cuv.text(),
-                              formato_json=self.txt_json.text())
-            else:
-                create_config(nombre,
-                              formato_xml=self.txt_xml.text(),
-                              formato_pdf=self.txt_pdf.text(),
-                              formato_cuv=self.txt_cuv.text(),
-                              formato_json=self.txt_json.text())
+        formatos = dict(formato_xml=self.txt_xml.text(),
+                        formato_pdf=self.txt_pdf.text(),
+                        formato_cuv=self.txt_cuv.text(),
+                        formato_json=self.txt_json.text())
+        if id_:
+            guardar = lambda: update_config(id_, nombre=nombre, **formatos)
+        else:
+            guardar = lambda: create_config(nombre, **formatos)
+        self._escribir(self.btn_guardar, guardar, "Configuración guardada correctamente", "No se pudo guardar")
+
+    def _escribir(self, boton, funcion, mensaje_ok, mensaje_error, despues=None):
+        """Ejecuta un cambio en la BD en segundo plano; el botón queda
+        deshabilitado hasta la respuesta para no repetirlo con otro clic"""
+        boton.setEnabled(False)
+
+        def ok(_):
+            boton.setEnabled(True)
+            if despues:
+                despues()
             self.cargar_lista()
-            QMessageBox.information(self, "OK", "Configuración guardada correctamente")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo guardar: {e}")
+            self.configuraciones_cambiadas.emit()
+            QMessageBox.information(self, "OK", mensaje_ok)
+
+        def error(e):
+            boton.setEnabled(True)
+            QMessageBox.critical(self, "Error", f"{mensaje_error}: {e}")
+
+        self.bd.llamar(funcion, al_terminar=ok, al_fallar=error)
 
     def activar_config(self):
         """Activar configuración seleccionada"""
@@ -503,12 +846,8 @@ class ConfiguracionWidget(QWidget):
         if not id_:
             QMessageBox.warning(self, "Validación", "Selecciona una configuración primero")
             return
-        try:
-            update_config(id_, activar=True)
-            self.cargar_lista()
-            QMessageBox.information(self, "OK", "Configuración activada")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo activar: {e}")
+        self._escribir(self.btn_activar, lambda: update_config(id_, activar=True),
+                       "Configuración activada", "No se pudo activar")
 
     def eliminar_config(self):
         """Eliminar configuración seleccionada"""
@@ -516,41 +855,88 @@ class ConfiguracionWidget(QWidget):
         if not id_:
             QMessageBox.warning(self, "Validación", "Selecciona una configuración primero")
             return
+        self._escribir(self.btn_eliminar, lambda: delete_config(id_),
+                       "Configuración eliminada", "No se pudo eliminar", despues=self._limpiar_campos)
+
+    def exportar_configuraciones(self):
+        """Guarda las configuraciones cargadas en un archivo JSON o CSV"""
+        if not self.configs:
+            QMessageBox.warning(self, "Exportar", "No hay configuraciones para exportar.")
+            return
+        ruta, _ = QFileDialog.getSaveFileName(self, "Exportar configuraciones",
+                                              f"Configuraciones_SERAF_{datetime.datetime.now().strftime('%Y%m%d')}.json",
+                                              "JSON (*.json);;CSV (*.csv)")
+        if not ruta:
+            return
         try:
-            delete_config(id_)
-            self.cargar_lista()
-            # Limpiar campos
-            self.txt_nombre.clear()
-            self.txt_xml.setText("")
-            self.txt_pdf.setText("")
-            self.txt_cuv.setText("")
-            self.txt_json.setText("")
-            QMessageBox.information(self, "OK", "Configuración eliminada")
+            total = exportar_configs(self.configs, ruta)
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudo eliminar: {e}")
+            QMessageBox.critical(self, "Error", f"No se pudo exportar: {e}")
+            return
+        QMessageBox.information(self, "OK", f"{total} configuraciones exportadas a:\n{ruta}")
+
+    def importar_configuraciones(self):
+        """Valida todo el archivo y lo importa en una sola transacción"""
+        ruta, _ = QFileDialog.getOpenFileName(self, "Importar configuraciones", "",
+                                              "Configuraciones (*.json *.csv);;Todos los archivos (*)")
+        if not ruta:
+            return
+        try:
+            configs = leer_configs(ruta)
+        except ArchivoConfigsInvalido as e:
+            detalle = "\n".join(e.errores[:20])
+            if len(e.errores) > 20:
+                detalle += f"\n... y {len(e.errores) - 20} más"
+            QMessageBox.warning(self, "Importar", f"{e}\n\n{detalle}".strip())
+            return
+        if not configs:
+            QMessageBox.warning(self, "Importar", "El archivo no tiene configuraciones.")
+            return
+
+        nombres = {c['nombre'] for c in self.configs}
+        existentes = sum(1 for c in configs if c['nombre'] in nombres)
+        actualizar = True
+        if existentes:
+            respuesta = QMessageBox.question(
+                self, "Importar",
+                f"{len(configs) - existentes} configuraciones nuevas y {existentes} que ya existen.\n\n"
+                "¿Actualizar los formatos de las que ya existen? (No: se dejan como están)",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+            if respuesta == QMessageBox.Cancel:
+                return
+            actualizar = respuesta == QMessageBox.Yes
+        self._escribir(self.btn_importar, lambda: importar_configs(configs, actualizar),
+                       f"Importación completada: {len(configs)} configuraciones de {os.path.basename(ruta)}",
+                       "No se pudo importar (no se guardó ninguna)")
+
+    def _limpiar_campos(self):
+        self.txt_nombre.clear()
+        self.txt_xml.setText("")
+        self.txt_pdf.setText("")
+        self.txt_cuv.setText("")
+        self.txt_json.setText("")
 
     def previsualizar(self):
         """Mostrar previsualización de los formatos"""
-        # Obtener configuración REAL desde BD
-        try:
-            config_db = obtener_configuracion_db()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudieron obtener los datos de configuración: {e}")
+        # Validar formatos primero
+        errores = self.validar_formatos()
+        if errores:
+            QMessageBox.warning(self, "Formatos incorrectos", "\n".join(errores))
             return
-        
+        # Obtener configuración REAL desde BD
+        self.bd.llamar(obtener_datos_ips, al_terminar=self._mostrar_previsualizacion,
+                       al_fallar=lambda e: QMessageBox.critical(
+                           self, "Error", f"No se pudieron obtener los datos de configuración: {e}"),
+                       clave='configuracion_preview')
+
+    def _mostrar_previsualizacion(self, config_db):
         contexto = {
             "numFactura": "12345",
             "ProcesoId": "999",
             "ips": config_db.get("codigo_ips", ""),
             "nit": config_db.get("nit", "")
         }
-        
-        # Validar formatos primero
-        errores = self.validar_formatos()
-        if errores:
-            QMessageBox.warning(self, "Formatos incorrectos", "\n".join(errores))
-            return
-        
+
         xml = apply_format(self.txt_xml.text(), contexto) or "(no definido)"
         pdf = apply_format(self.txt_pdf.text(), contexto) or "(no definido)"
         cuv = apply_format(self.txt_cuv.text(), contexto) or "(no definido)"
@@ -571,6 +957,36 @@ class ConfiguracionWidget(QWidget):
         msg.setText(mensaje)
         msg.exec_()
 
+    def previsualizar_en_carpeta(self):
+        """Plan completo de los formatos del formulario sobre una carpeta real"""
+        errores = self.validar_formatos()
+        if errores:
+            QMessageBox.warning(self, "Formatos incorrectos", "\n".join(errores))
+            return
+        config = {COLUMNA_FORMATO['xml']: self.txt_xml.text().strip(),
+                  COLUMNA_FORMATO['pdf']: self.txt_pdf.text().strip(),
+                  COLUMNA_FORMATO['cuv']: self.txt_cuv.text().strip(),
+                  COLUMNA_FORMATO['fact']: self.txt_json.text().strip()}
+        if not any(config.values()):
+            QMessageBox.warning(self, "Validación", "Define al menos un formato para previsualizar.")
+            return
+        carpeta = QFileDialog.getExistingDirectory(self, "Carpeta para la vista previa")
+        if not carpeta:
+            return
+        try:
+            reglas = leer_reglas_ini()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudieron leer las reglas de recorrido: {e}")
+            return
+
+        def mostrar(config_db):
+            opciones = OpcionesProcesamiento(renombrar=True, config=config, datos_ips=config_db, reglas=reglas)
+            DialogoPlanCompleto([carpeta], opciones, self).exec_()
+
+        self.bd.llamar(obtener_datos_ips, al_terminar=mostrar,
+                       al_fallar=lambda e: QMessageBox.critical(
+                           self, "Error", f"No se pudieron obtener los datos de configuración: {e}"))
+
 # -------------------------
 # Renombrador (principal)
 # -------------------------
@@ -578,8 +994,23 @@ class RenombradorCUVWidget(QWidget):
     progress_updated = pyqtSignal(int)
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.carpetas = []
-        self.last_context = None
+        self.modelo_carpetas = ModeloCarpetas(self)
+        self.bd = acceso_bd()
+        # Configuraciones y datos IPS leídos al llenar el combo (ver _configs_cargadas)
+        self.configs_por_id = {}
+        self.datos_ips = None
+        self.presupuesto_io = None  # PresupuestoIO de la ejecución en curso (None: sin límite)
+        # Inventario y lectura de cada carpeta en segundo plano desde que se agrega;
+        # sus lecturas respetan el límite de E/S de database.ini
+        try:
+            presupuesto = leer_presupuesto_ini()
+        except Exception as e:
+            print(f"Preescaneo sin límite de E/S: {e}")
+            presupuesto = None
+        self.preescaneo = Preescaneo(al_terminar=self.preescaneo_terminado,
+                                     presupuesto=presupuesto if presupuesto and presupuesto.activo else None)
+        # La prioridad de database.ini es solo el valor inicial de la casilla
+        self.prioridad_inicial = presupuesto.prioridad if presupuesto else PRIORIDAD_NORMAL
         self.setAcceptDrops(True)  # Habilitar drops en el widget principal
         self.init_ui()
 
@@ -592,17 +1023,35 @@ class RenombradorCUVWidget(QWidget):
         """Maneja el soltar archivos en el widget principal"""
         self.procesar_arrastre(event)
 
+    @property
+    def carpetas(self):
+        """Carpetas de la lista, en orden (copia: para cambiarla usar el modelo)"""
+        return self.modelo_carpetas.carpetas()
+
     def procesar_arrastre(self, event):
         """Procesa el arrastre de carpetas"""
-        urls = event.mimeData().urls()
-        for url in urls:
-            path = url.toLocalFile()
-            if os.path.isdir(path) and path not in self.carpetas:
-                self.carpetas.append(path)
-                self.lista_carpetas.addItem(path)
-        self.actualizar_boton_procesar()
+        rutas = [url.toLocalFile() for url in event.mimeData().urls()]
+        self.agregar_carpetas([r for r in rutas if os.path.isdir(r)])
         event.acceptProposedAction()
 
+    def agregar_carpetas(self, carpetas):
+        """Agrega un lote de carpetas a la lista y empieza a preescanearlas"""
+        opciones = self.opciones_preescaneo()
+        for carpeta in self.modelo_carpetas.agregar(carpetas):
+            self.preescaneo.agregar(carpeta, self.reglas_recorrido(), opciones)
+            self.modelo_carpetas.actualizar_detalle(carpeta, "⏳ en cola")
+        self.actualizar_boton_procesar()
+
+    def preescaneo_terminado(self, carpeta, resultado, error):
+        """Llamado desde un hilo del preescaneo: arma el detalle de la fila"""
+        if error is not None:
+            texto = f"⚠️ {error}"
+        else:
+            inv = resultado.inventario
+            total = len(inv.cuv) + len(inv.facturas) + len(inv.xml) + len(inv.pdf)
+            texto = f"{total} archivos, {len(inv.cuv)} CUV ✔"
+        self.modelo_carpetas.detalle_listo.emit(carpeta, texto)
+
     def init_ui(self):
         layout = QVBoxLayout(self)
         layout.setContentsMargins(20,20,20,20)
@@ -643,7 +1092,8 @@ class RenombradorCUVWidget(QWidget):
         grp = QGroupBox("📁 Carpetas seleccionadas")
         grp.setFont(QFont("Segoe UI", 11, QFont.Bold))
         vgrp = QVBoxLayout(grp)
-        self.lista_carpetas = ElegantListWidget()
+        self.lista_carpetas = ElegantListView()
+        self.lista_carpetas.setModel(self.modelo_carpetas)
         self.lista_carpetas.setSelectionMode(QAbstractItemView.MultiSelection)
         self.lista_carpetas.setAcceptDrops(True)
         # Conectar eventos de arrastre directamente
@@ -686,12 +1136,75 @@ class RenombradorCUVWidget(QWidget):
         self.radio_eliminar_todo = QCheckBox("   • Eliminar todo el array ResultadosValidacion (vaciar)")
         self.radio_eliminar_todo.setEnabled(False)  # Inicialmente deshabilitado
         self.radio_eliminar_todo.setChecked(False)
+
+        self.chk_respaldar_cuv = QCheckBox("   • Respaldar cada CUV antes de modificarlo (se puede restaurar)")
+        self.chk_respaldar_cuv.setEnabled(False)
+        self.chk_respaldar_cuv.setChecked(False)
+        self.chk_respaldar_cuv.setToolTip("El respaldo se guarda junto al archivo de registro. "
+                                          "Usa Herramientas > Restaurar respaldo CUV para revertir la ejecución.")
+
+        self.chk_modo_red = QCheckBox("⚡ Carpetas en red: procesar varios archivos a la vez")
+        self.chk_modo_red.setChecked(False)
+        self.chk_modo_red.setToolTip("Útil en carpetas compartidas (SMB), donde cada operación de archivo "
+                                     "espera a la red. El resultado es el mismo que procesando en serie.")
+
+        self.chk_segundo_plano = QCheckBox("🐢 Segundo plano: limitar el uso de disco y red")
+        self.chk_segundo_plano.setChecked(self.prioridad_inicial == PRIORIDAD_SEGUNDO_PLANO)
+        self.chk_segundo_plano.setToolTip("Para procesar en horario de oficina sin afectar a los demás equipos. "
+                                          "Los límites se configuran en la sección [procesamiento] de database.ini.")
         
         vopts.addWidget(self.chk_renombrar_archivos)
         vopts.addSpacing(10)
         vopts.addWidget(self.chk_modificar_cuv)
         vopts.addWidget(self.radio_eliminar_rechazados)
         vopts.addWidget(self.radio_eliminar_todo)
+        vopts.addWidget(self.chk_respaldar_cuv)
+        vopts.addSpacing(10)
+        vopts.addWidget(self.chk_modo_red)
+        vopts.addWidget(self.chk_segundo_plano)
+
+        # Cola compartida en la BD para repartir una entrega entre varios equipos
+        hcola = QHBoxLayout()
+        self.chk_cola_compartida = QCheckBox("👥 Repartir con otros equipos, cola:")
+        self.chk_cola_compartida.setToolTip(
+            "Las carpetas de la lista se agregan a una cola en la base de datos y cada equipo que procese "
+            "la misma cola toma una carpeta a la vez. Sin carpetas en la lista, este equipo solo ayuda "
+            "con la cola. Las rutas deben ser iguales en todos los equipos (\\\\servidor\\recurso).")
+        self.txt_cola = QLineEdit(f"entrega_{datetime.datetime.now().strftime('%Y%m')}")
+        self.txt_cola.setMaxLength(100)
+        hcola.addWidget(self.chk_cola_compartida)
+        hcola.addWidget(self.txt_cola)
+        vopts.addLayout(hcola)
+        self.chk_cola_compartida.toggled.connect(self.actualizar_boton_procesar)
+        if modo_offline() is not None:
+            self.chk_cola_compartida.setEnabled(False)
+            self.chk_cola_compartida.setToolTip("No disponible sin conexión a la base de datos")
+
+        # Reglas de recorrido (valores iniciales desde database.ini [procesamiento])
+        try:
+            reglas_ini = leer_reglas_ini()
+        except Exception as e:
+            print(f"No se pudieron leer las reglas de recorrido: {e}")
+            reglas_ini = ReglasRecorrido()
+        hreglas = QHBoxLayout()
+        self.txt_excluir = QLineEdit(reglas_ini.texto_exclusiones())
+        self.txt_excluir.setPlaceholderText("Excluir carpetas/archivos: Enviados; Respaldo*; 2024/Viejos")
+        self.txt_excluir.setToolTip("Patrones separados por ';'. Sin barra se comparan con el nombre; "
+                                    "con barra, con la ruta dentro de la carpeta. Lo excluido no se recorre.")
+        self.spn_profundidad = QSpinBox()
+        self.spn_profundidad.setRange(-1, 99)
+        self.spn_profundidad.setSpecialValueText("Sin límite")
+        self.spn_profundidad.setValue(-1 if reglas_ini.profundidad_maxima is None else reglas_ini.profundidad_maxima)
+        self.spn_profundidad.setToolTip("Niveles de subcarpetas a recorrer bajo cada carpeta (0: solo la carpeta)")
+        self.chk_omitir_ocultos = QCheckBox("Omitir ocultos")
+        self.chk_omitir_ocultos.setChecked(reglas_ini.omitir_ocultos)
+        self.chk_omitir_ocultos.setToolTip("Salta carpetas y archivos ocultos o de sistema (.git, cuarentena del antivirus)")
+        hreglas.addWidget(QLabel("🚫 Excluir:"))
+        hreglas.addWidget(self.txt_excluir)
+        hreglas.addWidget(QLabel("Profundidad:"))
+        hreglas.addWidget(self.spn_profundidad)
+        hreglas.addWidget(self.chk_omitir_ocultos)
+        vopts.addLayout(hreglas)
 
         # Configuración de nombres (OBLIGATORIA para renombrar)
         hcfg = QHBoxLayout()
@@ -720,6 +1233,11 @@ class RenombradorCUVWidget(QWidget):
         self.lbl_preview.setStyleSheet("color:#333;font-size:11px; background: #f0f8ff; padding: 8px; border-radius: 4px;")
         layout.addWidget(self.lbl_preview)
 
+        self.btn_ver_plan = ElegantButton("📋 Ver plan completo")
+        self.btn_ver_plan.setEnabled(False)
+        self.btn_ver_plan.setToolTip("Todos los renombrados que haría la configuración seleccionada en las carpetas, sin ejecutarlos")
+        layout.addWidget(self.btn_ver_plan)
+
         # Progress + procesar
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
@@ -729,6 +1247,11 @@ class RenombradorCUVWidget(QWidget):
         self.btn_procesar.setEnabled(False)
         layout.addWidget(self.btn_procesar)
 
+        self.btn_analizar = ElegantButton("📊 Analizar glosas (rechazos CUV)")
+        self.btn_analizar.setEnabled(False)
+        self.btn_analizar.setToolTip("Genera un reporte JSON/CSV con los rechazos por código, clase, carpeta y factura")
+        layout.addWidget(self.btn_analizar)
+
         # Conexiones - CORREGIDO Y ACTUALIZADO
         self.btn_quitar.clicked.connect(self.quitar_seleccionados)
         self.btn_limpiar.clicked.connect(self.limpiar_lista)
@@ -746,9 +1269,17 @@ class RenombradorCUVWidget(QWidget):
         self.chk_modificar_cuv.stateChanged.connect(self.actualizar_boton_procesar)
         self.lista_carpetas.model().rowsInserted.connect(self.actualizar_boton_procesar)
         self.lista_carpetas.model().rowsRemoved.connect(self.actualizar_boton_procesar)
+        self.lista_carpetas.model().modelReset.connect(self.actualizar_boton_procesar)
         
         # Conexión del botón procesar
         self.btn_procesar.clicked.connect(self.procesar_archivos)
+        self.btn_analizar.clicked.connect(self.analizar_glosas)
+        self.btn_ver_plan.clicked.connect(self.ver_plan_completo)
+
+        # Con otras reglas de recorrido lo preescaneado ya no sirve
+        self.txt_excluir.editingFinished.connect(self.reprogramar_preescaneo)
+        self.spn_profundidad.valueChanged.connect(self.reprogramar_preescaneo)
+        self.chk_omitir_ocultos.stateChanged.connect(self.reprogramar_preescaneo)
 
     def _mutual_check_cuv(self, clicked_checkbox):
         """Controla que solo una opción de modificación CUV esté activa"""
@@ -764,32 +1295,45 @@ class RenombradorCUVWidget(QWidget):
         enabled = self.chk_modificar_cuv.isChecked()
         self.radio_eliminar_rechazados.setEnabled(enabled)
         self.radio_eliminar_todo.setEnabled(enabled)
+        self.chk_respaldar_cuv.setEnabled(enabled)
         
         # Si se desactiva la modificación CUV, desmarcar las sub-opciones
         if not enabled:
             self.radio_eliminar_rechazados.setChecked(False)
             self.radio_eliminar_todo.setChecked(False)
+            self.chk_respaldar_cuv.setChecked(False)
 
     def reload_configs_into_combo(self):
+        self.btn_ref.setEnabled(False)
+        self.bd.llamar(_cargar_configs_y_datos_ips, al_terminar=self._configs_cargadas,
+                       al_fallar=self._configs_no_cargadas, clave='combo_configs')
+
+    def _configs_no_cargadas(self, e):
+        QMessageBox.critical(self, "Error", f"No se pudieron cargar las configuraciones: {e}")
+        self._configs_cargadas(([], None))
+
+    def _configs_cargadas(self, leido):
+        configs, self.datos_ips = leido
+        # El procesamiento usa estas copias: no vuelve a consultar la BD
+        self.configs_por_id = {c['id']: c for c in configs}
+        self.btn_ref.setEnabled(True)
+        # Sin señales mientras se llena: cada cambio de índice consultaría la BD
+        self.cmb_configs.blockSignals(True)
         self.cmb_configs.clear()
-        try:
-            configs = list_configs()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"No se pudieron cargar las configuraciones: {e}")
-            configs = []
         self.cmb_configs.addItem("-- Selecciona una configuración --", None)
         for c in configs:
             label = f"{c['id']:03d} - {c.get('nombre')}"
             if c.get('activa'):
                 label += " (ACTIVA)"
             self.cmb_configs.addItem(label, c['id'])
-        # seleccionar activa si hay y si no hay selección previa
-        act = get_active_config()
+        # seleccionar activa si hay (ya viene en la lista: no hace falta otra consulta)
+        act = next((c for c in configs if c.get('activa')), None)
         if act:
             for i in range(self.cmb_configs.count()):
                 if self.cmb_configs.itemData(i) == act.get('id'):
                     self.cmb_configs.setCurrentIndex(i)
                     break
+        self.cmb_configs.blockSignals(False)
         self.actualizar_estado_config()
 
     def actualizar_estado_config(self):
@@ -798,7 +1342,9 @@ class RenombradorCUVWidget(QWidget):
         renombrar_activado = self.chk_renombrar_archivos.isChecked()
         
         if config_id is None:
-            # No hay configuración seleccionada
+            # No hay configuración seleccionada: se descarta la consulta de la anterior, si sigue en curso
+            self.bd.descartar('estado_config')
+            self.lbl_preview.setText("")
             self.lbl_estado_config.setText("❌ Debes seleccionar una configuración para renombrar archivos")
             self.lbl_estado_config.setStyleSheet("color: #d32f2f; font-size: 10px; padding: 5px; background: #ffebee;")
             if renombrar_activado:
@@ -806,69 +1352,89 @@ class RenombradorCUVWidget(QWidget):
                 QMessageBox.warning(self, "Configuración requerida", 
                                   "Para renombrar archivos debes seleccionar una configuración de nombres.")
         else:
-            # Hay configuración seleccionada
-            try:
-                cfg = get_config_by_id(config_id)
-                if cfg:
-                    estado = "✅ Configuración seleccionada"
-                    if cfg.get('activa'):
-                        estado += " (ACTIVA)"
-                    self.lbl_estado_config.setText(estado)
-                    self.lbl_estado_config.setStyleSheet("color: #388e3c; font-size: 10px; padding: 5px; background: #e8f5e8;")
-                    
-                    # Mostrar preview
-                    try:
-                        config_db = obtener_configuracion_db()
-                        contexto = {
-                            "numFactura": "12345",
-                            "ProcesoId": "999",
-                            "fecha": datetime.datetime.now().strftime('%Y%m%d'),
-                            "ano": datetime.datetime.now().strftime('%Y'),
-                            "mes": datetime.datetime.now().strftime('%m'),
-                            "dia": datetime.datetime.now().strftime('%d'),
-                            "ips": config_db.get("codigo_ips", ""),
-                            "nit": config_db.get("nit", ""),
-                            "nombreCarpeta": "CarpetaEjemplo"
-                        }
-                        
-                        xml = apply_format(cfg.get('formato_xml'), contexto) or "(no definido)"
-                        pdf = apply_format(cfg.get('formato_pdf'), contexto) or "(no definido)"
-                        cuv = apply_format(cfg.get('formato_cuv'), contexto) or "(no definido)"
-                        jsn = apply_format(cfg.get('formato_json'), contexto) or "(no definido)"
-                        
-                        preview_text = f"📝 <b>Vista previa:</b> XML: <code>{xml}</code> | PDF: <code>{pdf}</code> | CUV: <code>{cuv}</code> | Factura: <code>{jsn}</code>"
-                        self.lbl_preview.setText(preview_text)
-                    except Exception as e:
-                        self.lbl_preview.setText(f"⚠️ Error en vista previa: {str(e)}")
-                else:
-                    self.lbl_estado_config.setText("❌ Configuración no encontrada")
-                    self.lbl_estado_config.setStyleSheet("color: #d32f2f; font-size: 10px; padding: 5px; background: #ffebee;")
-            except Exception as e:
-                self.lbl_estado_config.setText(f"❌ Error cargando configuración: {str(e)}")
-                self.lbl_estado_config.setStyleSheet("color: #d32f2f; font-size: 10px; padding: 5px; background: #ffebee;")
+            # Hay configuración seleccionada: se consulta en segundo plano; al
+            # recorrer el combo solo cuenta la última
+            self.lbl_estado_config.setText("⏳ Cargando configuración...")
+            self.lbl_estado_config.setStyleSheet("color: #666; font-size: 10px; padding: 5px;")
+            self.bd.llamar(_leer_config_y_datos_ips, config_id, self.datos_ips, al_terminar=self._mostrar_estado_config,
+                           al_fallar=self._error_estado_config, clave='estado_config')
+
+    def _error_estado_config(self, e):
+        self.lbl_estado_config.setText(f"❌ Error cargando configuración: {str(e)}")
+        self.lbl_estado_config.setStyleSheet("color: #d32f2f; font-size: 10px; padding: 5px; background: #ffebee;")
+
+    def _mostrar_estado_config(self, leido):
+        cfg, config_db = leido
+        if not cfg:
+            self.lbl_estado_config.setText("❌ Configuración no encontrada")
+            self.lbl_estado_config.setStyleSheet("color: #d32f2f; font-size: 10px; padding: 5px; background: #ffebee;")
+            return
+        estado = "✅ Configuración seleccionada"
+        if cfg.get('activa'):
+            estado += " (ACTIVA)"
+        self.lbl_estado_config.setText(estado)
+        self.lbl_estado_config.setStyleSheet("color: #388e3c; font-size: 10px; padding: 5px; background: #e8f5e8;")
+
+        # Mostrar preview
+        try:
+            contexto = {
+                "numFactura": "12345",
+                "ProcesoId": "999",
+                "fecha": datetime.datetime.now().strftime('%Y%m%d'),
+                "ano": datetime.datetime.now().strftime('%Y'),
+                "mes": datetime.datetime.now().strftime('%m'),
+                "dia": datetime.datetime.now().strftime('%d'),
+                "ips": config_db.get("codigo_ips", ""),
+                "nit": config_db.get("nit", ""),
+                "nombreCarpeta": "CarpetaEjemplo"
+            }
+
+            xml = apply_format(cfg.get('formato_xml'), contexto) or "(no definido)"
+            pdf = apply_format(cfg.get('formato_pdf'), contexto) or "(no definido)"
+            cuv = apply_format(cfg.get('formato_cuv'), contexto) or "(no definido)"
+            jsn = apply_format(cfg.get('formato_json'), contexto) or "(no definido)"
+
+            preview_text = f"📝 <b>Vista previa:</b> XML: <code>{xml}</code> | PDF: <code>{pdf}</code> | CUV: <code>{cuv}</code> | Factura: <code>{jsn}</code>"
+            self.lbl_preview.setText(preview_text)
+        except Exception as e:
+            self.lbl_preview.setText(f"⚠️ Error en vista previa: {str(e)}")
 
     def quitar_seleccionados(self):
         """Quitar las carpetas seleccionadas de la lista"""
-        items = self.lista_carpetas.selectedItems()
-        for item in items:
-            row = self.lista_carpetas.row(item)
-            carpeta = item.text()
-            self.lista_carpetas.takeItem(row)
-            if carpeta in self.carpetas:
-                self.carpetas.remove(carpeta)
+        filas = [indice.row() for indice in self.lista_carpetas.selectionModel().selectedRows()]
+        for carpeta in self.modelo_carpetas.quitar_filas(filas):
+            self.preescaneo.quitar(carpeta)
         self.actualizar_boton_procesar()
 
     def limpiar_lista(self):
         """Limpiar toda la lista de carpetas"""
-        self.lista_carpetas.clear()
-        self.carpetas.clear()
+        self.modelo_carpetas.limpiar()
+        self.preescaneo.limpiar()
         self.actualizar_boton_procesar()
 
+    def reprogramar_preescaneo(self):
+        """Vuelve a preescanear las carpetas si cambiaron las reglas de recorrido"""
+        opciones = self.opciones_preescaneo()
+        for carpeta in self.carpetas:
+            if self.preescaneo.agregar(carpeta, self.reglas_recorrido(), opciones):
+                self.modelo_carpetas.actualizar_detalle(carpeta, "⏳ en cola")
+
+    def opciones_preescaneo(self):
+        """OpcionesProcesamiento con la configuración elegida, para que el
+        preescaneo no lea lo que el renombrado resolverá por el nombre (None: se lee todo)"""
+        cfg = self.configs_por_id.get(self.cmb_configs.currentData())
+        if not cfg or not self.chk_renombrar_archivos.isChecked():
+            return None
+        return OpcionesProcesamiento(renombrar=True, config=cfg, datos_ips=self.datos_ips)
+
     def actualizar_boton_procesar(self):
         """Habilita el botón procesar si hay carpetas y opciones seleccionadas"""
         tiene_carpetas = len(self.carpetas) > 0
         tiene_opciones = self.chk_renombrar_archivos.isChecked() or self.chk_modificar_cuv.isChecked()
-        self.btn_procesar.setEnabled(tiene_carpetas and tiene_opciones)
+        # Con la cola compartida se puede procesar sin carpetas propias (ayudar a otro equipo)
+        self.btn_procesar.setEnabled((tiene_carpetas or self.chk_cola_compartida.isChecked()) and tiene_opciones)
+        self.btn_analizar.setEnabled(tiene_carpetas)
+        self.btn_ver_plan.setEnabled(tiene_carpetas)
 
     # ... (métodos drag & drop, quitar, limpiar iguales)
 
@@ -882,44 +1448,12 @@ class RenombradorCUVWidget(QWidget):
             return None
 
     def buscar_archivos_por_ext(self, carpeta, exts):
-        """Busca archivos por extensión - MEJORADO"""
-        encontrados = []
-        for raiz, _, archivos in os.walk(carpeta):
-            for a in archivos:
-                nombre_lower = a.lower()
-                if any(nombre_lower.endswith(e.lower()) for e in exts):
-                    encontrados.append(os.path.join(raiz, a))
-        return sorted(encontrados)  # Ordenar para procesar en orden consistente
+        """Busca archivos por extensión"""
+        return buscar_archivos_por_ext(carpeta, exts)
 
     def _obtener_archivos_asociados(self, num_factura, archivos_xml, archivos_pdf, carpeta_actual):
         """Busca archivos XML y PDF asociados a una factura"""
-        xml_asociado = None
-        pdf_asociado = None
-        
-        # Buscar por número de factura en el nombre
-        num_str = str(num_factura)
-        for archivo_xml in archivos_xml:
-            if num_str in os.path.basename(archivo_xml):
-                xml_asociado = archivo_xml
-                break
-                
-        for archivo_pdf in archivos_pdf:
-            if num_str in os.path.basename(archivo_pdf):
-                pdf_asociado = archivo_pdf
-                break
-        
-        # Si no se encontró, buscar en la misma carpeta que la factura
-        if not xml_asociado:
-            xmls_carpeta = [x for x in archivos_xml if os.path.dirname(x) == carpeta_actual]
-            if xmls_carpeta:
-                xml_asociado = xmls_carpeta[0]
-        
-        if not pdf_asociado:
-            pdfs_carpeta = [p for p in archivos_pdf if os.path.dirname(p) == carpeta_actual]
-            if pdfs_carpeta:
-                pdf_asociado = pdfs_carpeta[0]
-                
-        return xml_asociado, pdf_asociado
+        return obtener_archivos_asociados(num_factura, archivos_xml, archivos_pdf, carpeta_actual)
 
     def obtener_proceso_id_desde_cuv(self, archivo_cuv):
         """Obtiene el ProcesoId desde el archivo CUV"""
@@ -931,9 +1465,85 @@ class RenombradorCUVWidget(QWidget):
             print(f"Error leyendo ProcesoId desde CUV {archivo_cuv}: {e}")
             return ""
 
+    def ver_plan_completo(self):
+        """Plan de renombrado de la configuración seleccionada sobre las carpetas"""
+        if not self.carpetas:
+            QMessageBox.warning(self, "Advertencia", "No hay carpetas seleccionadas.")
+            return
+        config_id = self.cmb_configs.currentData()
+        if config_id is None:
+            QMessageBox.warning(self, "Configuración requerida",
+                                "Selecciona una configuración de nombres para ver el plan.")
+            return
+        carpetas = self.carpetas
+        reglas = self.reglas_recorrido()
+
+        def mostrar(leido):
+            cfg, config_db = leido
+            if not cfg:
+                QMessageBox.critical(self, "Error", "La configuración seleccionada no existe.")
+                return
+            opciones = OpcionesProcesamiento(renombrar=True, config=cfg, datos_ips=config_db, reglas=reglas)
+            DialogoPlanCompleto(carpetas, opciones, self).exec_()
+
+        cfg = self.configs_por_id.get(config_id)
+        if cfg and self.datos_ips is not None:
+            mostrar((cfg, self.datos_ips))
+            return
+        self.bd.llamar(_leer_config_y_datos_ips, config_id, al_terminar=mostrar,
+                       al_fallar=lambda e: QMessageBox.critical(self, "Error", f"No se pudo cargar la configuración: {e}"))
+
+    def analizar_glosas(self):
+        """Agrega los rechazos de todos los CUV de las carpetas y guarda el reporte"""
+        if not self.carpetas:
+            QMessageBox.warning(self, "Advertencia", "No hay carpetas seleccionadas.")
+            return
+        ruta, _ = QFileDialog.getSaveFileName(self, "Guardar reporte de glosas",
+                                              f"Reporte_Glosas_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                                              "Reporte JSON (*.json);;Todos los archivos (*)")
+        if not ruta:
+            return
+
+        self.btn_analizar.setEnabled(False)
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+        QApplication.processEvents()
+
+        def progreso(hechos, total):
+            self.progress_updated.emit(int(hechos * 100 / total) if total else 100)
+            QApplication.processEvents()
+
+        try:
+            analitica = analizar_carpetas([os.path.abspath(c) for c in self.carpetas], progreso=progreso,
+                                          reglas=self.reglas_recorrido())
+            ruta_json, ruta_csv = analitica.escribir_reporte(ruta)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo generar el reporte de glosas: {e}")
+            return
+        finally:
+            self.btn_analizar.setEnabled(True)
+            self.progress_bar.setVisible(False)
+
+        filas = "".join(
+            f"<tr><td>{clase}</td><td>{codigo}</td><td align='right'>{n}</td></tr>"
+            for (clase, codigo), n in analitica.codigos_ordenados()[:10]
+        )
+        msg = QMessageBox(self)
+        msg.setWindowTitle("Análisis de Glosas")
+        msg.setTextFormat(Qt.RichText)
+        msg.setText(
+            f"<h3>📊 Análisis de glosas</h3>"
+            f"<b>CUV analizados:</b> {analitica.archivos}<br/>"
+            f"<b>Rechazos:</b> {analitica.por_clase.get('RECHAZADO', 0)}<br/>"
+            f"<b>Errores de lectura:</b> {len(analitica.errores)}<br/><br/>"
+            f"<b>Códigos más frecuentes:</b><table>{filas}</table><br/>"
+            f"<b>Reporte:</b><br/><code>{ruta_json}</code><br/><code>{ruta_csv}</code>"
+        )
+        msg.exec_()
+
     def procesar_archivos(self):
         print("DEBUG: Método procesar_archivos llamado")
-        if not self.carpetas:
+        if not self.carpetas and not self.chk_cola_compartida.isChecked():
             QMessageBox.warning(self, "Advertencia", "No hay carpetas seleccionadas.")
             return
 
@@ -952,7 +1562,7 @@ class RenombradorCUVWidget(QWidget):
                                 "Para renombrar archivos debes seleccionar una configuración de nombres.")
                 return
             try:
-                cfg = get_config_by_id(config_id)
+                cfg = self.configs_por_id.get(config_id) or self.bd.esperar(get_config_by_id, config_id)
                 if not cfg:
                     QMessageBox.critical(self, "Error", "La configuración seleccionada no existe.")
                     return
@@ -981,202 +1591,128 @@ class RenombradorCUVWidget(QWidget):
         self.progress_bar.setValue(0)
         QApplication.processEvents()
 
-        # contadores
-        renombrados = {'cuv':0, 'fact':0, 'xml':0, 'pdf':0}
-        modificados_cuv = 0
-        errores = []
-        carpetas_procesadas = set()
-        total = len(self.carpetas)
-
         # Obtener configuración REAL desde BD
         try:
-            config_db = obtener_configuracion_db()
+            config_db = self.datos_ips if self.datos_ips is not None else self.bd.esperar(obtener_datos_ips)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"No se pudieron obtener los datos de configuración: {e}")
             self.btn_procesar.setEnabled(True)
             self.progress_bar.setVisible(False)
             return
 
-        # procesar cada carpeta
-        for idx, carpeta in enumerate(self.carpetas):
-            self.progress_updated.emit(int((idx / total) * 100))
+        # Respaldo previo de los CUV que se van a modificar
+        respaldo = None
+        if modificar_cuv and self.chk_respaldar_cuv.isChecked():
+            try:
+                respaldo = RespaldoCUV(os.path.dirname(os.path.abspath(archivo_log)))
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"No se pudo crear la carpeta de respaldo: {e}")
+                self.btn_procesar.setEnabled(True)
+                self.progress_bar.setVisible(False)
+                return
+
+        reglas = self.reglas_recorrido()
+
+        # Presupuesto de E/S (database.ini [procesamiento] y prioridad elegida)
+        try:
+            presupuesto = leer_presupuesto_ini(
+                prioridad=PRIORIDAD_SEGUNDO_PLANO if self.chk_segundo_plano.isChecked() else PRIORIDAD_NORMAL)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo leer el límite de E/S: {e}")
+            self.btn_procesar.setEnabled(True)
+            self.progress_bar.setVisible(False)
+            return
+        self.presupuesto_io = presupuesto if presupuesto.activo else None
+        # El preescaneo que siga en curso comparte el límite con la ejecución
+        self.preescaneo.presupuesto = self.presupuesto_io
+
+        # Historial en la BD (database.ini [procesamiento] historial_bd); sin conexión solo queda el .log
+        guardar_historial = historial_activo() and modo_offline() is None
+        def crear_opciones(config):
+            return OpcionesProcesamiento(renombrar=renombrar, config=config,
+                                         modo_cuv=self.modo_modificacion_cuv() if modificar_cuv else None,
+                                         respaldo=respaldo, datos_ips=config_db,
+                                         presupuesto=self.presupuesto_io, reglas=reglas,
+                                         preescaneo=self.preescaneo, historial=guardar_historial)
+        opciones = crear_opciones(cfg)
+        inicio = datetime.datetime.now()
+
+        # Cola compartida: se agregan las carpetas de la lista y se procesa lo que haya en la cola
+        cola = None
+        if self.chk_cola_compartida.isChecked():
+            nombre_cola = self.txt_cola.text().strip()
+            try:
+                if not nombre_cola:
+                    raise Exception("Escribe el nombre de la cola (el mismo en todos los equipos).")
+                cola = ColaTrabajo(nombre_cola)
+                if self.carpetas:
+                    agregadas = cola.encolar(self.carpetas, config_id=cfg['id'] if cfg else None, reglas=reglas)
+                    print(f"Cola {nombre_cola}: {agregadas} carpetas agregadas")
+            except Exception as e:
+                if cola is not None:
+                    cola.cerrar()
+                QMessageBox.critical(self, "Error", f"No se pudo usar la cola compartida: {e}")
+                self.btn_procesar.setEnabled(True)
+                self.progress_bar.setVisible(False)
+                return
+
+        # La configuración viaja con cada carpeta de la cola (otro equipo pudo agregarla con otra)
+        opciones_cola = {(cfg or {}).get('id'): opciones}
+
+        def opciones_para(tarea):
+            if not renombrar or tarea.config_id is None:
+                return opciones
+            if tarea.config_id not in opciones_cola:
+                config_tarea = self.configs_por_id.get(tarea.config_id) or self.bd.esperar(get_config_by_id, tarea.config_id)
+                if not config_tarea:
+                    raise Exception(f"La configuración {tarea.config_id} de la cola no existe")
+                opciones_cola[tarea.config_id] = crear_opciones(config_tarea)
+            return opciones_cola[tarea.config_id]
+
+        def progreso(hechas, total):
+            self.progress_updated.emit(int((hechas / total) * 100) if total else 100)
             QApplication.processEvents()
-            
-            if not os.path.exists(carpeta):
-                errores.append(f"Carpeta no existe: {carpeta}")
-                continue
-                
-            carpeta_real = os.path.abspath(carpeta)
-            if carpeta_real in carpetas_procesadas:
-                continue
-            carpetas_procesadas.add(carpeta_real)
-
-            print(f"Procesando carpeta: {carpeta_real}")
-
-            # buscar archivos CUV - MÉTODO MEJORADO
-            archivos_cuv = self.buscar_archivos_cuv_mejorado(carpeta_real)
-            print(f"  - Archivos CUV encontrados: {len(archivos_cuv)}")
-            for cuv in archivos_cuv:
-                print(f"    * {os.path.basename(cuv)}")
-
-            # MODIFICAR ARCHIVOS CUV (si está activado)
-            if modificar_cuv:
-                for archivo_cuv in archivos_cuv:
-                    try:
-                        if self.modificar_archivo_cuv(archivo_cuv):
-                            modificados_cuv += 1
-                            print(f"  - Modificado: {os.path.basename(archivo_cuv)}")
-                    except Exception as e:
-                        errores.append(f"Error modificando CUV {archivo_cuv}: {e}")
-
-            # RENOMBRAR ARCHIVOS (si está activado y hay configuración)
-            if renombrar and cfg:
-                # PRIMERO: Procesar archivos CUV para renombrarlos
-                for archivo_cuv in archivos_cuv:
-                    try:
-                        # Extraer número de factura del nombre del archivo CUV
-                        try:
-                            with open(archivo_cuv, 'r', encoding='utf-8') as f:
-                                datos_cuv = json.load(f)
-                            num_factura = datos_cuv.get("NumFactura")  # Leer del campo "NumFactura" del JSON
-                        except Exception as e:
-                            print(f"Error leyendo CUV {archivo_cuv}: {e}")
-                            continue
-                        
-                        if not num_factura:
-                            print(f"  - No se pudo extraer número de factura de: {archivo_cuv}")
-                            continue
-                        
-                         # Obtener ProcesoId desde el archivo CUV
-                        proceso_id = self.obtener_proceso_id_desde_cuv(archivo_cuv)
-                        
-                        # Crear contexto para formateo
-                        contexto = {
-                            "numFactura": str(num_factura),
-                            "ProcesoId": proceso_id,
-                            "fecha": datetime.datetime.now().strftime('%Y%m%d'),
-                            "ano": datetime.datetime.now().strftime('%Y'),
-                            "mes": datetime.datetime.now().strftime('%m'),
-                            "dia": datetime.datetime.now().strftime('%d'),
-                            "ips": config_db.get("codigo_ips", ""),
-                            "nit": config_db.get("nit", ""),
-                            "nombreCarpeta": os.path.basename(carpeta_real)
-                        }
-                        
-                        # Renombrar archivo CUV
-                        if cfg.get('formato_cuv'):
-                            nuevo_nombre_cuv = apply_format(cfg.get('formato_cuv'), contexto)
-                            if nuevo_nombre_cuv:
-                                dir_cuv = os.path.dirname(archivo_cuv)
-                                nuevo_path_cuv = os.path.join(dir_cuv, nuevo_nombre_cuv)
-                                
-                                # Verificar si ya tiene el nombre correcto
-                                if os.path.basename(archivo_cuv) != nuevo_nombre_cuv:
-                                    if self._safe_move_or_write_json(archivo_cuv, nuevo_path_cuv):
-                                        renombrados['cuv'] += 1
-                                        print(f"  - Renombrado CUV: {os.path.basename(archivo_cuv)} -> {nuevo_nombre_cuv}")
-                                    else:
-                                        errores.append(f"Error renombrando CUV: {archivo_cuv}")
-                                else:
-                                    print(f"  - CUV ya tiene nombre correcto: {nuevo_nombre_cuv}")
-                                    renombrados['cuv'] += 1  # Contar como renombrado
-                        
-                    except Exception as e:
-                        errores.append(f"Error procesando CUV {archivo_cuv}: {e}")
-
-                # SEGUNDO: Procesar otros archivos (facturas, XML, PDF)
-                facturas = self.buscar_archivos_por_ext(carpeta_real, ['.json'])
-                facturas = [f for f in facturas if not any(cuv in f.lower() for cuv in ['_cuv', '_cuv_renamed'])]
-                
-                archivos_xml = self.buscar_archivos_por_ext(carpeta_real, ['.xml'])
-                archivos_pdf = self.buscar_archivos_por_ext(carpeta_real, ['.pdf'])
-
-                for fact in facturas:
-                    try:
-                        with open(fact, 'r', encoding='utf-8') as f:
-                            d = json.load(f)
-                    except Exception as e:
-                        errores.append(f"Error leyendo factura {fact}: {e}")
-                        continue
-                    
-                    num_factura = d.get("numFactura")
-                    if not num_factura:
-                        errores.append(f"Factura sin numFactura: {fact}")
-                        continue
-                    
-                    carpeta_actual = os.path.dirname(fact)
-                    proceso_id = ""  # Para otros archivos, no necesitamos ProcesoId
-                    
-                    # Buscar archivos asociados
-                    xml_asociado, pdf_asociado = self._obtener_archivos_asociados(
-                        num_factura, archivos_xml, archivos_pdf, carpeta_actual)
-                    
-                    # contexto para formateo
-                    contexto = {
-                        "numFactura": str(num_factura),
-                        "ProcesoId": proceso_id,
-                        "fecha": datetime.datetime.now().strftime('%Y%m%d'),
-                        "ano": datetime.datetime.now().strftime('%Y'),
-                        "mes": datetime.datetime.now().strftime('%m'),
-                        "dia": datetime.datetime.now().strftime('%d'),
-                        "ips": config_db.get("codigo_ips", ""),
-                        "nit": config_db.get("nit", ""),
-                        "nombreCarpeta": os.path.basename(carpeta_real)
-                    }
-                    
-                    # Renombrar factura JSON
-                    fmt_fact = cfg.get('formato_json')
-                    if fmt_fact:
-                        nuevo_nombre_fact = apply_format(fmt_fact, contexto)
-                        if nuevo_nombre_fact:
-                            dir_fact = os.path.dirname(fact)
-                            nuevo_path_fact = os.path.join(dir_fact, nuevo_nombre_fact)
-                            if os.path.basename(fact) != nuevo_nombre_fact:
-                                if self._safe_move_or_write_json(fact, nuevo_path_fact):
-                                    renombrados['fact'] += 1
-                                    print(f"  - Renombrada factura: {os.path.basename(fact)} -> {nuevo_nombre_fact}")
-                                else:
-                                    errores.append(f"Error renombrando factura: {fact}")
-                            else:
-                                print(f"  - Factura ya tiene nombre correcto: {nuevo_nombre_fact}")
-                                renombrados['fact'] += 1
-
-                    # Renombrar XML asociado si se encontró
-                    if xml_asociado and cfg.get('formato_xml'):
-                        nuevo_nombre_xml = apply_format(cfg.get('formato_xml'), contexto)
-                        if nuevo_nombre_xml:
-                            dir_xml = os.path.dirname(xml_asociado)
-                            nuevo_path_xml = os.path.join(dir_xml, nuevo_nombre_xml)
-                            if os.path.basename(xml_asociado) != nuevo_nombre_xml:
-                                if self._safe_move_or_write_json(xml_asociado, nuevo_path_xml):
-                                    renombrados['xml'] += 1
-                                    print(f"  - Renombrado XML: {os.path.basename(xml_asociado)} -> {nuevo_nombre_xml}")
-                                else:
-                                    errores.append(f"Error renombrando XML: {xml_asociado}")
-                            else:
-                                print(f"  - XML ya tiene nombre correcto: {nuevo_nombre_xml}")
-                                renombrados['xml'] += 1
-
-                    # Renombrar PDF asociado si se encontró
-                    if pdf_asociado and cfg.get('formato_pdf'):
-                        nuevo_nombre_pdf = apply_format(cfg.get('formato_pdf'), contexto)
-                        if nuevo_nombre_pdf:
-                            dir_pdf = os.path.dirname(pdf_asociado)
-                            nuevo_path_pdf = os.path.join(dir_pdf, nuevo_nombre_pdf)
-                            if os.path.basename(pdf_asociado) != nuevo_nombre_pdf:
-                                if self._safe_move_or_write_json(pdf_asociado, nuevo_path_pdf):
-                                    renombrados['pdf'] += 1
-                                    print(f"  - Renombrado PDF: {os.path.basename(pdf_asociado)} -> {nuevo_nombre_pdf}")
-                                else:
-                                    errores.append(f"Error renombrando PDF: {pdf_asociado}")
-                            else:
-                                print(f"  - PDF ya tiene nombre correcto: {nuevo_nombre_pdf}")
-                                renombrados['pdf'] += 1
+
+        # procesar carpetas
+        segundo_plano = presupuesto.prioridad == PRIORIDAD_SEGUNDO_PLANO and iniciar_segundo_plano()
+        try:
+            if cola is not None:
+                resultado = procesar_cola(cola, opciones_para, progreso=progreso)
+                resumen_cola = cola.resumen()
+            elif self.chk_modo_red.isChecked():
+                resultado = PipelineAsync(opciones, progreso=progreso).ejecutar(self.carpetas)
+            else:
+                resultado = procesar_carpetas(self.carpetas, opciones, progreso=progreso)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo completar el procesamiento: {e}")
+            self.btn_procesar.setEnabled(True)
+            self.progress_bar.setVisible(False)
+            return
+        finally:
+            if segundo_plano:
+                terminar_segundo_plano()
+            if cola is not None:
+                cola.cerrar()
+        renombrados = resultado.renombrados
+        ya_correctos = resultado.ya_correctos
+        modificados_cuv = resultado.modificados_cuv
+        sin_cambios_cuv = resultado.sin_cambios_cuv
+        identificados = resultado.identificados
+        errores = resultado.errores
+        carpetas_procesadas = resultado.carpetas_procesadas
 
         # fin procesamiento
         self.progress_updated.emit(100)
         QApplication.processEvents()
 
+        if guardar_historial:
+            self.bd.llamar(guardar_ejecucion, inicio, datetime.datetime.now(), cfg, len(carpetas_procesadas), resultado,
+                           al_terminar=lambda id_: print(f"Historial guardado en la BD (ejecución {id_}, "
+                                                         f"{len(resultado.historial)} archivos)"),
+                           al_fallar=lambda e: QMessageBox.warning(
+                               self, "Historial", f"No se pudo guardar el historial en la base de datos: {e}\n\n"
+                                                  "El registro .log sí se guardó."))
+
         # escribir log
         try:
             with open(archivo_log, 'w', encoding='utf-8') as f:
@@ -1187,8 +1723,38 @@ class RenombradorCUVWidget(QWidget):
                 f.write(f"Facturas JSON renombradas: {renombrados['fact']}\n")
                 f.write(f"Archivos XML renombrados: {renombrados['xml']}\n")
                 f.write(f"Archivos PDF renombrados: {renombrados['pdf']}\n")
+                f.write(f"Archivos que ya tenían su nombre final: CUV {ya_correctos['cuv']}, "
+                        f"facturas {ya_correctos['fact']}, XML {ya_correctos['xml']}, PDF {ya_correctos['pdf']}\n")
                 f.write(f"Archivos CUV modificados: {modificados_cuv}\n")
+                f.write(f"Archivos CUV sin cambios: {sin_cambios_cuv}\n")
+                if respaldo:
+                    f.write(f"Respaldo CUV: {respaldo.directorio} ({respaldo.total} archivos; "
+                            f"reflink {respaldo.metodos['reflink']}, enlace {respaldo.metodos['enlace']}, "
+                            f"copia {respaldo.metodos['copia']})\n")
+                if renombrar:
+                    f.write(f"Facturas identificadas por nombre: {identificados['nombre']} "
+                            f"(JSON leídos: {identificados['contenido']})\n")
+                    if resultado.llamadas_fs is not None:
+                        f.write(f"Llamadas al sistema de archivos (renombrado): {resultado.llamadas_fs}\n")
+                if self.presupuesto_io:
+                    f.write(f"Presupuesto de E/S: {self.presupuesto_io.resumen()}\n")
+                f.write(f"Reglas de recorrido: {reglas.descripcion()}\n")
+                if cola is not None:
+                    f.write(f"Cola compartida: {cola.nombre} ({cola.trabajador}); estado al terminar: "
+                            + ", ".join(f"{estado} {n}" for estado, n in sorted(resumen_cola.items())) + "\n")
                 f.write(f"Errores: {len(errores)}\n")
+                if resultado.raices_fusionadas:
+                    f.write("\n--- Carpetas fusionadas (repetidas o dentro de otra) ---\n")
+                    for carpeta, cubierta_por, motivo in resultado.raices_fusionadas:
+                        f.write(f"{carpeta} -> {cubierta_por} ({motivo})\n")
+                if reglas.omitidos:
+                    f.write("\n--- Carpetas omitidas ---\n")
+                    for ruta, motivo in sorted(reglas.omitidos):
+                        f.write(f"{ruta} ({motivo})\n")
+                if resultado.ajustes_concurrencia:
+                    f.write("\n--- Ajustes de concurrencia ---\n")
+                    for a in resultado.ajustes_concurrencia:
+                        f.write(f"{a}\n")
                 if errores:
                     f.write("\n--- Errores ---\n")
                     for e in errores:
@@ -1207,213 +1773,63 @@ class RenombradorCUVWidget(QWidget):
             f"<b>Facturas JSON renombradas:</b> {renombrados['fact']}<br/>"
             f"<b>Archivos XML renombrados:</b> {renombrados['xml']}<br/>"
             f"<b>Archivos PDF renombrados:</b> {renombrados['pdf']}<br/>"
+            f"<b>Ya tenían su nombre final:</b> {sum(ya_correctos.values())}<br/>"
             f"<b>Archivos CUV modificados:</b> {modificados_cuv}<br/>"
+            f"<b>Archivos CUV sin cambios:</b> {sin_cambios_cuv}<br/>"
             f"<b>Errores:</b> {len(errores)}<br/>"
-            f"<br/><b>Registro guardado en:</b><br/><code>{archivo_log}</code>"
+            + (f"<b>CUV respaldados:</b> {respaldo.total} en <code>{respaldo.directorio}</code><br/>" if respaldo else "")
+            + f"<br/><b>Registro guardado en:</b><br/><code>{archivo_log}</code>"
         )
         msg.exec_()
 
         # reset UI
         self.btn_procesar.setEnabled(True)
         self.progress_bar.setVisible(False)
+        # Los archivos cambiaron: se vuelve a preescanear por si se procesa otra vez
+        self.reprogramar_preescaneo()
     
     def buscar_archivos_cuv_mejorado(self, carpeta):
         """Busca archivos CUV de manera más efectiva"""
-        archivos_cuv = []
-        for raiz, _, archivos in os.walk(carpeta):
-            for archivo in archivos:
-                nombre_lower = archivo.lower()
-                # Buscar archivos que contengan 'cuv' y terminen en .json
-                if 'cuv' in nombre_lower and nombre_lower.endswith('.json'):
-                    archivos_cuv.append(os.path.join(raiz, archivo))
-        return sorted(archivos_cuv)
+        return buscar_archivos_cuv(carpeta)
     
     def extraer_proceso_id_desde_observaciones(self, observaciones):
         """Extrae el ProcesoId del texto de observaciones"""
-        try:
-            if not observaciones:
-                return None
-                
-            # Buscar el patrón "ProcesoId" seguido de números
-            import re
-            patron = r'ProcesoId\s*(\d+)'
-            match = re.search(patron, observaciones)
-            
-            if match:
-                return match.group(1)  # Devuelve el número encontrado
-            return None
-        except Exception:
-            return None
+        return extraer_proceso_id(observaciones)
+
+    def reglas_recorrido(self):
+        """Reglas de poda elegidas para esta ejecución"""
+        profundidad = self.spn_profundidad.value()
+        return ReglasRecorrido.desde_texto(self.txt_excluir.text(),
+                                           profundidad_maxima=None if profundidad < 0 else profundidad,
+                                           omitir_ocultos=self.chk_omitir_ocultos.isChecked())
+
+    def modo_modificacion_cuv(self):
+        """Devuelve el modo de modificación CUV elegido en la interfaz"""
+        if self.radio_eliminar_rechazados.isChecked():
+            return MODO_ELIMINAR_RECHAZADOS
+        if self.radio_eliminar_todo.isChecked():
+            return MODO_VACIAR
+        return None
 
-    def modificar_archivo_cuv(self, archivo_cuv):
-        """Modifica el archivo CUV según las opciones seleccionadas"""
-        try:
-            # Leer archivo CUV
-            with open(archivo_cuv, 'r', encoding='utf-8') as f:
-                datos_cuv = json.load(f)
-            
-            modificado = False
-            
-            # EXTRAER Y ACTUALIZAR ProcesoId DESDE OBSERVACIONES
-            proceso_id_actualizado = False
-            for resultado in datos_cuv.get('ResultadosValidacion', []):
-                observaciones = resultado.get('Observaciones', '')
-                if observaciones:
-                    proceso_id = self.extraer_proceso_id_desde_observaciones(observaciones)
-                    if proceso_id and proceso_id != datos_cuv.get('ProcesoId'):
-                        datos_cuv['ProcesoId'] = proceso_id
-                        proceso_id_actualizado = True
-                        print(f"  - Actualizado ProcesoId: {proceso_id}")
-                        break  # Solo necesitamos el primero que encontremos
-            
-            if self.radio_eliminar_rechazados.isChecked():
-                # Buscar elementos RECHAZADOS y el CUV
-                cuv_encontrado = None
-                validaciones_filtradas = []
-                
-                for r in datos_cuv.get('ResultadosValidacion', []):
-                    if r.get('Clase') == 'RECHAZADO':
-                        # Si es rechazado, buscar el CUV si es RVG02
-                        if r.get('Codigo') == 'RVG02':
-                            desc = r.get('Observaciones', '')
-                            try:
-                                cuv_start = desc.index("Ministerio de Salud; CUV ") + len("Ministerio de Salud; CUV ")
-                                cuv_end = desc.index(" del Documento")
-                                cuv_encontrado = desc[cuv_start:cuv_end].strip()
-                            except ValueError:
-                                pass
-                    else:
-                        # Mantener solo los no rechazados
-                        validaciones_filtradas.append(r)
-                
-                # Actualizar validaciones sin los rechazados
-                datos_cuv['ResultadosValidacion'] = validaciones_filtradas
-                
-                # Si encontramos CUV, actualizar estado
-                if cuv_encontrado:
-                    datos_cuv['CodigoUnicoValidacion'] = cuv_encontrado
-                    datos_cuv['ResultState'] = True
-                
-                modificado = True
-                
-            elif self.radio_eliminar_todo.isChecked():
-                # Vaciar array de validaciones y actualizar estado
-                datos_cuv['ResultadosValidacion'] = []
-                datos_cuv['ResultState'] = True
-                modificado = True
-            
-            # Si hubo modificaciones (ya sea en ProcesoId o en validaciones), guardar archivo
-            if modificado or proceso_id_actualizado:
-                with open(archivo_cuv, 'w', encoding='utf-8') as f:
-                    json.dump(datos_cuv, f, indent=4, ensure_ascii=False)
-                return True
-                
-            return False
-            
-        except Exception as e:
-            print(f"Error procesando archivo CUV {archivo_cuv}: {e}")
-            return False
+    def modificar_archivo_cuv(self, archivo_cuv, respaldo=None):
+        """Modifica el archivo CUV según las opciones seleccionadas.
+
+        Devuelve True si el archivo se reescribió y False si ya estaba
+        correcto (no se toca en disco). Si se pasa un RespaldoCUV, el archivo
+        se respalda justo antes de reemplazarlo.
+        """
+        resultado = modificar_cuv(archivo_cuv, self.modo_modificacion_cuv(),
+                                  respaldo=respaldo.respaldar if respaldo else None,
+                                  presupuesto=self.presupuesto_io)
+        return resultado == CUV_MODIFICADO
 
     def extraer_num_factura_de_nombre(self, nombre_archivo):
         """Extrae el número de factura del nombre del archivo CUV"""
-        try:
-            # Patrones comunes en nombres de archivos CUV
-            import re
-            patrones = [
-                r'(\d+)_cuv',           # 12345_cuv.json
-                r'cuv_(\d+)',           # cuv_12345.json  
-                r'(\d+)-cuv',           # 12345-cuv.json
-                r'cuv-(\d+)',           # cuv-12345.json
-                r'(\d+)\.',             # 12345.cuv.json
-            ]
-            
-            for patron in patrones:
-                match = re.search(patron, nombre_archivo.lower())
-                if match:
-                    return match.group(1)
-            
-            # Si no coincide con patrones, buscar cualquier número en el nombre
-            numeros = re.findall(r'\d+', nombre_archivo)
-            if numeros:
-                # Devolver el número más largo (probablemente el de factura)
-                return max(numeros, key=len)
-                
-            return None
-        except Exception:
-            return None
-    def es_archivo_ya_procesado(self, archivo, contexto, fmt_cuv, fmt_fact, fmt_xml, fmt_pdf):
-        """Verifica si un archivo ya tiene el nombre esperado (ya fue procesado)"""
-        nombre_archivo = os.path.basename(archivo)
-        
-        # Generar los nombres esperados
-        nombres_esperados = []
-        if archivo.endswith('_cuv.json') or 'CUV' in archivo.upper():
-            if fmt_cuv:
-                nombre_esperado = apply_format(fmt_cuv, contexto)
-                if nombre_esperado:
-                    nombres_esperados.append(nombre_esperado.lower())
-        elif archivo.endswith('.json') and not archivo.endswith('_cuv.json'):
-            if fmt_fact:
-                nombre_esperado = apply_format(fmt_fact, contexto)
-                if nombre_esperado:
-                    nombres_esperados.append(nombre_esperado.lower())
-        elif archivo.endswith('.xml'):
-            if fmt_xml:
-                nombre_esperado = apply_format(fmt_xml, contexto)
-                if nombre_esperado:
-                    nombres_esperados.append(nombre_esperado.lower())
-        elif archivo.endswith('.pdf'):
-            if fmt_pdf:
-                nombre_esperado = apply_format(fmt_pdf, contexto)
-                if nombre_esperado:
-                    nombres_esperados.append(nombre_esperado.lower())
-        
-        # Verificar si el archivo actual ya tiene uno de los nombres esperados
-        return nombre_archivo.lower() in nombres_esperados
+        return extraer_num_factura_de_nombre(nombre_archivo)
 
     def _safe_move_or_write_json(self, src_path, dest_path, json_obj=None):
         """Mover/renombrar archivo o escribir JSON de forma segura"""
-        try:
-            # Si el destino existe y es diferente al origen, eliminarlo
-            if os.path.exists(dest_path) and os.path.abspath(src_path) != os.path.abspath(dest_path):
-                try:
-                    os.remove(dest_path)
-                except Exception as e:
-                    print(f"Error eliminando archivo destino existente: {e}")
-                    return False
-            
-            if json_obj is not None:
-                # escribir JSON
-                with open(dest_path, 'w', encoding='utf-8') as fw:
-                    json.dump(json_obj, fw, ensure_ascii=False, indent=2)
-                
-                # Eliminar original si es diferente al destino
-                if (os.path.exists(src_path) and 
-                    os.path.abspath(src_path) != os.path.abspath(dest_path) and
-                    src_path != dest_path):
-                    try:
-                        os.remove(src_path)
-                    except Exception as e:
-                        print(f"Error eliminando archivo original: {e}")
-            else:
-                # mover/renombrar archivo
-                if os.path.abspath(src_path) != os.path.abspath(dest_path):
-                    try:
-                        os.rename(src_path, dest_path)
-                    except Exception:
-                        # si rename falla (cross-device), hacer copy+remove
-                        try:
-                            with open(src_path, 'rb') as fr, open(dest_path, 'wb') as fw:
-                                fw.write(fr.read())
-                            if os.path.exists(src_path) and os.path.abspath(src_path) != os.path.abspath(dest_path):
-                                os.remove(src_path)
-                        except Exception as e:
-                            print(f"Error en copia de archivo: {e}")
-                            return False
-            return True
-        except Exception as e:
-            print(f"Error en _safe_move_or_write_json: {e}")
-            return False
+        return mover_o_escribir_json(src_path, dest_path, json_obj, self.presupuesto_io)
 
 def leer_version():
     """Lee la versión desde version.txt si existe"""
@@ -1437,6 +1853,7 @@ class VentanaPrincipal(QMainWindow):
         self.setMinimumSize(700, 900)  # Reducido de 950 a 900
         self.setWindowIcon(QIcon.fromTheme("document-edit"))
         self.config_widget = None  # Referencia única a la pestaña de configuración
+        self._mensaje_estado = ""
         self.init_ui()
         self.verificar_licencia()
 
@@ -1463,6 +1880,16 @@ class VentanaPrincipal(QMainWindow):
         act_config.triggered.connect(self.mostrar_config)
         menu_herramientas.addAction(act_config)
 
+        act_restaurar = QAction("♻️ Restaurar respaldo CUV", self)
+        act_restaurar.triggered.connect(self.restaurar_respaldo_cuv)
+        menu_herramientas.addAction(act_restaurar)
+
+        act_historial = QAction("🔎 Historial de una factura", self)
+        act_historial.triggered.connect(self.mostrar_historial_factura)
+        menu_herramientas.addAction(act_historial)
+        if modo_offline() is not None:
+            act_historial.setEnabled(False)
+
         menu_ayuda = menu_bar.addMenu("❓ Ayuda")
         act_acerca = QAction("ℹ️ Acerca de", self)
         act_acerca.triggered.connect(self.mostrar_acerca)
@@ -1478,6 +1905,10 @@ class VentanaPrincipal(QMainWindow):
         act_contacto.triggered.connect(self.mostrar_contacto)
         menu_ayuda.addAction(act_contacto)
 
+        act_diagnostico = QAction("🩺 Diagnóstico de conexión", self)
+        act_diagnostico.triggered.connect(self.mostrar_diagnostico_conexion)
+        menu_ayuda.addAction(act_diagnostico)
+
         # widget central con pestañas
         self.tabs = QTabWidget()
         self.tabs.setTabPosition(QTabWidget.North)
@@ -1496,6 +1927,23 @@ class VentanaPrincipal(QMainWindow):
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Listo")
+        acceso_bd().ocupado.connect(self.indicar_bd_ocupada)
+        instantanea = modo_offline()
+        if instantanea is not None:
+            self.setWindowTitle("SERAF (sin conexión)")
+            lbl_offline = QLabel(f"📴 Sin conexión: configuración del {instantanea.fecha_texto()}")
+            lbl_offline.setStyleSheet("color: #e65100; padding: 0 6px;")
+            self.status_bar.addPermanentWidget(lbl_offline)
+
+    def indicar_bd_ocupada(self, ocupada):
+        """Cursor de actividad mientras hay consultas a la BD en segundo plano"""
+        if ocupada:
+            QApplication.setOverrideCursor(Qt.BusyCursor)
+            self._mensaje_estado = self.status_bar.currentMessage()
+            self.status_bar.showMessage("⏳ Consultando la base de datos...")
+        else:
+            QApplication.restoreOverrideCursor()
+            self.status_bar.showMessage(self._mensaje_estado)
 
     def verificar_licencia(self):
         """Verifica licencia y muestra contacto si hay problemas"""
@@ -1524,6 +1972,7 @@ class VentanaPrincipal(QMainWindow):
         """Muestra la pestaña de configuración, evitando duplicados"""
         if self.config_widget is None:
             self.config_widget = ConfiguracionWidget()
+            self.config_widget.configuraciones_cambiadas.connect(self.renombrador.reload_configs_into_combo)
             idx = self.tabs.addTab(self.config_widget, "⚙️ Configuración")
         else:
             # Si ya existe, buscar su índice y activarlo
@@ -1537,6 +1986,53 @@ class VentanaPrincipal(QMainWindow):
         
         self.tabs.setCurrentIndex(idx)
 
+    def mostrar_historial_factura(self):
+        """Cuándo y cómo se renombraron los archivos de una factura (historial en la BD)"""
+        num, ok = QInputDialog.getText(self, "Historial de una factura", "Número de factura:")
+        num = num.strip()
+        if not ok or not num:
+            return
+
+        def mostrar(filas):
+            if not filas:
+                QMessageBox.information(self, "Historial de una factura",
+                                        f"No hay registros de la factura {num}.\n\n"
+                                        "El historial se guarda solo con historial_bd = si en [procesamiento] de database.ini.")
+                return
+            lineas = []
+            for f in filas[-50:]:
+                fecha = f['fecha'].strftime('%d/%m/%Y %H:%M') if hasattr(f['fecha'], 'strftime') else f['fecha']
+                lineas.append(f"{fecha} · {f['equipo']} · {f['config'] or '-'}\n"
+                              f"   {f['tipo']} {f['estado']}: {f['nombre_origen']} -> {f['nombre_destino']}\n"
+                              f"   {f['directorio']}")
+            encabezado = f"{len(filas)} registros de la factura {num}"
+            if len(filas) > 50:
+                encabezado += " (se muestran los 50 más recientes)"
+            QMessageBox.information(self, "Historial de una factura", encabezado + ":\n\n" + "\n\n".join(lineas))
+
+        acceso_bd().llamar(buscar_factura, num, al_terminar=mostrar,
+                           al_fallar=lambda e: QMessageBox.critical(self, "Error", f"No se pudo consultar el historial: {e}"))
+
+    def restaurar_respaldo_cuv(self):
+        """Revierte una ejecución devolviendo los CUV desde su carpeta de respaldo"""
+        directorio = QFileDialog.getExistingDirectory(self, "Selecciona la carpeta Respaldo_CUV_...")
+        if not directorio:
+            return
+        resp = QMessageBox.question(self, "Restaurar respaldo",
+                                    f"Se sobrescribirán los CUV originales con el respaldo de:\n{directorio}\n\n"
+                                    "Los CUV que esa ejecución renombró vuelven a su nombre original.\n\n¿Continuar?")
+        if resp != QMessageBox.Yes:
+            return
+        try:
+            restaurados, errores = restaurar_respaldo(directorio)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"No se pudo restaurar el respaldo: {e}")
+            return
+        mensaje = f"Archivos CUV restaurados: {restaurados}\nErrores: {len(errores)}"
+        if errores:
+            mensaje += "\n\n" + "\n".join(errores[:20])
+        QMessageBox.information(self, "Restauración completada", mensaje)
+
     def mostrar_acerca(self):
         """Muestra información 'Acerca de' incluyendo la versión"""
         version = leer_version()
@@ -1564,6 +2060,36 @@ class VentanaPrincipal(QMainWindow):
                 "Se mostrará la información de contacto para obtener soporte.")
             self.mostrar_contacto()
 
+    def mostrar_diagnostico_conexion(self):
+        """Intentos, fallas y latencias de la conexión a la BD"""
+        from database_manager import DatabaseManager
+        d = DatabaseManager().diagnostico()
+        estados = {'cerrado': "✅ normal", 'abierto': "⛔ abierto (servidor no disponible)",
+                   'prueba': "⏳ probando de nuevo el servidor"}
+
+        def ms(valor):
+            return f"{valor:.0f} ms" if valor is not None else "-"
+
+        texto = (
+            f"Motor: {d['motor'] or '-'}\n"
+            f"Conectado: {'sí' if d['conectado'] else 'no'}\n"
+            f"Circuito: {estados.get(d['circuito'], d['circuito'])}\n\n"
+            f"Intentos de conexión: {d['intentos']}\n"
+            f"Reintentos: {d['reintentos']}\n"
+            f"Fallas: {d['fallos']}\n"
+            f"Rechazados sin intentar: {d['rechazados_por_circuito']}\n\n"
+            f"Latencia de conexión: última {ms(d['latencia_ultima_ms'])}, "
+            f"media {ms(d['latencia_media_ms'])}, máxima {ms(d['latencia_maxima_ms'])}"
+        )
+        texto += f"\n\nConsultas enviadas: {d['consultas_total']}"
+        if d['consultas_recientes']:
+            texto += "\nÚltimas acciones (consultas, tiempo):"
+            for accion, consultas, duracion in d['consultas_recientes'][-8:]:
+                texto += f"\n  {accion}: {consultas}, {duracion:.0f} ms"
+        if d['ultimo_error']:
+            texto += f"\n\nÚltimo error:\n{d['ultimo_error']}"
+        QMessageBox.information(self, "Diagnóstico de conexión", texto)
+
     def mostrar_contacto(self):
         """Muestra la información de contacto del soporte con link funcional"""
         contacto = (
@@ -1581,8 +2107,9 @@ class VentanaPrincipal(QMainWindow):
     def closeEvent(self, event):
         """Cerrar conexión a BD al salir"""
         from database_manager import DatabaseManager
-        db = DatabaseManager()
-        db.close_connection()
+        # La conexión se cierra en el hilo de la BD, después de lo que esté pendiente
+        acceso_bd().cerrar(DatabaseManager().close_connection)
+        self.renombrador.preescaneo.cerrar()
         event.accept()
 
 # -------------------------
@@ -1619,30 +2146,39 @@ def main():
         QMessageBox.critical(None, "Error", mensaje)
         sys.exit(1)
 
+    # Modo sin conexión pedido en database.ini: no se intenta conectar
+    if offline_forzado():
+        instantanea = instantanea_disponible()
+        if instantanea is None:
+            QMessageBox.critical(None, "Modo sin conexión",
+                                 "database.ini pide trabajar sin conexión ([procesamiento] modo_offline), "
+                                 "pero no hay una configuración guardada válida.\n\n"
+                                 "Abra SERAF una vez con conexión a la base de datos para guardarla.")
+            sys.exit(1)
+        activar_modo_offline(instantanea)
+
     # Verificar conexión a BD con firebirdsql - NUEVA IMPLEMENTACIÓN
     try:
-        print("🔍 Iniciando verificación de conexión a BD...")
+        if modo_offline() is None:
+            print("🔍 Iniciando verificación de conexión a BD...")
         
-        # Test de conexión simple usando DatabaseManager
-        from database_manager import DatabaseManager
-        db = DatabaseManager()
-        conn = db.get_connection()
+            # Test de conexión simple usando DatabaseManager
+            from database_manager import DatabaseManager
+            db = DatabaseManager()
+            sentencias = db.sentencias()
         
-        # Test de consulta simple para verificar que funciona
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM RDB$DATABASE")
-        resultado = cur.fetchone()
-        cur.close()
+            # Test de consulta simple para verificar que funciona
+            resultado = sentencias.ejecutar(sentencias.motor.SQL_PRUEBA).fetchone()
         
-        print(f"✅ Conexión a BD verificada correctamente. Resultado test: {resultado}")
+            print(f"✅ Conexión a BD verificada correctamente. Resultado test: {resultado}")
         
-        # Verificar también que config_manager funciona
-        from config_manager import list_configs
-        configs = list_configs()
-        print(f"✅ Config Manager funciona. Configuraciones encontradas: {len(configs)}")
+            # Verificar también que config_manager funciona
+            from config_manager import list_configs
+            configs = list_configs()
+            print(f"✅ Config Manager funciona. Configuraciones encontradas: {len(configs)}")
         
-        _CONFIG_MANAGER_OK = True
-        _CONFIG_MANAGER_ERROR_MSG = ""
+            _CONFIG_MANAGER_OK = True
+            _CONFIG_MANAGER_ERROR_MSG = ""
         
     except Exception as e:
         _CONFIG_MANAGER_OK = False
@@ -1828,10 +2364,20 @@ def main():
             "Web: www.rips2275.com"
         )
         
-        QMessageBox.critical(None, titulo, mensaje_final)
-        sys.exit(1)
+        # Con una instantánea válida se ofrece seguir sin conexión
+        instantanea = instantanea_disponible()
+        if instantanea is None:
+            QMessageBox.critical(None, titulo, mensaje_final)
+            sys.exit(1)
+        resp = QMessageBox.question(None, titulo,
+                                    f"{mensaje}¿Trabajar sin conexión con la configuración guardada el "
+                                    f"{instantanea.fecha_texto()}?\n\n"
+                                    "Se pueden usar las configuraciones existentes, pero no crearlas ni modificarlas.")
+        if resp != QMessageBox.Yes:
+            sys.exit(1)
+        activar_modo_offline(instantanea)
 
-    # Si llegamos aquí, la conexión es exitosa - Crear ventana principal
+    # Si llegamos aquí, hay conexión (o se eligió trabajar sin ella) - Crear ventana principal
     try:
         ventana = VentanaPrincipal()
         ventana.show()
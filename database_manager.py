@@ -1,17 +1,342 @@
 import configparser
 import os
-import firebirdsql  # CAMBIAR fdb por firebirdsql
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 import datetime
 from pathlib import Path
 
+# Límites de la conexión (sobrescribibles en [database] de database.ini)
+TIMEOUT_CONEXION = 5.0      # segundos para abrir el socket al servidor
+TIMEOUT_CONSULTA = 30.0     # segundos de espera de cada respuesta del servidor
+REINTENTOS = 2              # reintentos ante fallas de red transitorias
+ESPERA_REINTENTO = 0.5      # primera espera entre intentos; se duplica en cada uno
+FALLOS_PARA_ABRIR = 3       # intentos fallidos seguidos que abren el circuito
+SEGUNDOS_CIRCUITO = 30.0    # tiempo con el circuito abierto antes de volver a probar
+LATENCIAS_GUARDADAS = 50
+
+# Códigos de Firebird de fallas de red (se reintentan); el resto (credenciales,
+# ruta de la base) no se arregla reintentando
+_CODIGOS_RED = ('335544721', '335544722', '335544726', '335544741')
+
+
+class ServidorNoDisponible(Exception):
+    """El circuito está abierto: el servidor falló hace poco y no se intenta conectar"""
+
+
+def es_falla_de_red(error):
+    """True si el error es de red o tiempo de espera (vale la pena reintentar)"""
+    if isinstance(error, (socket.timeout, ConnectionError)):
+        return True
+    texto = str(error).lower()
+    return (any(codigo in texto for codigo in _CODIGOS_RED) or 'timed out' in texto or 'timeout' in texto
+            or 'network' in texto or 'connection reset' in texto or 'connection refused' in texto)
+
+
+class CircuitoConexion:
+    """Cortacircuitos de la conexión a la BD.
+
+    Cerrado: se intenta conectar. Tras FALLOS_PARA_ABRIR intentos fallidos
+    seguidos se abre y durante SEGUNDOS_CIRCUITO todo intento falla al
+    instante (sin esperar tiempos de red en cada clic). Pasado ese tiempo
+    se deja pasar un intento de prueba: si conecta se cierra, si no se
+    vuelve a abrir.
+    """
+
+    def __init__(self, fallos_para_abrir=FALLOS_PARA_ABRIR, segundos=SEGUNDOS_CIRCUITO, reloj=time.monotonic):
+        self.fallos_para_abrir = fallos_para_abrir
+        self.segundos = segundos
+        self._reloj = reloj
+        self.fallos_seguidos = 0
+        self.abierto_hasta = None
+
+    @property
+    def estado(self):
+        if self.abierto_hasta is None:
+            return 'cerrado'
+        return 'abierto' if self._reloj() < self.abierto_hasta else 'prueba'
+
+    def verificar(self):
+        if self.estado == 'abierto':
+            restante = self.abierto_hasta - self._reloj()
+            raise ServidorNoDisponible(
+                f"Servidor de base de datos no disponible (timeout tras {self.fallos_seguidos} intentos fallidos); "
+                f"se volverá a intentar en {restante:.0f} s")
+
+    def exito(self):
+        self.fallos_seguidos = 0
+        self.abierto_hasta = None
+
+    def fallo(self):
+        self.fallos_seguidos += 1
+        if self.estado == 'prueba' or self.fallos_seguidos >= self.fallos_para_abrir:
+            self.abierto_hasta = self._reloj() + self.segundos
+
+
+class ContadorConsultas:
+    """Cuenta las consultas enviadas al servidor (preparar y ejecutar) por
+    acción de la interfaz.
+
+    Dentro de `with contador_consultas.accion('nombre'):` cada consulta del
+    hilo suma a esa acción; al salir queda en `recientes` (nombre, consultas,
+    milisegundos) y en el total por nombre. Fuera de una acción solo suma
+    al total general.
+    """
+
+    def __init__(self, guardadas=LATENCIAS_GUARDADAS):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.total = 0
+        self.por_accion = {}   # nombre -> [veces, consultas]
+        self.recientes = deque(maxlen=guardadas)
+
+    def sumar(self, n=1):
+        with self._lock:
+            self.total += n
+        actual = getattr(self._local, 'accion', None)
+        if actual is not None:
+            actual[1] += n
+
+    @contextmanager
+    def accion(self, nombre):
+        anterior = getattr(self._local, 'accion', None)
+        actual = [nombre, 0]
+        self._local.accion = actual
+        inicio = time.monotonic()
+        try:
+            yield actual
+        finally:
+            self._local.accion = anterior
+            if anterior is not None:
+                anterior[1] += actual[1]
+            with self._lock:
+                veces = self.por_accion.setdefault(nombre, [0, 0])
+                veces[0] += 1
+                veces[1] += actual[1]
+                self.recientes.append((nombre, actual[1], (time.monotonic() - inicio) * 1000))
+
+    def ultima(self, nombre):
+        """Consultas de la última ejecución de la acción nombre, o None"""
+        with self._lock:
+            for accion, consultas, _ in reversed(self.recientes):
+                if accion == nombre:
+                    return consultas
+        return None
+
+
+contador_consultas = ContadorConsultas()
+
+
+class SentenciasConexion:
+    """Sentencias preparadas de una conexión, para no reenviar el mismo SQL.
+
+    Cada texto SQL se prepara la primera vez que se usa y después solo se
+    ejecuta con sus parámetros. Todo va por un único cursor: la conexión se
+    usa desde un solo hilo a la vez (ver bd_asincrona). Al reconectar se
+    crea otro SentenciasConexion (las sentencias son de la conexión).
+    """
+
+    def __init__(self, conexion, motor):
+        self.conexion = conexion
+        self.motor = motor
+        self.cursor = conexion.cursor()
+        self._preparadas = {}
+        self.verificadas = set()   # comprobaciones ya hechas en esta conexión (p. ej. tablas)
+
+    def _preparar(self, sql):
+        preparada = self._preparadas.get(sql)
+        if preparada is None:
+            preparada = self.motor.preparar(self.cursor, sql)
+            self._preparadas[sql] = preparada
+            if self.motor.prepara_en_servidor:
+                contador_consultas.sumar()
+        return preparada
+
+    def ejecutar(self, sql, params=()):
+        """Ejecuta sql (preparándolo si es la primera vez); devuelve el cursor para leer filas"""
+        self.cursor.execute(self._preparar(sql), params)
+        contador_consultas.sumar()
+        return self.cursor
+
+    def ejecutar_lote(self, sql, filas):
+        """executemany de sql con una sola preparación. SQLite lo resuelve en
+        una llamada; firebirdsql envía una ejecución por fila (no tiene envío
+        por lotes), pero sin volver a preparar."""
+        filas = list(filas)
+        if not filas:
+            return
+        self.cursor.executemany(self._preparar(sql), filas)
+        contador_consultas.sumar(len(filas) if self.motor.prepara_en_servidor else 1)
+
+    def ejecutar_directo(self, sql):
+        """Para lo que se ejecuta una sola vez (DDL): no se guarda preparado"""
+        self.cursor.execute(sql)
+        contador_consultas.sumar()
+
+    def cerrar(self, cerrar_conexion=False):
+        self._preparadas.clear()
+        try:
+            self.cursor.close()
+            if cerrar_conexion:
+                self.conexion.close()
+        except Exception:
+            pass
+
+
+# -------------------------
+# Motores de base de datos
+# -------------------------
+MOTOR_FIREBIRD = 'firebird'
+MOTOR_SQLITE = 'sqlite'
+
+
+class MotorFirebird:
+    """Servidor Firebird por red (la instalación habitual, con LST_IPS del sistema de la IPS)"""
+    nombre = MOTOR_FIREBIRD
+    prepara_en_servidor = True
+    COLUMNA_IDENTIDAD = "INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"
+    SQL_PRUEBA = "SELECT 1 FROM RDB$DATABASE"
+    SQL_TABLA_EXISTE = "SELECT COUNT(*) FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = ?"
+    # Hora del servidor (no la de cada equipo, que puede estar desfasada)
+    SQL_AHORA = "CURRENT_TIMESTAMP"
+    SQL_AHORA_MAS_SEGUNDOS = "DATEADD(SECOND, CAST(? AS INTEGER), CURRENT_TIMESTAMP)"
+
+    def descripcion(self, params):
+        return f"{params['host']}:{params['database']}"
+
+    def primera_fila(self, sql):
+        """SELECT que devuelve solo la primera fila"""
+        return self.primeras_filas(sql, 1)
+
+    def primeras_filas(self, sql, n):
+        return sql.replace("SELECT", f"SELECT FIRST {int(n)}", 1)
+
+    def preparar(self, cursor, sql):
+        return cursor.prep(sql)
+
+    def conectar(self, params):
+        # El controlador se importa aquí: con motor = sqlite no hace falta tenerlo instalado
+        try:
+            import firebirdsql  # CAMBIAR fdb por firebirdsql
+        except ImportError as e:
+            raise Exception(f"Error de Firebird: falta el controlador firebirdsql ({e}).\n\n"
+                            "Instálelo (pip install firebirdsql) o use motor = sqlite en database.ini.")
+        try:
+            # Sonda TCP con su propio límite: un host inalcanzable falla en
+            # timeout_conexion segundos y no en el tiempo de espera del sistema
+            socket.create_connection((params['host'], params['port']), params['timeout_conexion']).close()
+        except OSError as e:
+            raise Exception(f"Error de Firebird: no se puede conectar a host {params['host']}:{params['port']} "
+                            f"(timeout {params['timeout_conexion']:.0f} s): {e}\n\n"
+                            "Posible problema de conexión de red. Verifique:\n- Dirección IP del servidor\n"
+                            f"- Servicio Firebird ejecutándose\n- Firewall/puerto {params['port']}")
+        try:
+            # USAR FIREBIRDSQL EN LUGAR DE FDB
+            return firebirdsql.connect(
+                host=params['host'],
+                port=params['port'],
+                database=params['database'],
+                user=params['user'],
+                password=params['password'],
+                charset=params['charset'],
+                timeout=params['timeout_consulta']
+            )
+        except firebirdsql.OperationalError as e:
+            # Manejar errores específicos de Firebird
+            error_msg = f"Error de Firebird: {str(e)}"
+            if '335544721' in str(e) or '335544722' in str(e):
+                error_msg += "\n\nPosible problema de conexión de red. Verifique:\n- Dirección IP del servidor\n- Servicio Firebird ejecutándose\n- Firewall/puerto 3050"
+            elif '335544344' in str(e) or '335544345' in str(e):
+                error_msg += "\n\nArchivo de base de datos no encontrado. Verifique la ruta."
+            elif '335544472' in str(e):
+                error_msg += "\n\nCredenciales incorrectas. Verifique usuario y contraseña."
+            raise Exception(error_msg)
+        except Exception as e:
+            raise Exception(f"Error conectando a la base de datos: {str(e)}")
+
+
+class MotorSQLite:
+    """Archivo SQLite local: un solo equipo sin servidor ni red.
+
+    Tiene las mismas tablas que usa SERAF (configuraciones y LST_IPS, que se
+    crea vacía: sin datos se usan los valores por defecto hasta que se
+    cargue el código y NIT de la IPS). sqlite3 guarda sus propias sentencias
+    compiladas, así que preparar no hace nada.
+    """
+    nombre = MOTOR_SQLITE
+    prepara_en_servidor = False
+    COLUMNA_IDENTIDAD = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    SQL_PRUEBA = "SELECT 1"
+    SQL_TABLA_EXISTE = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    SQL_AHORA = "datetime('now', 'localtime')"
+    SQL_AHORA_MAS_SEGUNDOS = "datetime('now', 'localtime', '+' || ? || ' seconds')"
+    TABLA_IPS_SQL = "CREATE TABLE IF NOT EXISTS LST_IPS (COD_IPS VARCHAR(20), NRO_IDENT VARCHAR(20))"
+    _tipos_registrados = False
+
+    def descripcion(self, params):
+        return f"SQLite {os.path.abspath(params['database'])}"
+
+    def primera_fila(self, sql):
+        return self.primeras_filas(sql, 1)
+
+    def primeras_filas(self, sql, n):
+        return f"{sql} LIMIT {int(n)}"
+
+    def preparar(self, cursor, sql):
+        return sql
+
+    @classmethod
+    def _registrar_tipos(cls):
+        # Fechas como texto ISO (los adaptadores por defecto de sqlite3 están obsoletos)
+        if not cls._tipos_registrados:
+            sqlite3.register_adapter(datetime.datetime, lambda valor: valor.isoformat(" "))
+            sqlite3.register_converter("TIMESTAMP", lambda valor: datetime.datetime.fromisoformat(valor.decode()))
+            cls._tipos_registrados = True
+
+    def conectar(self, params):
+        self._registrar_tipos()
+        carpeta = os.path.dirname(os.path.abspath(params['database']))
+        if not os.path.isdir(carpeta):
+            raise Exception(f"Error de SQLite: la carpeta de la base de datos no existe: {carpeta}")
+        try:
+            # La conexión es una sola y la usan el hilo de la interfaz (al
+            # arrancar) y el de bd_asincrona, nunca a la vez
+            conexion = sqlite3.connect(params['database'], timeout=params['timeout_consulta'],
+                                       detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+            conexion.execute(self.TABLA_IPS_SQL)
+            conexion.commit()
+            return conexion
+        except sqlite3.Error as e:
+            raise Exception(f"Error de SQLite en {params['database']}: {e}")
+
+
+MOTORES = {MOTOR_FIREBIRD: MotorFirebird, MOTOR_SQLITE: MotorSQLite}
+
+
 class DatabaseManager:
     _instance = None
     _connection = None
+    _sentencias = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(DatabaseManager, cls).__new__(cls)
+            cls._instance._iniciar_diagnostico()
         return cls._instance
+
+    def _iniciar_diagnostico(self):
+        self._lock = threading.Lock()
+        self.circuito = CircuitoConexion()
+        self.intentos = 0
+        self.reintentos = 0
+        self.fallos = 0
+        self.rechazados_por_circuito = 0
+        self.latencias_conexion = deque(maxlen=LATENCIAS_GUARDADAS)  # segundos de cada conexión exitosa
+        self.ultimo_error = None
+        self.motor = None
     
     def get_db_params(self):
         """Obtiene parámetros de conexión desde database.ini"""
@@ -27,86 +352,178 @@ class DatabaseManager:
         
         db_config = config['database']
         
-        return {
-            'host': db_config.get('host', '127.0.0.1'),
-            'database': db_config.get('database', ''),
-            'user': db_config.get('user', 'SYSDBA'),
-            'password': db_config.get('password', ''),
-            'charset': db_config.get('charset', 'WIN1252')  # CAMBIAR A WIN1252
-        }
+        motor = db_config.get('motor', MOTOR_FIREBIRD).strip().lower()
+        if motor not in MOTORES:
+            raise Exception(f"Motor '{motor}' no soportado en database.ini (use {' o '.join(MOTORES)})")
+
+        try:
+            return {
+                'motor': motor,
+                'host': db_config.get('host', '127.0.0.1'),
+                'port': db_config.getint('port', 3050),
+                'database': db_config.get('database', 'seraf.db' if motor == MOTOR_SQLITE else ''),
+                'user': db_config.get('user', 'SYSDBA'),
+                'password': db_config.get('password', ''),
+                'charset': db_config.get('charset', 'WIN1252'),  # CAMBIAR A WIN1252
+                'timeout_conexion': db_config.getfloat('timeout_conexion', TIMEOUT_CONEXION),
+                'timeout_consulta': db_config.getfloat('timeout_consulta', TIMEOUT_CONSULTA),
+                'reintentos': db_config.getint('reintentos', REINTENTOS),
+            }
+        except ValueError as e:
+            raise Exception(f"Valor inválido en [database] de database.ini: {e}")
     
     def get_connection(self):
-        """Obtiene conexión singleton a la BD"""
+        """Obtiene conexión singleton a la BD.
+
+        Cada intento tiene tiempo límite; las fallas de red se reintentan con
+        espera exponencial y, si el servidor sigue caído, el circuito se abre
+        y las llamadas siguientes fallan al instante con ServidorNoDisponible.
+        """
         if self._connection is None:
             params = self.get_db_params()
             
             if not params['database']:
                 raise Exception("Ruta de base de datos no especificada en database.ini")
-            
-            try:
-                # USAR FIREBIRDSQL EN LUGAR DE FDB
-                self._connection = firebirdsql.connect(
-                    host=params['host'],
-                    database=params['database'],
-                    user=params['user'],
-                    password=params['password'],
-                    charset=params['charset']
-                )
-                print(f"Conexión exitosa a {params['host']}:{params['database']}")
-            except firebirdsql.OperationalError as e:
-                # Manejar errores específicos de Firebird
-                error_msg = f"Error de Firebird: {str(e)}"
-                if '335544721' in str(e) or '335544722' in str(e):
-                    error_msg += "\n\nPosible problema de conexión de red. Verifique:\n- Dirección IP del servidor\n- Servicio Firebird ejecutándose\n- Firewall/puerto 3050"
-                elif '335544344' in str(e) or '335544345' in str(e):
-                    error_msg += "\n\nArchivo de base de datos no encontrado. Verifique la ruta."
-                elif '335544472' in str(e):
-                    error_msg += "\n\nCredenciales incorrectas. Verifique usuario y contraseña."
-                raise Exception(error_msg)
-            except Exception as e:
-                raise Exception(f"Error conectando a la base de datos: {str(e)}")
-        
+            if self.motor is None or self.motor.nombre != params['motor']:
+                self.motor = MOTORES[params['motor']]()
+
+            with self._lock:
+                try:
+                    self.circuito.verificar()
+                except ServidorNoDisponible:
+                    self.rechazados_por_circuito += 1
+                    raise
+
+            espera = ESPERA_REINTENTO
+            for intento in range(params['reintentos'] + 1):
+                try:
+                    self._connection = self._conectar(params)
+                    break
+                except Exception as e:
+                    with self._lock:
+                        self.fallos += 1
+                        self.ultimo_error = str(e)
+                    if intento < params['reintentos'] and es_falla_de_red(e):
+                        print(f"Conexión fallida ({str(e).splitlines()[0]}); reintento en {espera:.1f} s")
+                        with self._lock:
+                            self.reintentos += 1
+                        time.sleep(espera)
+                        espera *= 2
+                        continue
+                    with self._lock:
+                        self.circuito.fallo()
+                    raise
+            with self._lock:
+                self.circuito.exito()
+
         return self._connection
+
+    def sentencias(self):
+        """SentenciasConexion de la conexión actual (conecta si hace falta)"""
+        conexion = self.get_connection()
+        if self._sentencias is None or self._sentencias.conexion is not conexion:
+            if self._sentencias is not None:
+                self._sentencias.cerrar()
+            self._sentencias = SentenciasConexion(conexion, self.motor)
+        return self._sentencias
+
+    def conexion_aparte(self):
+        """SentenciasConexion sobre una conexión propia, fuera del singleton.
+
+        Para quien necesita la BD desde otro hilo sin pasar por bd_asincrona
+        (p. ej. los latidos de cola_trabajo). Quien la pide la cierra con
+        cerrar(cerrar_conexion=True).
+        """
+        params = self.get_db_params()
+        if not params['database']:
+            raise Exception("Ruta de base de datos no especificada en database.ini")
+        motor = MOTORES[params['motor']]()
+        return SentenciasConexion(motor.conectar(params), motor)
+
+    def _conectar(self, params):
+        with self._lock:
+            self.intentos += 1
+        inicio = time.monotonic()
+        conexion = self.motor.conectar(params)
+        with self._lock:
+            self.latencias_conexion.append(time.monotonic() - inicio)
+        print(f"Conexión exitosa a {self.motor.descripcion(params)}")
+        return conexion
+
+    def registrar_falla_consulta(self, error):
+        """Ante una falla de red en una consulta descarta la conexión (la
+        siguiente llamada vuelve a conectar) y la cuenta para el circuito.
+        Devuelve True si la descartó. Las fallas al conectar ya se cuentan en
+        get_connection (sin conexión abierta no se cuenta otra vez)."""
+        if self._connection is None or not es_falla_de_red(error):
+            return False
+        with self._lock:
+            self.fallos += 1
+            self.ultimo_error = str(error)
+            self.circuito.fallo()
+        conexion, self._connection = self._connection, None
+        self._sentencias = None
+        if conexion is not None:
+            try:
+                conexion.close()
+            except Exception:
+                pass
+        return True
+
+    def diagnostico(self):
+        """Intentos, fallas y latencias de conexión, para mostrar en la interfaz"""
+        with self._lock:
+            latencias = list(self.latencias_conexion)
+            return {
+                'motor': self.motor.nombre if self.motor is not None else None,
+                'conectado': self._connection is not None,
+                'circuito': self.circuito.estado,
+                'fallos_seguidos': self.circuito.fallos_seguidos,
+                'intentos': self.intentos,
+                'reintentos': self.reintentos,
+                'fallos': self.fallos,
+                'rechazados_por_circuito': self.rechazados_por_circuito,
+                'latencia_ultima_ms': latencias[-1] * 1000 if latencias else None,
+                'latencia_media_ms': sum(latencias) / len(latencias) * 1000 if latencias else None,
+                'latencia_maxima_ms': max(latencias) * 1000 if latencias else None,
+                'ultimo_error': self.ultimo_error,
+                'consultas_total': contador_consultas.total,
+                'consultas_recientes': list(contador_consultas.recientes),
+            }
     
     def close_connection(self):
         """Cierra la conexión a la BD"""
+        if self._sentencias is not None:
+            self._sentencias.cerrar()
+            self._sentencias = None
         if self._connection:
             self._connection.close()
             self._connection = None
 
-def obtener_datos_ips():
-    """Obtiene los datos de IPS desde la tabla LST_IPS"""
+# Valores que se usan cuando LST_IPS no da datos (no son de ninguna IPS real)
+DATOS_IPS_POR_DEFECTO = {'codigo_ips': "890000000", 'nit': "900000000"}
+
+
+def leer_datos_ips():
+    """Datos de IPS de la tabla LST_IPS, o None si la consulta falla o la tabla está vacía"""
     db = DatabaseManager()
-    conn = None
     try:
-        conn = db.get_connection()
-        cur = conn.cursor()
-        
         # Consulta CORREGIDA - solo usa LST_IPS
-        cur.execute("""
-            SELECT FIRST 1 cod_ips, nro_ident 
-            FROM LST_IPS
-        """)
-        
-        resultado = cur.fetchone()
-        cur.close()
-        
-        if resultado:
-            return {
-                'codigo_ips': str(resultado[0]) if resultado[0] is not None else "",
-                'nit': str(resultado[1]) if resultado[1] is not None else ""
-            }
-        else:
-            # Si no encuentra datos en LST_IPS, retornar valores por defecto
-            return {
-                'codigo_ips': "890000000",
-                'nit': "900000000"
-            }
-            
+        sentencias = db.sentencias()
+        resultado = sentencias.ejecutar(sentencias.motor.primera_fila("SELECT cod_ips, nro_ident FROM LST_IPS")).fetchone()
     except Exception as e:
         print(f"Error obteniendo datos IPS desde LST_IPS: {e}")
-        # En caso de error, retornar valores por defecto
-        return {
-            'codigo_ips': "890000000",
-            'nit': "900000000"
-        }
\ No newline at end of file
+        db.registrar_falla_consulta(e)
+        return None
+    if not resultado:
+        return None
+    return {
+        'codigo_ips': str(resultado[0]) if resultado[0] is not None else "",
+        'nit': str(resultado[1]) if resultado[1] is not None else ""
+    }
+
+
+def obtener_datos_ips():
+    """Obtiene los datos de IPS desde la tabla LST_IPS (los valores por defecto si no hay)"""
+    datos = leer_datos_ips()
+    return datos if datos is not None else dict(DATOS_IPS_POR_DEFECTO)
\ No newline at end of file
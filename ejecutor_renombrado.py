@@ -0,0 +1,200 @@
+# ejecutor_renombrado.py
+import errno
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+# renameat: con src_dir_fd/dst_dir_fd solo en POSIX, donde rename ya reemplaza
+# el destino igual que os.replace. En Windows se usan rutas absolutas.
+SOPORTA_DIR_FD = os.rename in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY')
+
+TAMANO_BLOQUE_COPIA = 1024 * 1024
+# Descriptores de directorio abiertos a la vez (muy por debajo de RLIMIT_NOFILE)
+MAX_DIRECTORIOS_ABIERTOS = 16
+# Renombrados anunciados a partir de los cuales un directorio usa descriptor:
+# abrirlo y cerrarlo son dos llamadas más, que solo compensan con varios
+MINIMO_PARA_DIR_FD = 8
+
+
+class EjecutorRenombrado:
+    """Renombra archivos con el mínimo de llamadas al sistema de archivos.
+
+    Cada renombrado es una única llamada (os.replace, o renameat en POSIX):
+    reemplaza el destino si existe, igual que antes, pero sin el exists +
+    remove previos, y en un recurso de red es un solo viaje. Si el sistema
+    lo permite y anunciar() dijo que un directorio tendrá al menos
+    MINIMO_PARA_DIR_FD renombrados, se hacen relativos a un descriptor del
+    directorio, así el servidor no vuelve a resolver la ruta completa en
+    árboles profundos. Con menos se usa os.replace: con un solo renombrado,
+    abrir y cerrar el descriptor costaría tres llamadas en vez de una. El
+    descriptor se cierra cuando termina el último renombrado anunciado del
+    directorio, y nunca hay más de MAX_DIRECTORIOS_ABIERTOS abiertos: se
+    cierra el usado hace más tiempo.
+
+    contadores lleva la cuenta de las llamadas emitidas (replace, apertura y
+    cierre de directorios, copias de respaldo entre volúmenes) para poder
+    comprobar cuántas cuesta cada renombrado. Se puede usar desde varios
+    hilos. Con presupuesto (presupuesto_io.PresupuestoIO) cada llamada
+    espera su turno y la copia entre volúmenes se limita por bytes.
+    """
+
+    def __init__(self, usar_dir_fd=SOPORTA_DIR_FD, presupuesto=None, max_abiertos=MAX_DIRECTORIOS_ABIERTOS):
+        self.usar_dir_fd = usar_dir_fd
+        self.presupuesto = presupuesto
+        self.max_abiertos = max_abiertos
+        self.contadores = Counter()
+        self.renombrados = 0
+        self._dir_fds = OrderedDict()   # directorio -> fd, del usado hace más tiempo al más reciente
+        self._en_uso = Counter()        # directorio -> renombrados en curso con su fd
+        self._pendientes = Counter()    # directorio -> renombrados anunciados aún sin hacer
+        self._lock = threading.Lock()
+
+    def _contar(self, llamada, n=1):
+        with self._lock:
+            self.contadores[llamada] += n
+
+    def anunciar(self, directorios):
+        """Renombrados que vienen (un directorio por operación del plan)"""
+        with self._lock:
+            self._pendientes.update(directorios)
+
+    def _tomar_dir_fd(self, directorio):
+        """Descriptor para renombrar en directorio, o None si conviene os.replace"""
+        with self._lock:
+            fd = self._dir_fds.get(directorio)
+            if fd is None:
+                if self._pendientes[directorio] < MINIMO_PARA_DIR_FD:
+                    return None
+                self._cerrar_sobrantes(self.max_abiertos - 1)
+                fd = os.open(directorio, os.O_RDONLY | os.O_DIRECTORY)
+                self.contadores['open_dir'] += 1
+                self._dir_fds[directorio] = fd
+            else:
+                self._dir_fds.move_to_end(directorio)
+            self._en_uso[directorio] += 1
+            return fd
+
+    def _soltar(self, directorio, fd):
+        """Fin de un renombrado en directorio; cierra el descriptor con el último"""
+        with self._lock:
+            if fd is not None:
+                self._en_uso[directorio] -= 1
+                if self._en_uso[directorio] <= 0:
+                    del self._en_uso[directorio]
+            if self._pendientes[directorio] > 1:
+                self._pendientes[directorio] -= 1
+                return
+            del self._pendientes[directorio]
+            if directorio in self._dir_fds and directorio not in self._en_uso:
+                self._cerrar_fd(directorio)
+
+    def _cerrar_sobrantes(self, limite):
+        # Con el candado; los descriptores en uso por otro hilo no se tocan
+        for directorio in list(self._dir_fds):
+            if len(self._dir_fds) <= limite:
+                return
+            if directorio not in self._en_uso:
+                self._cerrar_fd(directorio)
+
+    def _cerrar_fd(self, directorio):
+        try:
+            os.close(self._dir_fds.pop(directorio))
+        except OSError:
+            pass
+        self.contadores['close_dir'] += 1
+
+    def renombrar(self, directorio, nombre_origen, nombre_destino):
+        """Renombra directorio/nombre_origen a directorio/nombre_destino.
+
+        directorio debe ser absoluto. Devuelve True si el archivo quedó con
+        el nombre nuevo.
+        """
+        if nombre_origen == nombre_destino:
+            self._soltar(directorio, None)
+            return True
+        if self.presupuesto is not None:
+            self.presupuesto.esperar_operacion()
+        fd = None
+        try:
+            if self.usar_dir_fd:
+                fd = self._tomar_dir_fd(directorio)
+            self._contar('replace')
+            if fd is not None:
+                os.rename(nombre_origen, nombre_destino, src_dir_fd=fd, dst_dir_fd=fd)
+            else:
+                os.replace(os.path.join(directorio, nombre_origen), os.path.join(directorio, nombre_destino))
+        except OSError as e:
+            print(f"Error renombrando {os.path.join(directorio, nombre_origen)}: {e}")
+            return False
+        finally:
+            self._soltar(directorio, fd)
+        with self._lock:
+            self.renombrados += 1
+        return True
+
+    def mover(self, origen, destino):
+        """Mueve entre rutas absolutas cualesquiera; si están en volúmenes
+        distintos copia y borra el original"""
+        directorio_origen, nombre_origen = os.path.split(origen)
+        directorio_destino, nombre_destino = os.path.split(destino)
+        if directorio_origen == directorio_destino:
+            return self.renombrar(directorio_origen, nombre_origen, nombre_destino)
+        if self.presupuesto is not None:
+            self.presupuesto.esperar_operacion()
+        try:
+            self._contar('replace')
+            os.replace(origen, destino)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                print(f"Error moviendo {origen}: {e}")
+                return False
+            # Volúmenes distintos: copy + remove
+            try:
+                self._contar('copia')
+                with open(origen, 'rb') as fr, open(destino, 'wb') as fw:
+                    if self.presupuesto is None:
+                        shutil.copyfileobj(fr, fw, TAMANO_BLOQUE_COPIA)
+                    else:
+                        self._copiar_limitado(fr, fw)
+                self._contar('unlink')
+                os.remove(origen)
+            except OSError as e:
+                print(f"Error en copia de archivo: {e}")
+                return False
+        with self._lock:
+            self.renombrados += 1
+        return True
+
+    def _copiar_limitado(self, fr, fw):
+        # Cada bloque cuenta dos veces: se lee del origen y se escribe en el destino
+        while True:
+            bloque = fr.read(TAMANO_BLOQUE_COPIA)
+            if not bloque:
+                return
+            self.presupuesto.cargar_bytes(len(bloque))
+            self.presupuesto.consumir_bytes(len(bloque))
+            fw.write(bloque)
+
+    def cerrar(self):
+        """Cierra los descriptores de directorio que queden abiertos (al
+        terminar cada carpeta, cuando ya no hay renombrados en curso) y olvida
+        lo anunciado que no se llegó a hacer"""
+        with self._lock:
+            for directorio in list(self._dir_fds):
+                self._cerrar_fd(directorio)
+            self._en_uso.clear()
+            self._pendientes.clear()
+
+    @property
+    def total_llamadas(self):
+        return sum(self.contadores.values())
+
+    def llamadas_por_renombrado(self):
+        return self.total_llamadas / self.renombrados if self.renombrados else 0.0
+
+    def resumen(self):
+        """Texto para el registro de la ejecución"""
+        detalle = ", ".join(f"{k} {v}" for k, v in sorted(self.contadores.items()))
+        return (f"{self.total_llamadas} llamadas para {self.renombrados} renombrados "
+                f"({self.llamadas_por_renombrado():.2f} por renombrado; {detalle or 'ninguna'})")
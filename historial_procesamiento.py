@@ -0,0 +1,153 @@
+# historial_procesamiento.py
+import configparser
+import getpass
+import os
+import socket
+
+from database_manager import DatabaseManager
+
+TABLA_EJECUCIONES = 'SERAF_EJECUCIONES'
+TABLA_ARCHIVOS = 'SERAF_HISTORIAL_ARCHIVOS'
+SECCION_INI = 'procesamiento'
+# Filas por transacción al guardar los archivos de una ejecución
+TAMANO_LOTE_HISTORIAL = 1000
+
+EJECUCIONES_SQL = f"""
+CREATE TABLE {TABLA_EJECUCIONES} (
+    ID {{identidad}},
+    FECHA_INICIO TIMESTAMP,
+    FECHA_FIN TIMESTAMP,
+    EQUIPO VARCHAR(100),
+    USUARIO VARCHAR(100),
+    CONFIG_ID INTEGER,
+    CONFIG_NOMBRE VARCHAR(100),
+    CARPETAS INTEGER,
+    RENOMBRADOS INTEGER,
+    CUV_MODIFICADOS INTEGER,
+    ERRORES INTEGER
+)
+"""
+
+ARCHIVOS_SQL = f"""
+CREATE TABLE {TABLA_ARCHIVOS} (
+    EJECUCION_ID INTEGER NOT NULL,
+    DIRECTORIO VARCHAR(1000),
+    TIPO VARCHAR(10),
+    NUM_FACTURA VARCHAR(50),
+    NOMBRE_ORIGEN VARCHAR(255),
+    NOMBRE_DESTINO VARCHAR(255),
+    ESTADO VARCHAR(20)
+)
+"""
+
+INDICES_SQL = (
+    f"CREATE INDEX IX_HISTORIAL_FACTURA ON {TABLA_ARCHIVOS} (NUM_FACTURA)",
+    f"CREATE INDEX IX_HISTORIAL_EJECUCION ON {TABLA_ARCHIVOS} (EJECUCION_ID)",
+)
+
+SQL_INSERTAR_EJECUCION = f"""
+    INSERT INTO {TABLA_EJECUCIONES}
+    (FECHA_INICIO, FECHA_FIN, EQUIPO, USUARIO, CONFIG_ID, CONFIG_NOMBRE, CARPETAS, RENOMBRADOS, CUV_MODIFICADOS, ERRORES)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    RETURNING ID
+"""
+
+SQL_INSERTAR_ARCHIVO = f"""
+    INSERT INTO {TABLA_ARCHIVOS}
+    (EJECUCION_ID, DIRECTORIO, TIPO, NUM_FACTURA, NOMBRE_ORIGEN, NOMBRE_DESTINO, ESTADO)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Largo de cada columna de SERAF_HISTORIAL_ARCHIVOS después de EJECUCION_ID
+_LARGOS_ARCHIVO = (1000, 10, 50, 255, 255, 20)
+
+COLUMNAS_BUSQUEDA = ('fecha', 'equipo', 'usuario', 'config', 'tipo', 'directorio',
+                     'nombre_origen', 'nombre_destino', 'estado')
+SQL_BUSCAR_FACTURA = f"""
+    SELECT e.FECHA_INICIO, e.EQUIPO, e.USUARIO, e.CONFIG_NOMBRE, a.TIPO, a.DIRECTORIO,
+           a.NOMBRE_ORIGEN, a.NOMBRE_DESTINO, a.ESTADO
+    FROM {TABLA_ARCHIVOS} a JOIN {TABLA_EJECUCIONES} e ON e.ID = a.EJECUCION_ID
+    WHERE a.NUM_FACTURA = ?
+    ORDER BY e.FECHA_INICIO, e.ID
+"""
+
+
+def historial_activo(ruta='database.ini'):
+    """True si database.ini pide guardar el historial ([procesamiento] historial_bd = si)"""
+    if not os.path.exists(ruta):
+        return False
+    config = configparser.ConfigParser()
+    config.read(ruta)
+    if SECCION_INI not in config:
+        return False
+    valor = config[SECCION_INI].get('historial_bd', '').strip().lower()
+    return valor in ('si', 'sí', 'true', '1', 'yes')
+
+
+def _sentencias():
+    """Sentencias de la conexión con las tablas del historial creadas (se
+    comprueba una vez por conexión)"""
+    sentencias = DatabaseManager().sentencias()
+    if TABLA_ARCHIVOS in sentencias.verificadas:
+        return sentencias
+    motor = sentencias.motor
+    creada = False
+    for tabla, ddl in ((TABLA_EJECUCIONES, EJECUCIONES_SQL), (TABLA_ARCHIVOS, ARCHIVOS_SQL)):
+        if sentencias.ejecutar(motor.SQL_TABLA_EXISTE, (tabla,)).fetchone()[0] == 0:
+            sentencias.ejecutar_directo(ddl.format(identidad=motor.COLUMNA_IDENTIDAD))
+            creada = True
+    if creada:
+        # Firebird no deja usar una tabla en la misma transacción que la crea
+        sentencias.conexion.commit()
+        for indice in INDICES_SQL:
+            try:
+                sentencias.ejecutar_directo(indice)
+            except Exception:
+                # Ignorar si el índice ya existe
+                pass
+        sentencias.conexion.commit()
+    sentencias.verificadas.add(TABLA_ARCHIVOS)
+    return sentencias
+
+
+def _recortar(fila):
+    return tuple(None if valor is None else str(valor)[:largo] for valor, largo in zip(fila, _LARGOS_ARCHIVO))
+
+
+def guardar_ejecucion(inicio, fin, config, carpetas, resultado, tamano_lote=TAMANO_LOTE_HISTORIAL):
+    """Guarda el encabezado de la ejecución y resultado.historial; devuelve el ID.
+
+    Los archivos se insertan con executemany en lotes de tamano_lote filas,
+    un commit por lote (el encabezado va con el primero): unas pocas
+    transacciones por ejecución, no una por archivo.
+    """
+    db = DatabaseManager()
+    sentencias = _sentencias()
+    try:
+        cur = sentencias.ejecutar(SQL_INSERTAR_EJECUCION, (
+            inicio, fin, socket.gethostname()[:100], getpass.getuser()[:100],
+            (config or {}).get('id'), ((config or {}).get('nombre') or "")[:100] or None,
+            carpetas, sum(resultado.renombrados.values()), resultado.modificados_cuv, len(resultado.errores)))
+        ejecucion_id = cur.fetchone()[0]
+        filas = resultado.historial
+        for desde in range(0, max(len(filas), 1), tamano_lote):
+            sentencias.ejecutar_lote(SQL_INSERTAR_ARCHIVO,
+                                     [(ejecucion_id,) + _recortar(f) for f in filas[desde:desde + tamano_lote]])
+            sentencias.conexion.commit()
+        return ejecucion_id
+    except Exception as e:
+        # Con la conexión caída no hay nada que deshacer: se descarta
+        if not db.registrar_falla_consulta(e):
+            sentencias.conexion.rollback()
+        raise
+
+
+def buscar_factura(num_factura):
+    """Qué se hizo con los archivos de la factura en cada ejecución, de la más antigua a la más reciente"""
+    db = DatabaseManager()
+    try:
+        filas = _sentencias().ejecutar(SQL_BUSCAR_FACTURA, (str(num_factura).strip(),)).fetchall()
+        return [dict(zip(COLUMNAS_BUSQUEDA, fila)) for fila in filas]
+    except Exception as e:
+        db.registrar_falla_consulta(e)
+        raise
@@ -0,0 +1,157 @@
+# identidad_factura.py
+import json
+import os
+import re
+import threading
+import zlib
+
+# Campo del JSON que identifica la factura en cada tipo de archivo
+CAMPO_CUV = 'NumFactura'
+CAMPO_FACTURA = 'numFactura'
+
+ORIGEN_NOMBRE = 'nombre'
+ORIGEN_CONTENIDO = 'contenido'
+
+# De los archivos identificados por nombre, uno de cada VERIFICAR_CADA se
+# abre igual para comprobar que el contenido dice lo mismo
+VERIFICAR_CADA = 25
+
+# Patrones comunes en nombres de archivos CUV, en orden de prioridad (gana el
+# primer patrón que coincide, no la coincidencia más a la izquierda)
+PATRONES_NUM_EN_NOMBRE = (
+    re.compile(r'(\d+)_cuv'),     # 12345_cuv.json
+    re.compile(r'cuv_(\d+)'),     # cuv_12345.json
+    re.compile(r'(\d+)-cuv'),     # 12345-cuv.json
+    re.compile(r'cuv-(\d+)'),     # cuv-12345.json
+    re.compile(r'(\d+)\.'),       # 12345.cuv.json
+)
+PATRON_NUMEROS = re.compile(r'\d+')
+
+
+def extraer_num_factura_de_nombre(nombre_archivo):
+    """Extrae el número de factura del nombre del archivo CUV (heurística)"""
+    try:
+        nombre = nombre_archivo.lower()
+        for patron in PATRONES_NUM_EN_NOMBRE:
+            match = patron.search(nombre)
+            if match:
+                return match.group(1)
+        # Si no coincide con patrones, devolver el número más largo (probablemente el de factura)
+        numeros = PATRON_NUMEROS.findall(nombre_archivo)
+        return max(numeros, key=len) if numeros else None
+    except Exception:
+        return None
+
+
+def leer_identidad_json(archivo, campo, presupuesto=None):
+    """Lee numFactura (según campo) y ProcesoId del contenido del archivo"""
+    return _leer_identidad(archivo, campo, presupuesto)[0]
+
+
+def _leer_identidad(archivo, campo, presupuesto=None):
+    if presupuesto is not None:
+        presupuesto.esperar_operacion()
+    with open(archivo, 'rb') as f:
+        contenido = f.read()
+    if presupuesto is not None:
+        presupuesto.cargar_bytes(len(contenido))
+    datos = json.loads(contenido.decode('utf-8'))
+    num = datos.get(campo)
+    proceso_id = datos.get("ProcesoId")
+    return (str(num).strip() if num else None,
+            str(proceso_id) if proceso_id else ""), len(contenido)
+
+
+def leer_identidades(archivos, campo):
+    """leer_identidad_json para un lote de archivos.
+
+    Pensada para ejecutarse en otro proceso: devuelve, en el mismo orden,
+    (num, proceso_id) o el texto del error, que sí se puede enviar de vuelta,
+    y el total de bytes leídos (para cargarlo al presupuesto de E/S).
+    """
+    leidos = []
+    total_bytes = 0
+    for archivo in archivos:
+        try:
+            identidad, n = _leer_identidad(archivo, campo)
+            leidos.append(identidad)
+            total_bytes += n
+        except Exception as e:
+            leidos.append(str(e))
+    return leidos, total_bytes
+
+
+class ResolutorIdentidad:
+    """Resuelve numFactura/ProcesoId de un archivo evitando abrirlo.
+
+    Primero intenta leerlos del nombre con la expresión compilada de la
+    plantilla (un archivo ya renombrado por SERAF los lleva en el nombre).
+    Solo se abre el JSON si el nombre no es concluyente (no coincide, la
+    plantilla no es reversible o no tiene texto fijo que la distinga de un
+    nombre cualquiera) o si le toca
+    la muestra de verificación (uno de cada verificar_cada, elegido por el
+    nombre para que la decisión no dependa del orden ni del hilo).
+    """
+
+    def __init__(self, plantilla, contexto_fijo, campo, verificar_cada=VERIFICAR_CADA, presupuesto=None):
+        self.plantilla = plantilla
+        self.presupuesto = presupuesto
+        self.contexto_fijo = contexto_fijo
+        self.campo = campo
+        self.verificar_cada = verificar_cada
+        self.necesita_proceso_id = campo == CAMPO_CUV and plantilla.usa('ProcesoId')
+        # El ProcesoId del nombre puede ser el de antes de modificar el CUV: se lee del contenido
+        self.por_nombre = bool(plantilla) and plantilla.distintiva(contexto_fijo) and not self.necesita_proceso_id
+        self.estadisticas = {ORIGEN_NOMBRE: 0, ORIGEN_CONTENIDO: 0, 'verificados': 0, 'discrepancias': 0}
+        # resolver se puede llamar desde varios hilos a la vez
+        self._lock = threading.Lock()
+
+    def toca_verificar(self, archivo):
+        """True si archivo está en la muestra que se abre aunque el nombre baste"""
+        if not self.verificar_cada:
+            return False
+        return zlib.crc32(os.path.basename(archivo).encode('utf-8')) % self.verificar_cada == 0
+
+    def _desde_nombre(self, archivo):
+        if not self.por_nombre:
+            return None
+        valores = self.plantilla.extraer(os.path.basename(archivo), self.contexto_fijo)
+        if not valores or not valores.get('numFactura'):
+            return None
+        return valores['numFactura'], valores.get('ProcesoId', "")
+
+    def requiere_contenido(self, archivo):
+        """True si resolver(archivo) puede necesitar abrir el JSON"""
+        return self._desde_nombre(archivo) is None or self.toca_verificar(archivo)
+
+    def resolver(self, archivo, leido=None):
+        """Devuelve (num_factura, proceso_id, origen); num_factura es None si
+        el archivo no trae número. Los errores de lectura se propagan.
+
+        leido es el resultado de leer_identidades para este archivo, si ya
+        se leyó por adelantado (en ese caso no se vuelve a abrir).
+        """
+        desde_nombre = self._desde_nombre(archivo)
+        if desde_nombre is not None and not self.toca_verificar(archivo):
+            with self._lock:
+                self.estadisticas[ORIGEN_NOMBRE] += 1
+            return desde_nombre[0], desde_nombre[1], ORIGEN_NOMBRE
+
+        if leido is None:
+            num, proceso_id = leer_identidad_json(archivo, self.campo, self.presupuesto)
+        elif isinstance(leido, str):
+            raise Exception(leido)
+        else:
+            num, proceso_id = leido
+        if self.campo != CAMPO_CUV:
+            proceso_id = ""  # Para otros archivos, no necesitamos ProcesoId
+        discrepancia = desde_nombre is not None and desde_nombre[0] != num
+        with self._lock:
+            self.estadisticas[ORIGEN_CONTENIDO] += 1
+            if desde_nombre is not None:
+                self.estadisticas['verificados'] += 1
+            if discrepancia:
+                self.estadisticas['discrepancias'] += 1
+        if discrepancia:
+            print(f"  - Nombre y contenido no coinciden en {archivo}: {desde_nombre[0]} / {num}")
+        return num, proceso_id, ORIGEN_CONTENIDO
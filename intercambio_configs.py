@@ -0,0 +1,125 @@
+# intercambio_configs.py
+import csv
+import datetime
+import json
+import os
+
+from plantillas_nombre import FORMATOS_CONFIG, validar_formatos
+
+# Columnas que viajan en el archivo (ID y fechas son de cada sede)
+CAMPOS = ('nombre', 'formato_xml', 'formato_pdf', 'formato_cuv', 'formato_json', 'activa')
+LARGO_NOMBRE = 100
+LARGO_FORMATO = 255
+VERSION_ARCHIVO = 1
+_VERDADEROS = ('1', 'si', 'sí', 'true', 'x', 'yes', 'activa')
+
+
+class ArchivoConfigsInvalido(Exception):
+    """El archivo no se pudo leer o tiene configuraciones con errores"""
+
+    def __init__(self, mensaje, errores=()):
+        super().__init__(mensaje)
+        self.errores = list(errores)
+
+
+def _es_csv(ruta):
+    return os.path.splitext(ruta)[1].lower() == '.csv'
+
+
+def _activa(valor):
+    if isinstance(valor, str):
+        return valor.strip().lower() in _VERDADEROS
+    return bool(valor)
+
+
+# -------------------------
+# Exportar
+# -------------------------
+def exportar_configs(configs, ruta):
+    """Escribe configs en JSON o CSV (según la extensión de ruta); devuelve cuántas"""
+    filas = [{campo: (bool(c.get(campo)) if campo == 'activa' else c.get(campo) or "") for campo in CAMPOS}
+             for c in configs]
+    temporal = ruta + '.tmp'
+    if _es_csv(ruta):
+        # utf-8-sig y ';' para que Excel en español lo abra sin asistente
+        with open(temporal, 'w', encoding='utf-8-sig', newline='') as f:
+            escritor = csv.DictWriter(f, fieldnames=CAMPOS, delimiter=';')
+            escritor.writeheader()
+            for fila in filas:
+                escritor.writerow(dict(fila, activa='si' if fila['activa'] else 'no'))
+    else:
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION_ARCHIVO,
+                       'exportado': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'configuraciones': filas}, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+    return len(filas)
+
+
+# -------------------------
+# Importar
+# -------------------------
+def leer_configs(ruta):
+    """Lee y valida todas las configuraciones del archivo antes de tocar la BD.
+
+    Devuelve la lista de dicts con CAMPOS. Si alguna fila tiene errores
+    lanza ArchivoConfigsInvalido con todos ellos (no se importa ninguna).
+    """
+    try:
+        if _es_csv(ruta):
+            with open(ruta, 'r', encoding='utf-8-sig', newline='') as f:
+                contenido = f.read()
+            try:
+                dialecto = csv.Sniffer().sniff(contenido.split('\n', 1)[0], delimiters=';,\t')
+            except csv.Error:
+                dialecto = csv.excel
+            filas = list(csv.DictReader(contenido.splitlines(), dialect=dialecto))
+        else:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            filas = datos.get('configuraciones') if isinstance(datos, dict) else datos
+            if not isinstance(filas, list) or not all(isinstance(fila, dict) for fila in filas):
+                raise ValueError("se esperaba una lista de configuraciones")
+    except (OSError, ValueError, csv.Error) as e:
+        raise ArchivoConfigsInvalido(f"No se pudo leer {ruta}: {e}")
+
+    configs = []
+    for fila in filas:
+        fila = {str(k).strip().lower(): v for k, v in fila.items() if k is not None}
+        config = {campo: ("" if fila.get(campo) is None else str(fila.get(campo)).strip())
+                  for campo in CAMPOS if campo != 'activa'}
+        config['activa'] = _activa(fila.get('activa', False))
+        configs.append(config)
+
+    errores = validar_configs(configs)
+    if errores:
+        raise ArchivoConfigsInvalido(f"{len(errores)} errores en {os.path.basename(ruta)}; no se importó nada",
+                                     errores)
+    return configs
+
+
+def validar_configs(configs):
+    """Errores de todas las filas (nombre, duplicados, largo y formatos)"""
+    errores = []
+    vistos = {}
+    activas = []
+    for i, c in enumerate(configs, start=1):
+        nombre = c.get('nombre', "")
+        etiqueta = f"Fila {i} ({nombre})" if nombre else f"Fila {i}"
+        if not nombre:
+            errores.append(f"{etiqueta}: nombre obligatorio")
+        elif len(nombre) > LARGO_NOMBRE:
+            errores.append(f"{etiqueta}: el nombre supera {LARGO_NOMBRE} caracteres")
+        elif nombre in vistos:
+            errores.append(f"{etiqueta}: nombre repetido (ya está en la fila {vistos[nombre]})")
+        else:
+            vistos[nombre] = i
+        for columna, (tipo, _) in FORMATOS_CONFIG.items():
+            if len(c.get(columna) or "") > LARGO_FORMATO:
+                errores.append(f"{etiqueta}: formato {tipo} supera {LARGO_FORMATO} caracteres")
+        errores.extend(f"{etiqueta}: {error}" for error in validar_formatos(c))
+        if c.get('activa'):
+            activas.append(i)
+    if len(activas) > 1:
+        errores.append(f"Solo una configuración puede estar activa (filas {', '.join(map(str, activas))})")
+    return errores
@@ -0,0 +1,1084 @@
+# motor_procesamiento.py
+import asyncio
+import datetime
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+from procesador_cuv import es_archivo_cuv, modificar_cuv, CUV_MODIFICADO
+from plantillas_nombre import PlantillaNombre, NombresEsperados
+from ejecutor_renombrado import EjecutorRenombrado
+from concurrencia_adaptativa import ControlConcurrencia
+from recorrido_paralelo import RecorridoParalelo, recorrer_en_serie, normalizar_raices
+from identidad_factura import (
+    ResolutorIdentidad, leer_identidades, CAMPO_CUV, CAMPO_FACTURA, ORIGEN_NOMBRE, ORIGEN_CONTENIDO
+)
+
+TIPOS_ARCHIVO = ('cuv', 'fact', 'xml', 'pdf')
+
+# Columna de la configuración que define el formato de cada tipo
+COLUMNA_FORMATO = {'cuv': 'formato_cuv', 'fact': 'formato_json', 'xml': 'formato_xml', 'pdf': 'formato_pdf'}
+
+_MENSAJE_RENOMBRADO = {'cuv': "Renombrado CUV", 'fact': "Renombrada factura",
+                       'xml': "Renombrado XML", 'pdf': "Renombrado PDF"}
+_MENSAJE_YA_CORRECTO = {'cuv': "CUV ya tiene nombre correcto", 'fact': "Factura ya tiene nombre correcto",
+                        'xml': "XML ya tiene nombre correcto", 'pdf': "PDF ya tiene nombre correcto"}
+_MENSAJE_ERROR = {'cuv': "Error renombrando CUV", 'fact': "Error renombrando factura",
+                  'xml': "Error renombrando XML", 'pdf': "Error renombrando PDF"}
+
+# Estado de cada archivo en el historial de la ejecución
+HISTORIAL_RENOMBRADO = 'renombrado'
+HISTORIAL_ERROR = 'error'
+HISTORIAL_CUV_MODIFICADO = 'cuv_modificado'
+
+
+# -------------------------
+# Opciones y resultado de una ejecución
+# -------------------------
+class OpcionesProcesamiento:
+    """Lo que se decidió en la interfaz para una ejecución"""
+
+    def __init__(self, renombrar=False, config=None, modo_cuv=None, respaldo=None, datos_ips=None,
+                 presupuesto=None, reglas=None, preescaneo=None, historial=False):
+        self.renombrar = bool(renombrar and config)
+        self.config = config
+        self.modo_cuv = modo_cuv
+        self.respaldo = respaldo
+        # PresupuestoIO que limita lecturas, escrituras y renombrados (None: sin límite)
+        self.presupuesto = presupuesto
+        # ReglasRecorrido: subcarpetas y archivos que no se recorren (None: todo)
+        self.reglas = reglas
+        # preescaneo.Preescaneo con lo ya inventariado y leído al agregar las carpetas
+        self.preescaneo = preescaneo
+        # True: se anota cada archivo tocado en resultado.historial (para guardarlo en la BD)
+        self.historial = historial
+        datos_ips = datos_ips or {}
+        ahora = datetime.datetime.now()
+        # Contexto común a toda la ejecución (se calcula una sola vez)
+        self.contexto_ejecucion = {
+            "fecha": ahora.strftime('%Y%m%d'),
+            "ano": ahora.strftime('%Y'),
+            "mes": ahora.strftime('%m'),
+            "dia": ahora.strftime('%d'),
+            "ips": datos_ips.get("codigo_ips", ""),
+            "nit": datos_ips.get("nit", ""),
+        }
+        self.plantillas = {tipo: PlantillaNombre((config or {}).get(columna))
+                           for tipo, columna in COLUMNA_FORMATO.items()}
+
+
+class ResultadoProcesamiento:
+    """Contadores y errores acumulados durante una ejecución"""
+
+    def __init__(self):
+        self.renombrados = dict.fromkeys(TIPOS_ARCHIVO, 0)
+        self.ya_correctos = dict.fromkeys(TIPOS_ARCHIVO, 0)
+        self.modificados_cuv = 0
+        self.sin_cambios_cuv = 0
+        self.identificados = {ORIGEN_NOMBRE: 0, ORIGEN_CONTENIDO: 0}
+        self.errores = []
+        self.carpetas_procesadas = set()
+        self.llamadas_fs = None  # resumen del EjecutorRenombrado de la ejecución
+        self.ajustes_concurrencia = []
+        self.raices_fusionadas = []  # (carpeta, carpeta que la cubre, motivo)
+        # (directorio, tipo, num_factura, nombre_origen, nombre_destino, estado), en el orden
+        # del plan; solo con OpcionesProcesamiento.historial
+        self.historial = []
+
+    def sumar(self, otro):
+        """Agrega a este resultado el de otra ejecución (p. ej. otra carpeta de la cola)"""
+        for tipo in TIPOS_ARCHIVO:
+            self.renombrados[tipo] += otro.renombrados[tipo]
+            self.ya_correctos[tipo] += otro.ya_correctos[tipo]
+        for origen in self.identificados:
+            self.identificados[origen] += otro.identificados.get(origen, 0)
+        self.modificados_cuv += otro.modificados_cuv
+        self.sin_cambios_cuv += otro.sin_cambios_cuv
+        self.errores.extend(otro.errores)
+        self.carpetas_procesadas |= otro.carpetas_procesadas
+        self.ajustes_concurrencia.extend(otro.ajustes_concurrencia)
+        self.raices_fusionadas.extend(otro.raices_fusionadas)
+        self.historial.extend(otro.historial)
+
+
+# -------------------------
+# Inventario y operaciones de archivo
+# -------------------------
+class InventarioCarpeta:
+    """Archivos de una carpeta clasificados en un solo recorrido"""
+
+    def __init__(self, carpeta, cuv, facturas, xml, pdf):
+        self.carpeta = carpeta
+        self.cuv = cuv
+        self.facturas = facturas
+        self.xml = xml
+        self.pdf = pdf
+
+
+def inventariar_carpeta(carpeta, recorrido=None, al_encontrar_cuv=None, reglas=None):
+    """Recorre la carpeta una vez y separa CUV, facturas JSON, XML y PDF.
+
+    Con recorrido (RecorridoParalelo) los directorios se listan en paralelo;
+    reglas (ReglasRecorrido) poda lo excluido sin listarlo.
+    al_encontrar_cuv(ruta) se llama con cada CUV en cuanto aparece, antes de
+    que termine el recorrido. Las listas del inventario van ordenadas, así
+    que el resultado no depende del orden en que se listó.
+    """
+    cuv, facturas, xml, pdf = [], [], [], []
+    recorrer = recorrido.recorrer if recorrido is not None else recorrer_en_serie
+    for raiz, archivos in recorrer(carpeta, reglas):
+        for a in archivos:
+            nombre_lower = a.lower()
+            ruta = os.path.join(raiz, a)
+            if es_archivo_cuv(a):
+                cuv.append(ruta)
+                if al_encontrar_cuv is not None:
+                    al_encontrar_cuv(ruta)
+            elif nombre_lower.endswith('.json'):
+                if not any(c in ruta.lower() for c in ['_cuv', '_cuv_renamed']):
+                    facturas.append(ruta)
+            elif nombre_lower.endswith('.xml'):
+                xml.append(ruta)
+            elif nombre_lower.endswith('.pdf'):
+                pdf.append(ruta)
+    return InventarioCarpeta(carpeta, sorted(cuv), sorted(facturas), sorted(xml), sorted(pdf))
+
+
+def buscar_archivos_por_ext(carpeta, exts, recorrido=None, reglas=None):
+    """Busca archivos por extensión"""
+    encontrados = []
+    recorrer = recorrido.recorrer if recorrido is not None else recorrer_en_serie
+    for raiz, archivos in recorrer(carpeta, reglas):
+        for a in archivos:
+            nombre_lower = a.lower()
+            if any(nombre_lower.endswith(e.lower()) for e in exts):
+                encontrados.append(os.path.join(raiz, a))
+    return sorted(encontrados)  # Ordenar para procesar en orden consistente
+
+
+def obtener_archivos_asociados(num_factura, archivos_xml, archivos_pdf, carpeta_actual):
+    """Busca archivos XML y PDF asociados a una factura"""
+    xml_asociado = None
+    pdf_asociado = None
+
+    # Buscar por número de factura en el nombre
+    num_str = str(num_factura)
+    for archivo_xml in archivos_xml:
+        if num_str in os.path.basename(archivo_xml):
+            xml_asociado = archivo_xml
+            break
+
+    for archivo_pdf in archivos_pdf:
+        if num_str in os.path.basename(archivo_pdf):
+            pdf_asociado = archivo_pdf
+            break
+
+    # Si no se encontró, buscar en la misma carpeta que la factura
+    if not xml_asociado:
+        xmls_carpeta = [x for x in archivos_xml if os.path.dirname(x) == carpeta_actual]
+        if xmls_carpeta:
+            xml_asociado = xmls_carpeta[0]
+
+    if not pdf_asociado:
+        pdfs_carpeta = [p for p in archivos_pdf if os.path.dirname(p) == carpeta_actual]
+        if pdfs_carpeta:
+            pdf_asociado = pdfs_carpeta[0]
+
+    return xml_asociado, pdf_asociado
+
+
+def mover_o_escribir_json(src_path, dest_path, json_obj=None, presupuesto=None):
+    """Mover/renombrar archivo o escribir JSON de forma segura"""
+    try:
+        src_abs = os.path.abspath(src_path)
+        dest_abs = os.path.abspath(dest_path)
+        if json_obj is not None:
+            # escribir JSON (abrir con 'w' ya reemplaza el destino)
+            texto = json.dumps(json_obj, ensure_ascii=False, indent=2)
+            if presupuesto is not None:
+                presupuesto.esperar_operacion()
+                presupuesto.consumir_bytes(len(texto.encode('utf-8')))
+            with open(dest_abs, 'w', encoding='utf-8') as fw:
+                fw.write(texto)
+
+            # Eliminar original si es diferente al destino
+            if src_abs != dest_abs:
+                try:
+                    os.remove(src_abs)
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    print(f"Error eliminando archivo original: {e}")
+            return True
+        if src_abs == dest_abs:
+            return True
+        return EjecutorRenombrado(usar_dir_fd=False, presupuesto=presupuesto).mover(src_abs, dest_abs)
+    except Exception as e:
+        print(f"Error en mover_o_escribir_json: {e}")
+        return False
+
+
+class OperacionRenombrado:
+    """Un renombrado planificado dentro de un directorio.
+
+    Las rutas se calculan al planificar (el inventario ya trae rutas
+    absolutas) para no repetir abspath/join al ejecutar.
+    """
+    __slots__ = ('tipo', 'directorio', 'nombre_origen', 'nombre_destino', 'origen', 'destino', 'num_factura',
+                 '_claves')
+
+    def __init__(self, tipo, origen, nombre_destino, num_factura=None):
+        self.tipo = tipo
+        self.num_factura = num_factura
+        self.origen = os.path.abspath(origen)
+        self.directorio, self.nombre_origen = os.path.split(self.origen)
+        self.nombre_destino = nombre_destino
+        self.destino = os.path.join(self.directorio, nombre_destino)
+        self._claves = (os.path.normcase(self.origen), os.path.normcase(self.destino))
+
+    def ejecutar(self, ejecutor):
+        return ejecutor.renombrar(self.directorio, self.nombre_origen, self.nombre_destino)
+
+    def claves(self):
+        """Rutas que toca la operación; dos operaciones que comparten alguna
+        deben ejecutarse en el orden del plan"""
+        return self._claves
+
+
+class NotaPlan:
+    """Entrada del plan que no toca disco: un mensaje, un error o un archivo
+    que ya tenía su nombre final. Va en el plan para registrarse en su
+    lugar, entre los renombrados."""
+    __slots__ = ('mensaje', 'error', 'ya_correcto')
+
+    def __init__(self, mensaje=None, error=None, ya_correcto=None):
+        self.mensaje = mensaje
+        self.error = error
+        self.ya_correcto = ya_correcto
+
+    def ejecutar(self, ejecutor):
+        return None
+
+
+def operaciones_del_plan(plan):
+    return [e for e in plan if isinstance(e, OperacionRenombrado)]
+
+
+def aplicar_modificacion(archivo_cuv, opciones):
+    """Modifica un CUV según opciones; devuelve (archivo, estado, error).
+
+    No necesita el inventario de la carpeta, por eso se puede lanzar
+    mientras el recorrido aún no termina.
+    """
+    respaldo = opciones.respaldo
+    try:
+        estado = modificar_cuv(archivo_cuv, opciones.modo_cuv,
+                               respaldo=respaldo.respaldar if respaldo else None,
+                               presupuesto=opciones.presupuesto)
+        return archivo_cuv, estado, None
+    except Exception as e:
+        return archivo_cuv, None, e
+
+
+# -------------------------
+# Lógica por carpeta
+# -------------------------
+class ProcesadorCarpeta:
+    """Pasos del procesamiento de una carpeta, separados según hagan E/S o no.
+
+    modificar/resolver_* leen o escriben archivos y se pueden ejecutar en
+    paralelo. planificar_* devuelven el plan (renombrados y notas) sin
+    tocar disco ni contadores; registrar_* actualizan contadores y mensajes
+    y se llaman siempre en el orden del plan, así el resultado es el mismo
+    que el de una ejecución en serie.
+    """
+
+    def __init__(self, inventario, opciones, resultado, leidos=None):
+        self.inv = inventario
+        self.opciones = opciones
+        self.resultado = resultado
+        # Contenido ya leído por adelantado (preescaneo): {ruta: (num, proceso_id) o error}
+        self.leidos = dict(leidos or {})
+        self.plantillas = opciones.plantillas
+        self.contexto_carpeta = dict(opciones.contexto_ejecucion,
+                                     nombreCarpeta=os.path.basename(inventario.carpeta))
+        self.resolutor_cuv = ResolutorIdentidad(self.plantillas['cuv'], self.contexto_carpeta, CAMPO_CUV,
+                                                presupuesto=opciones.presupuesto)
+        self.resolutor_fact = ResolutorIdentidad(self.plantillas['fact'], self.contexto_carpeta, CAMPO_FACTURA,
+                                                 presupuesto=opciones.presupuesto)
+        self.nombres_esperados = NombresEsperados(self.plantillas, self.contexto_carpeta)
+        self.nombres_esperados.agregar_existentes(
+            os.path.basename(a) for a in inventario.facturas + inventario.xml + inventario.pdf)
+
+    # --- Modificación CUV ---
+    def modificar(self, archivo_cuv):
+        """E/S: aplica la modificación; devuelve (archivo, estado, error)"""
+        return aplicar_modificacion(archivo_cuv, self.opciones)
+
+    def registrar_modificacion(self, archivo_cuv, estado, error):
+        if error is not None or estado == CUV_MODIFICADO:
+            self.leidos.pop(archivo_cuv, None)  # lo leído antes ya no es el contenido actual
+        if error is not None:
+            self.resultado.errores.append(f"Error modificando CUV {archivo_cuv}: {error}")
+        elif estado == CUV_MODIFICADO:
+            self.resultado.modificados_cuv += 1
+            if self.opciones.historial:
+                directorio, nombre = os.path.split(os.path.abspath(archivo_cuv))
+                self.resultado.historial.append((directorio, 'cuv', None, nombre, nombre, HISTORIAL_CUV_MODIFICADO))
+            print(f"  - Modificado: {os.path.basename(archivo_cuv)}")
+        else:
+            self.resultado.sin_cambios_cuv += 1
+            print(f"  - Sin cambios: {os.path.basename(archivo_cuv)}")
+
+    # --- Renombrado CUV ---
+    def cuv_por_resolver(self):
+        """CUV cuyo nombre final aún no se conoce (sin abrir ningún JSON)"""
+        pendientes = []
+        for archivo_cuv in self.inv.cuv:
+            # Los de la muestra de verificación se abren aunque el nombre sea el final
+            if (self.nombres_esperados.identificar(os.path.basename(archivo_cuv), ('cuv',))
+                    and not self.resolutor_cuv.toca_verificar(archivo_cuv)):
+                self.resultado.ya_correctos['cuv'] += 1
+            else:
+                pendientes.append(archivo_cuv)
+        return pendientes
+
+    def resolver_cuv(self, archivo_cuv, leido=None):
+        """E/S: número de factura y ProcesoId; devuelve (archivo, num, proceso_id, error)"""
+        if leido is None:
+            leido = self.leidos.get(archivo_cuv)
+        try:
+            num, proceso_id, _ = self.resolutor_cuv.resolver(archivo_cuv, leido)
+            return archivo_cuv, num, proceso_id, None
+        except Exception as e:
+            return archivo_cuv, None, None, e
+
+    def planificar_cuv(self, resueltos):
+        plan = []
+        plantilla = self.plantillas['cuv']
+        for archivo_cuv, num_factura, proceso_id, error in resueltos:
+            if error is not None:
+                plan.append(NotaPlan(mensaje=f"Error leyendo CUV {archivo_cuv}: {error}"))
+                continue
+            if not num_factura:
+                plan.append(NotaPlan(mensaje=f"  - No se pudo extraer número de factura de: {archivo_cuv}"))
+                continue
+            self.nombres_esperados.registrar(num_factura, proceso_id)
+            contexto = dict(self.contexto_carpeta, numFactura=str(num_factura), ProcesoId=proceso_id)
+            self._planificar(plan, 'cuv', archivo_cuv, plantilla, contexto)
+        return plan
+
+    # --- Renombrado de facturas, XML y PDF ---
+    def facturas_por_resolver(self):
+        pendientes = []
+        for fact in self.inv.facturas:
+            # Factura con nombre final y su XML/PDF ya renombrados: nada que hacer
+            ya = self.nombres_esperados.identificar(os.path.basename(fact), ('fact',))
+            if (ya and self.nombres_esperados.completo(ya[1], ('xml', 'pdf'))
+                    and not self.resolutor_fact.toca_verificar(fact)):
+                for tipo in ('fact', 'xml', 'pdf'):
+                    if tipo in self.nombres_esperados.plantillas:
+                        self.resultado.ya_correctos[tipo] += 1
+                continue
+            pendientes.append(fact)
+        return pendientes
+
+    def resolver_factura(self, fact, leido=None):
+        """E/S: devuelve (archivo, num, proceso_id, error)"""
+        if leido is None:
+            leido = self.leidos.get(fact)
+        try:
+            num, proceso_id, _ = self.resolutor_fact.resolver(fact, leido)
+            return fact, num, proceso_id, None
+        except Exception as e:
+            return fact, None, None, e
+
+    def planificar_facturas(self, resueltos):
+        plan = []
+        for fact, num_factura, proceso_id, error in resueltos:
+            if error is not None:
+                plan.append(NotaPlan(error=f"Error leyendo factura {fact}: {error}"))
+                continue
+            if not num_factura:
+                plan.append(NotaPlan(error=f"Factura sin numFactura: {fact}"))
+                continue
+
+            # Buscar archivos asociados
+            xml_asociado, pdf_asociado = obtener_archivos_asociados(
+                num_factura, self.inv.xml, self.inv.pdf, os.path.dirname(fact))
+
+            contexto = dict(self.contexto_carpeta, numFactura=str(num_factura), ProcesoId=proceso_id)
+            self._planificar(plan, 'fact', fact, self.plantillas['fact'], contexto)
+            if xml_asociado:
+                self._planificar(plan, 'xml', xml_asociado, self.plantillas['xml'], contexto)
+            if pdf_asociado:
+                self._planificar(plan, 'pdf', pdf_asociado, self.plantillas['pdf'], contexto)
+        return plan
+
+    def _planificar(self, plan, tipo, archivo, plantilla, contexto):
+        if not plantilla:
+            return
+        nuevo_nombre = plantilla.render(contexto)
+        if not nuevo_nombre:
+            return
+        if os.path.basename(archivo) == nuevo_nombre:
+            plan.append(NotaPlan(mensaje=f"  - {_MENSAJE_YA_CORRECTO[tipo]}: {nuevo_nombre}", ya_correcto=tipo))
+            return
+        plan.append(OperacionRenombrado(tipo, archivo, nuevo_nombre, contexto.get('numFactura')))
+
+    def registrar(self, entrada, ok):
+        """Registra una entrada del plan; ok es el resultado de ejecutarla"""
+        if isinstance(entrada, NotaPlan):
+            if entrada.mensaje:
+                print(entrada.mensaje)
+            if entrada.error:
+                self.resultado.errores.append(entrada.error)
+            if entrada.ya_correcto:
+                self.resultado.ya_correctos[entrada.ya_correcto] += 1
+        else:
+            self.registrar_renombrado(entrada, ok)
+
+    def registrar_renombrado(self, op, ok):
+        if self.opciones.historial:
+            self.resultado.historial.append((op.directorio, op.tipo, op.num_factura, op.nombre_origen,
+                                             op.nombre_destino, HISTORIAL_RENOMBRADO if ok else HISTORIAL_ERROR))
+        if ok:
+            self.resultado.renombrados[op.tipo] += 1
+            if op.tipo == 'cuv' and self.opciones.respaldo is not None:
+                # Para que restaurar el respaldo deshaga también el renombrado
+                self.opciones.respaldo.anotar_renombrado(op.origen, op.destino)
+            print(f"  - {_MENSAJE_RENOMBRADO[op.tipo]}: {os.path.basename(op.origen)} -> {os.path.basename(op.destino)}")
+        else:
+            self.resultado.errores.append(f"{_MENSAJE_ERROR[op.tipo]}: {op.origen}")
+
+    def cerrar(self):
+        for resolutor in (self.resolutor_cuv, self.resolutor_fact):
+            for origen in self.resultado.identificados:
+                self.resultado.identificados[origen] += resolutor.estadisticas[origen]
+
+
+def _normalizar_raices(carpetas, opciones, resultado):
+    """Quita carpetas repetidas o anidadas antes de recorrer nada"""
+    raices, fusiones = normalizar_raices(carpetas, opciones.reglas)
+    for carpeta, cubierta_por, motivo in fusiones:
+        print(f"Carpeta {carpeta} omitida ({motivo}: {cubierta_por})")
+    resultado.raices_fusionadas.extend(fusiones)
+    return raices
+
+
+def _tomar_preescaneo(carpeta, opciones):
+    """(inventario, leidos) preescaneados y vigentes para carpeta, o (None, None)"""
+    if opciones.preescaneo is None:
+        return None, None
+    previo = opciones.preescaneo.tomar(carpeta, opciones.reglas)
+    if previo is None:
+        return None, None
+    if opciones.reglas is not None and previo.reglas is not opciones.reglas:
+        opciones.reglas.omitidos.extend(previo.reglas.omitidos)
+    print(f"Usando preescaneo de {carpeta}")
+    return previo.inventario, previo.leidos
+
+
+def _validar_carpeta(carpeta, resultado):
+    """Devuelve la ruta absoluta a procesar, o None si no existe o está repetida"""
+    if not os.path.exists(carpeta):
+        resultado.errores.append(f"Carpeta no existe: {carpeta}")
+        return None
+    carpeta_real = os.path.abspath(carpeta)
+    if carpeta_real in resultado.carpetas_procesadas:
+        return None
+    resultado.carpetas_procesadas.add(carpeta_real)
+    return carpeta_real
+
+
+def _inventariar_si_existe(carpeta, recorrido=None, al_encontrar_cuv=None, reglas=None):
+    if not os.path.exists(carpeta):
+        return None
+    return inventariar_carpeta(carpeta, recorrido, al_encontrar_cuv, reglas)
+
+
+def _dentro_de(ruta, carpeta):
+    ruta = os.path.normcase(os.path.abspath(ruta))
+    carpeta = os.path.normcase(os.path.abspath(carpeta))
+    return ruta == carpeta or ruta.startswith(carpeta.rstrip(os.sep) + os.sep)
+
+
+def _anunciar_plan(ejecutor, plan):
+    """Avisa al ejecutor cuántos renombrados tendrá cada directorio"""
+    ejecutor.anunciar(op.directorio for op in operaciones_del_plan(plan))
+
+
+def _anunciar_inventario(inv):
+    print(f"Procesando carpeta: {inv.carpeta}")
+    print(f"  - Archivos CUV encontrados: {len(inv.cuv)}")
+    for cuv in inv.cuv:
+        print(f"    * {os.path.basename(cuv)}")
+
+
+# -------------------------
+# Ejecución en serie
+# -------------------------
+def procesar_inventario(inv, opciones, resultado, ejecutor, leidos=None):
+    """Procesa una carpeta ya inventariada, un archivo tras otro"""
+    _anunciar_inventario(inv)
+    p = ProcesadorCarpeta(inv, opciones, resultado, leidos)
+
+    # MODIFICAR ARCHIVOS CUV (si está activado)
+    if opciones.modo_cuv:
+        for archivo_cuv in inv.cuv:
+            p.registrar_modificacion(*p.modificar(archivo_cuv))
+
+    # RENOMBRAR ARCHIVOS (si está activado y hay configuración)
+    if opciones.renombrar:
+        # PRIMERO: archivos CUV
+        plan = p.planificar_cuv([p.resolver_cuv(a) for a in p.cuv_por_resolver()])
+        _anunciar_plan(ejecutor, plan)
+        for entrada in plan:
+            p.registrar(entrada, entrada.ejecutar(ejecutor))
+        # SEGUNDO: facturas, XML y PDF
+        plan = p.planificar_facturas([p.resolver_factura(f) for f in p.facturas_por_resolver()])
+        _anunciar_plan(ejecutor, plan)
+        for entrada in plan:
+            p.registrar(entrada, entrada.ejecutar(ejecutor))
+        p.cerrar()
+        ejecutor.cerrar()
+
+
+def procesar_carpetas(carpetas, opciones, progreso=None, umbral_lotes=None, ejecutor=None):
+    """Procesa las carpetas una tras otra; progreso(hechas, total) antes de cada una.
+
+    Las carpetas con al menos umbral_lotes archivos JSON se procesan por
+    lotes (ProcesadorLotes); el resultado es el mismo. ejecutor permite
+    compartir un EjecutorRenombrado entre varias llamadas (su resumen
+    acumula todas).
+    """
+    resultado = ResultadoProcesamiento()
+    ejecutor = ejecutor or EjecutorRenombrado(presupuesto=opciones.presupuesto)
+    lotes = None
+    umbral_lotes = UMBRAL_LOTES if umbral_lotes is None else umbral_lotes
+    carpetas = _normalizar_raices(carpetas, opciones, resultado)
+    total = len(carpetas)
+    try:
+        for idx, carpeta in enumerate(carpetas):
+            if progreso:
+                progreso(idx, total)
+            carpeta_real = _validar_carpeta(carpeta, resultado)
+            if carpeta_real is None:
+                continue
+            inv, leidos = _tomar_preescaneo(carpeta_real, opciones)
+            if inv is None:
+                inv = inventariar_carpeta(carpeta_real, reglas=opciones.reglas)
+            if umbral_lotes and len(inv.cuv) + len(inv.facturas) >= umbral_lotes:
+                if lotes is None:
+                    lotes = ProcesadorLotes(ejecutor, presupuesto=opciones.presupuesto)
+                lotes.procesar(inv, opciones, resultado, leidos)
+            else:
+                procesar_inventario(inv, opciones, resultado, ejecutor, leidos)
+    finally:
+        if lotes is not None:
+            lotes.cerrar()
+            resultado.ajustes_concurrencia.extend(lotes.historial())
+        ejecutor.cerrar()
+    resultado.llamadas_fs = ejecutor.resumen()
+    return resultado
+
+
+# -------------------------
+# Carpetas grandes: por lotes dentro de la carpeta
+# -------------------------
+UMBRAL_LOTES = 2000
+TAMANO_LOTE = 500
+LOTES_EN_VUELO = 4
+OPERACIONES_INICIALES = 8
+
+
+# Resultado ya disponible para las notas del plan, que no se ejecutan
+_SIN_EJECUCION = Future()
+_SIN_EJECUCION.set_result([None])
+
+
+class ProcesadorLotes:
+    """Procesa una carpeta muy grande repartiendo el trabajo por lotes.
+
+    Cada fase (modificar CUV, renombrar CUV, renombrar facturas) recorre la
+    lista de archivos en lotes de tamano_lote: inventario -> lectura de los
+    JSON (pool de procesos, el parseo es CPU) -> asociación y nombres (en
+    este hilo, en orden) -> renombrado (pool de hilos). Entre etapas solo
+    hay unos pocos lotes pendientes, así la memoria no crece con el tamaño
+    de la carpeta. Cuántos lotes se analizan a la vez y cuántas operaciones
+    de archivo van en paralelo lo decide ControlConcurrencia según la
+    latencia observada.
+
+    Los contadores y mensajes se registran en el orden del plan, y un
+    renombrado que toca la ruta de un archivo aún no leído se aplaza hasta
+    el final de la fase, igual que en serie, donde toda la lectura va antes
+    que los renombrados. El resultado coincide con procesar_inventario.
+    """
+
+    def __init__(self, ejecutor, max_procesos=None, max_hilos=None, tamano_lote=TAMANO_LOTE, adaptativo=True,
+                 presupuesto=None):
+        self.ejecutor = ejecutor
+        self.presupuesto = presupuesto
+        self.max_procesos = max_procesos or os.cpu_count() or 1
+        self.max_hilos = max_hilos or min(32, (os.cpu_count() or 1) + 4)
+        self.tamano_lote = tamano_lote
+        self.control_operaciones = ControlConcurrencia(
+            'operaciones de archivo', OPERACIONES_INICIALES, maximo=self.max_hilos, adaptativo=adaptativo)
+        # Lotes en análisis a la vez: hasta dos por proceso para que ninguno quede ocioso
+        self.control_analisis = ControlConcurrencia(
+            'análisis JSON', min(LOTES_EN_VUELO, self.max_procesos), maximo=self.max_procesos * 2,
+            adaptativo=adaptativo)
+        self._procesos = None
+        self._hilos = None
+
+    def _pool_procesos(self):
+        if self._procesos is None:
+            self._procesos = ProcessPoolExecutor(max_workers=self.max_procesos)
+        return self._procesos
+
+    def _pool_hilos(self):
+        if self._hilos is None:
+            self._hilos = ThreadPoolExecutor(max_workers=self.max_hilos)
+        return self._hilos
+
+    def cerrar(self):
+        for pool in (self._procesos, self._hilos):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        self._procesos = self._hilos = None
+
+    def historial(self):
+        return self.control_operaciones.historial + self.control_analisis.historial
+
+    def _enviar(self, tipo, funcion, *args):
+        """Envía una operación de archivo al pool de hilos respetando el límite actual"""
+        control = self.control_operaciones
+        control.adquirir()
+
+        def tarea():
+            inicio = time.monotonic()
+            try:
+                return funcion(*args)
+            finally:
+                control.medir(time.monotonic() - inicio, tipo)
+                control.liberar()
+        return self._pool_hilos().submit(tarea)
+
+    def procesar(self, inv, opciones, resultado, leidos=None):
+        _anunciar_inventario(inv)
+        p = ProcesadorCarpeta(inv, opciones, resultado, leidos)
+
+        if opciones.modo_cuv:
+            self._modificar(p, inv.cuv)
+
+        if opciones.renombrar:
+            self._fase(p, p.cuv_por_resolver(), p.resolutor_cuv, CAMPO_CUV, p.resolver_cuv, p.planificar_cuv)
+            self._fase(p, p.facturas_por_resolver(), p.resolutor_fact, CAMPO_FACTURA,
+                       p.resolver_factura, p.planificar_facturas)
+            p.cerrar()
+        self.ejecutor.cerrar()
+
+    def _modificar(self, p, archivos):
+        ventana = deque()
+        for archivo in archivos:
+            ventana.append(self._enviar('modificar', p.modificar, archivo))
+            if len(ventana) >= self.tamano_lote * LOTES_EN_VUELO:
+                p.registrar_modificacion(*ventana.popleft().result())
+        while ventana:
+            p.registrar_modificacion(*ventana.popleft().result())
+
+    def _leer_lote(self, lote, resolutor, campo, ya_leidos):
+        por_leer = [a for a in lote if a not in ya_leidos and resolutor.requiere_contenido(a)]
+        if not por_leer:
+            return lote, por_leer, None
+        # El presupuesto no se comparte con otros procesos: las lecturas del
+        # lote se piden aquí y los bytes se cargan cuando el lote vuelve
+        if self.presupuesto is not None:
+            self.presupuesto.esperar_operacion(len(por_leer))
+        futuro = self._pool_procesos().submit(leer_identidades, por_leer, campo)
+        # Desde el envío: incluye la espera en el pool, que es lo que crece si hay demasiados lotes
+        enviado = time.monotonic()
+
+        def terminado(f):
+            self.control_analisis.medir(time.monotonic() - enviado, 'lectura', operaciones=len(por_leer))
+            if self.presupuesto is not None and not f.cancelled() and f.exception() is None:
+                self.presupuesto.cargar_bytes(f.result()[1])
+        futuro.add_done_callback(terminado)
+        return lote, por_leer, futuro
+
+    def _fase(self, p, archivos, resolutor, campo, resolver, planificar):
+        lotes = [archivos[i:i + self.tamano_lote] for i in range(0, len(archivos), self.tamano_lote)]
+        # Rutas que todavía no se han leído: ningún renombrado puede tocarlas antes
+        sin_leer = {os.path.normcase(os.path.abspath(a)) for a in archivos}
+        lecturas = deque()
+        siguiente = 0
+        registros = deque()   # (entrada, futuro del grupo, posición) en orden del plan
+        futuro_de_clave = {}
+        aplazadas = []
+        claves_aplazadas = set()
+
+        def registrar_listos(limite):
+            # Por encima del límite se espera al más antiguo: eso frena la lectura
+            while registros:
+                entrada, futuro, pos = registros[0]
+                if futuro is None:
+                    break  # aplazada: se conoce al final de la fase
+                if len(registros) <= limite and not futuro.done():
+                    break
+                registros.popleft()
+                p.registrar(entrada, futuro.result()[pos])
+
+        while siguiente < len(lotes) or lecturas:
+            # Lectura: mantener tantos lotes en el pool de procesos como permita el control
+            while siguiente < len(lotes) and (not lecturas or len(lecturas) < self.control_analisis.limite):
+                lecturas.append(self._leer_lote(lotes[siguiente], resolutor, campo, p.leidos))
+                siguiente += 1
+            lote, por_leer, futuro = lecturas.popleft()
+            leidos = dict(zip(por_leer, futuro.result()[0])) if futuro else {}
+            sin_leer.difference_update(os.path.normcase(os.path.abspath(a)) for a in lote)
+
+            # Asociación y nombres, en orden
+            plan = planificar([resolver(a, leidos.get(a)) for a in lote])
+            _anunciar_plan(self.ejecutor, plan)
+
+            # Renombrado: grupos independientes al pool de hilos
+            inmediatas = []
+            posicion_aplazada = {}
+            for op in operaciones_del_plan(plan):
+                claves = op.claves()
+                if any(c in sin_leer or c in claves_aplazadas for c in claves):
+                    posicion_aplazada[id(op)] = len(aplazadas)
+                    aplazadas.append(op)
+                    claves_aplazadas.update(claves)
+                else:
+                    inmediatas.append(op)
+            futuro_de_op = {}
+            for grupo in agrupar_operaciones(inmediatas):
+                ops = [op for _, op in grupo]
+                for c in {c for op in ops for c in op.claves()}:
+                    anterior = futuro_de_clave.get(c)
+                    if anterior is not None:
+                        anterior.result()  # un lote anterior aún toca esa ruta
+                futuro = self._enviar('renombrar', self._ejecutar_grupo, ops)
+                for pos, op in enumerate(ops):
+                    futuro_de_op[id(op)] = (futuro, pos)
+                    for c in op.claves():
+                        futuro_de_clave[c] = futuro
+            for entrada in plan:
+                if id(entrada) in posicion_aplazada:
+                    registros.append((entrada, None, posicion_aplazada[id(entrada)]))
+                else:
+                    registros.append((entrada,) + futuro_de_op.get(id(entrada), (_SIN_EJECUCION, 0)))
+            registrar_listos(self.tamano_lote * LOTES_EN_VUELO)
+            futuro_de_clave = {c: f for c, f in futuro_de_clave.items() if not f.done()}
+
+        # Fin de la fase: esperar lo enviado, aplicar lo aplazado en orden y registrar el resto
+        for futuro in set(futuro_de_clave.values()):
+            futuro.result()
+        if aplazadas:
+            futuro_aplazadas = self._enviar('renombrar', self._ejecutar_grupo, aplazadas)
+            registros = deque((entrada, futuro_aplazadas if futuro is None else futuro, pos)
+                              for entrada, futuro, pos in registros)
+        registrar_listos(0)
+
+    def _ejecutar_grupo(self, operaciones):
+        return [op.ejecutar(self.ejecutor) for op in operaciones]
+
+
+# -------------------------
+# Ejecución asíncrona (recursos de red)
+# -------------------------
+CONCURRENCIA_RED = 64
+CONCURRENCIA_RED_INICIAL = 8
+CARPETAS_EN_VUELO = 4
+
+
+def agrupar_operaciones(operaciones):
+    """Agrupa las operaciones que comparten alguna ruta.
+
+    Cada grupo conserva el orden del plan y debe ejecutarse en serie; grupos
+    distintos son independientes y pueden ir en paralelo.
+    """
+    grupo_de_clave = {}
+    grupos = []
+    for indice, op in enumerate(operaciones):
+        if not isinstance(op, OperacionRenombrado):
+            continue  # las notas del plan no se ejecutan
+        existentes = {grupo_de_clave[c] for c in op.claves() if c in grupo_de_clave}
+        if not existentes:
+            destino = len(grupos)
+            grupos.append([])
+        else:
+            destino = min(existentes)
+            for otro in sorted(existentes - {destino}):
+                grupos[destino].extend(grupos[otro])
+                for _, o in grupos[otro]:
+                    for c in o.claves():
+                        grupo_de_clave[c] = destino
+                grupos[otro] = []
+            grupos[destino].sort(key=lambda par: par[0])
+        grupos[destino].append((indice, op))
+        for c in op.claves():
+            grupo_de_clave[c] = destino
+    return [g for g in grupos if g]
+
+
+class PipelineAsync:
+    """Procesamiento con muchas operaciones de archivo en vuelo a la vez.
+
+    Pensado para recursos compartidos SMB, donde cada stat/open/rename cuesta
+    un viaje de red: inventario, lectura, transformación y renombrado son
+    etapas unidas por colas acotadas, y cada operación de archivo se delega a
+    un pool de hilos. Cuántas operaciones van a la vez (hasta concurrencia)
+    lo ajusta ControlConcurrencia según la latencia del recurso. Los
+    directorios de cada carpeta se listan en paralelo (RecorridoParalelo) y
+    la modificación de cada CUV empieza en cuanto el recorrido lo encuentra.
+    Los contadores se actualizan en el orden del plan, por lo que el
+    resultado es el mismo que el de procesar_carpetas.
+    """
+
+    def __init__(self, opciones, concurrencia=CONCURRENCIA_RED, progreso=None, adaptativo=True):
+        self.opciones = opciones
+        self.concurrencia = concurrencia
+        self.progreso = progreso
+        self.resultado = ResultadoProcesamiento()
+        self.ejecutor = EjecutorRenombrado(presupuesto=opciones.presupuesto)
+        self.recorrido = RecorridoParalelo(presupuesto=opciones.presupuesto)
+        self.control = ControlConcurrencia('operaciones de red', min(CONCURRENCIA_RED_INICIAL, concurrencia),
+                                           maximo=concurrencia, adaptativo=adaptativo)
+
+    def ejecutar(self, carpetas):
+        carpetas = _normalizar_raices(carpetas, self.opciones, self.resultado)
+        try:
+            asyncio.run(self._ejecutar(carpetas))
+        finally:
+            self.ejecutor.cerrar()
+        self.resultado.llamadas_fs = self.ejecutor.resumen()
+        self.resultado.ajustes_concurrencia.extend(self.control.historial)
+        return self.resultado
+
+    async def _io(self, funcion, *args, tipo=None):
+        """Ejecuta funcion en el pool cuando el límite actual lo permite;
+        con tipo, su duración alimenta el ajuste del límite"""
+        async with self._cupo:
+            await self._cupo.wait_for(self.control.hay_cupo)
+            self.control.entrar()
+        inicio = time.monotonic()
+        try:
+            return await self._loop.run_in_executor(self._pool, funcion, *args)
+        finally:
+            if tipo:
+                self.control.medir(time.monotonic() - inicio, tipo)
+            self.control.salir()
+            async with self._cupo:
+                self._cupo.notify(max(1, self.control.disponibles))
+
+    async def _ejecutar(self, carpetas):
+        self._loop = asyncio.get_running_loop()
+        self._cupo = asyncio.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrencia)
+        cola_inventarios = asyncio.Queue(maxsize=CARPETAS_EN_VUELO)
+        self._cola_renombrados = asyncio.Queue(maxsize=self.concurrencia * 4)
+        total = len(carpetas)
+        hechas = 0
+
+        async def inventariar():
+            # Cada carpeta se inventaría una sola vez; la validación y los
+            # contadores se resuelven luego en el orden original
+            tareas = {}
+            for carpeta in carpetas:
+                carpeta_real = os.path.abspath(carpeta)
+                if carpeta_real not in tareas:
+                    tareas[carpeta_real] = asyncio.ensure_future(self._inventariar(carpeta_real))
+                await cola_inventarios.put((carpeta, tareas[carpeta_real]))
+            await cola_inventarios.put(None)
+
+        async def procesar():
+            nonlocal hechas
+            while True:
+                trabajo = await cola_inventarios.get()
+                if trabajo is None:
+                    return
+                carpeta, tarea = trabajo
+                inv, anticipadas, leidos = await tarea
+                if inv is None:
+                    self.resultado.errores.append(f"Carpeta no existe: {carpeta}")
+                elif inv.carpeta not in self.resultado.carpetas_procesadas:
+                    self.resultado.carpetas_procesadas.add(inv.carpeta)
+                    await self._procesar_inventario(inv, anticipadas, leidos)
+                    self.ejecutor.cerrar()
+                hechas += 1
+                if self.progreso:
+                    self.progreso(hechas, total)
+
+        async def renombrar():
+            while True:
+                trabajo = await self._cola_renombrados.get()
+                if trabajo is None:
+                    return
+                grupo, resultados, listo = trabajo
+                for indice, op in grupo:
+                    resultados[indice] = await self._io(op.ejecutar, self.ejecutor, tipo='renombrar')
+                listo()
+
+        try:
+            renombradores = [asyncio.ensure_future(renombrar()) for _ in range(self.concurrencia)]
+            # Procesar en orden de carpeta para que la salida coincida con la ejecución en serie
+            productor = asyncio.ensure_future(inventariar())
+            await procesar()
+            await productor
+            for _ in renombradores:
+                await self._cola_renombrados.put(None)
+            await asyncio.gather(*renombradores)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    async def _inventariar(self, carpeta):
+        """Inventaría carpeta; devuelve (inventario, modificaciones ya lanzadas
+        por ruta, contenido ya leído por el preescaneo)"""
+        if self.opciones.preescaneo is not None and os.path.exists(carpeta):
+            inv, leidos = await self._io(_tomar_preescaneo, carpeta, self.opciones)
+            if inv is not None:
+                return inv, {}, leidos
+        anticipadas = {}
+        al_encontrar_cuv = None
+        respaldo = self.opciones.respaldo
+        # Si el respaldo queda dentro de la carpeta, sus copias aparecerían en el recorrido
+        if self.opciones.modo_cuv and not (respaldo and _dentro_de(respaldo.directorio, carpeta)):
+            def anticipar(ruta):
+                anticipadas[ruta] = asyncio.ensure_future(
+                    self._io(aplicar_modificacion, ruta, self.opciones, tipo='modificar'))
+
+            def al_encontrar_cuv(ruta):
+                # Se llama desde el hilo del recorrido; las tareas se crean en el bucle
+                self._loop.call_soon_threadsafe(anticipar, ruta)
+        inv = await self._io(_inventariar_si_existe, carpeta, self.recorrido, al_encontrar_cuv, self.opciones.reglas)
+        return inv, anticipadas, None
+
+    async def _renombrar(self, plan):
+        """Encola los grupos de operaciones y espera sus resultados (en orden del plan)"""
+        resultados = [None] * len(plan)
+        grupos = agrupar_operaciones(plan)
+        if not grupos:
+            return resultados
+        _anunciar_plan(self.ejecutor, plan)
+        pendientes = len(grupos)
+        terminado = self._loop.create_future()
+
+        def listo():
+            nonlocal pendientes
+            pendientes -= 1
+            if pendientes == 0 and not terminado.done():
+                terminado.set_result(None)
+
+        for grupo in grupos:
+            await self._cola_renombrados.put((grupo, resultados, listo))
+        await terminado
+        return resultados
+
+    async def _procesar_inventario(self, inv, anticipadas=None, leidos=None):
+        _anunciar_inventario(inv)
+        p = ProcesadorCarpeta(inv, self.opciones, self.resultado, leidos)
+        anticipadas = anticipadas or {}
+
+        if self.opciones.modo_cuv:
+            # Las que ya se lanzaron durante el recorrido solo se esperan
+            modificados = await asyncio.gather(*[anticipadas.get(a) or self._io(p.modificar, a, tipo='modificar')
+                                                 for a in inv.cuv])
+            for r in modificados:
+                p.registrar_modificacion(*r)
+
+        if self.opciones.renombrar:
+            resueltos = await asyncio.gather(*[self._io(p.resolver_cuv, a, tipo='lectura') for a in p.cuv_por_resolver()])
+            plan_cuv = p.planificar_cuv(resueltos)
+            # Los renombrados CUV y la lectura de facturas no comparten archivos: se solapan
+            renombrado_cuv = asyncio.ensure_future(self._renombrar(plan_cuv))
+            facturas = p.facturas_por_resolver()
+            resueltos = await asyncio.gather(*[self._io(p.resolver_factura, f, tipo='lectura') for f in facturas])
+            for entrada, ok in zip(plan_cuv, await renombrado_cuv):
+                p.registrar(entrada, ok)
+
+            plan_fact = p.planificar_facturas(resueltos)
+            for entrada, ok in zip(plan_fact, await self._renombrar(plan_fact)):
+                p.registrar(entrada, ok)
+            p.cerrar()
+
+
+# -------------------------
+# Vista previa del plan completo (no toca disco)
+# -------------------------
+ESTADO_RENOMBRAR = 'renombrar'
+ESTADO_COLISION = 'colision'
+ESTADO_ERROR = 'error'
+
+
+class FilaPlan:
+    """Un renombrado planificado (o un error del plan) para la vista previa"""
+    __slots__ = ('tipo', 'origen', 'destino', 'estado', 'detalle')
+
+    def __init__(self, tipo, origen, destino, estado=ESTADO_RENOMBRAR, detalle=""):
+        self.tipo = tipo
+        self.origen = origen
+        self.destino = destino
+        self.estado = estado
+        self.detalle = detalle
+
+
+def _filas_del_plan(plan, existentes):
+    filas = []
+    for entrada in plan:
+        if isinstance(entrada, OperacionRenombrado):
+            fila = FilaPlan(entrada.tipo, entrada.origen, entrada.destino)
+            if entrada.claves()[1] in existentes:
+                # El ejecutor reemplaza el destino: se perdería ese archivo
+                fila.estado = ESTADO_COLISION
+                fila.detalle = "ya existe un archivo con ese nombre"
+            filas.append(fila)
+        elif not entrada.ya_correcto:
+            texto = (entrada.error or entrada.mensaje or "").strip().lstrip('- ')
+            filas.append(FilaPlan('', '', '', ESTADO_ERROR, texto))
+    return filas
+
+
+def previsualizar_plan(carpetas, opciones, al_planificar, cancelar=None, tamano_lote=TAMANO_LOTE):
+    """Calcula los renombrados que haría opciones sobre carpetas, sin ejecutarlos.
+
+    al_planificar(filas) recibe una lista de FilaPlan por cada lote de
+    tamano_lote archivos resueltos, en el orden del plan, para mostrarlas
+    mientras sigue el recorrido. Los destinos que ya existen en la carpeta
+    vienen marcados como colisión; los destinos repetidos dentro del plan
+    los marca quien acumula las filas. cancelar (threading.Event) detiene
+    la vista previa entre lotes. Devuelve el ResultadoProcesamiento con lo
+    que ya tenía nombre correcto y los errores del recorrido.
+    """
+    resultado = ResultadoProcesamiento()
+    if not opciones.renombrar:
+        return resultado
+
+    def cancelado():
+        return cancelar is not None and cancelar.is_set()
+
+    for carpeta in _normalizar_raices(carpetas, opciones, resultado):
+        if cancelado():
+            break
+        carpeta_real = _validar_carpeta(carpeta, resultado)
+        if carpeta_real is None:
+            continue
+        inv = inventariar_carpeta(carpeta_real, reglas=opciones.reglas)
+        existentes = {os.path.normcase(a) for a in inv.cuv + inv.facturas + inv.xml + inv.pdf}
+        p = ProcesadorCarpeta(inv, opciones, resultado)
+        # Las facturas se identifican con los nombres que registra la fase CUV
+        for pendientes, resolver, planificar in ((p.cuv_por_resolver, p.resolver_cuv, p.planificar_cuv),
+                                                 (p.facturas_por_resolver, p.resolver_factura, p.planificar_facturas)):
+            archivos = pendientes()
+            for i in range(0, len(archivos), tamano_lote):
+                if cancelado():
+                    return resultado
+                plan = planificar([resolver(a) for a in archivos[i:i + tamano_lote]])
+                filas = _filas_del_plan(plan, existentes)
+                if filas:
+                    al_planificar(filas)
+        p.cerrar()
+    return resultado
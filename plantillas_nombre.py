@@ -0,0 +1,279 @@
+# plantillas_nombre.py
+import re
+import string
+
+# -------------------------
+# Formateo seguro
+# -------------------------
+class _SafeDict(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+def apply_format(format_str, context):
+    if not format_str:
+        return None
+    try:
+        safe = _SafeDict(**context)
+        return format_str.format_map(safe)
+    except Exception:
+        out = format_str
+        for k, v in context.items():
+            out = out.replace("{" + k + "}", v)
+        return out
+
+def needs_placeholder(format_str, placeholder):
+    return ("{" + placeholder + "}") in (format_str or "")
+
+# -------------------------
+# Plantillas compiladas
+# -------------------------
+# Variables que cambian por archivo; el resto sale del contexto de la ejecución
+VARIABLES_POR_ARCHIVO = ('numFactura', 'ProcesoId')
+
+# Cómo reconocer cada variable al leer un nombre ya generado
+_PATRONES_VARIABLE = {
+    'numFactura': r'[A-Za-z0-9-]+',
+    'ProcesoId': r'\d+',
+    'fecha': r'\d{8}',
+    'ano': r'\d{4}',
+    'mes': r'\d{2}',
+    'dia': r'\d{2}',
+}
+# Variables de fecha: un nombre generado otro día sigue siendo reconocible
+_VARIABLES_FECHA = ('fecha', 'ano', 'mes', 'dia')
+
+
+class PlantillaNombre:
+    """Formato de nombre analizado una sola vez.
+
+    render() equivale a apply_format pero sin volver a interpretar el
+    formato en cada archivo, y patron() construye la expresión que reconoce
+    los nombres que la propia plantilla genera, para recuperar numFactura y
+    ProcesoId sin abrir el archivo.
+    """
+
+    def __init__(self, formato):
+        self.formato = formato or ""
+        self.partes = []
+        self.simple = True
+        try:
+            for literal, campo, spec, conversion in string.Formatter().parse(self.formato):
+                if campo is not None and (spec or conversion or not campo.isidentifier()):
+                    self.simple = False
+                self.partes.append((literal, campo))
+        except ValueError:
+            self.simple = False
+        self.campos = {campo for _, campo in self.partes if campo}
+        self._patrones = {}
+
+    def __bool__(self):
+        return bool(self.formato)
+
+    def usa(self, variable):
+        return variable in self.campos
+
+    def distintiva(self, contexto_fijo):
+        """True si los nombres generados llevan texto fijo propio (un prefijo,
+        un sufijo o un dato de la IPS) además de la extensión.
+
+        Solo en ese caso un nombre que coincide con la plantilla se puede dar
+        por generado por SERAF: con '{numFactura}.json' cualquier factura1.json
+        sin procesar coincidiría, y su número real está en el contenido.
+        """
+        partes = list(self.partes)
+        if partes and partes[-1][1] is None:
+            partes[-1] = (partes[-1][0].rpartition('.')[0], None)
+        for literal, campo in partes:
+            fijos = [literal]
+            if campo is not None and campo not in VARIABLES_POR_ARCHIVO + _VARIABLES_FECHA:
+                fijos.append(str(contexto_fijo.get(campo, "")))
+            if any(c.isalnum() for texto in fijos for c in texto):
+                return True
+        return False
+
+    def render(self, contexto):
+        if not self.formato:
+            return None
+        if not self.simple:
+            return apply_format(self.formato, contexto)
+        salida = []
+        for literal, campo in self.partes:
+            salida.append(literal)
+            if campo is not None:
+                valor = contexto.get(campo)
+                salida.append("{" + campo + "}" if valor is None else str(valor))
+        return "".join(salida)
+
+    def patron(self, contexto_fijo, estricto=False):
+        """Expresión compilada (una por contexto de carpeta) que reconoce los
+        nombres generados por la plantilla, o None si no es reversible.
+
+        Con estricto=True las variables de fecha deben coincidir con las del
+        contexto, es decir, el nombre es exactamente el que generaría esta
+        ejecución. No es reversible si dos variables por archivo quedan juntas
+        sin un literal que las separe, porque entonces no se sabe dónde
+        termina cada una.
+        """
+        if not self.formato or not self.simple:
+            return None
+        variables = VARIABLES_POR_ARCHIVO if estricto else VARIABLES_POR_ARCHIVO + _VARIABLES_FECHA
+        clave = (estricto,) + tuple(sorted((k, str(contexto_fijo.get(k, ''))) for k in self.campos
+                                           if k not in variables))
+        if clave in self._patrones:
+            return self._patrones[clave]
+
+        regex = []
+        vistos = set()
+        anterior_variable = False
+        reversible = True
+        for literal, campo in self.partes:
+            regex.append(re.escape(literal))
+            if literal:
+                anterior_variable = False
+            if campo is None:
+                continue
+            if campo in variables:
+                if anterior_variable:
+                    reversible = False
+                if campo in vistos:
+                    regex.append(f"(?P={campo})")
+                else:
+                    regex.append(f"(?P<{campo}>{_PATRONES_VARIABLE[campo]})")
+                    vistos.add(campo)
+                anterior_variable = True
+            elif campo in contexto_fijo:
+                regex.append(re.escape(str(contexto_fijo[campo])))
+            else:
+                # Variable desconocida: apply_format la deja tal cual
+                regex.append(re.escape("{" + campo + "}"))
+
+        compilado = re.compile("".join(regex)) if reversible else None
+        self._patrones[clave] = compilado
+        return compilado
+
+    def extraer(self, nombre, contexto_fijo, estricto=False):
+        """Devuelve las variables por archivo leídas del nombre, o None"""
+        patron = self.patron(contexto_fijo, estricto)
+        if patron is None:
+            return None
+        m = patron.fullmatch(nombre)
+        if not m:
+            return None
+        return {k: v for k, v in m.groupdict().items() if k in VARIABLES_POR_ARCHIVO}
+
+
+# -------------------------
+# Validación de formatos
+# -------------------------
+# Variables que se pueden usar en los formatos (las que ofrece el selector de la interfaz)
+VARIABLES_FORMATO = ('numFactura', 'ProcesoId', 'ips', 'nit', 'fecha', 'ano', 'mes', 'dia', 'nombreCarpeta')
+
+# Columna de la configuración -> (nombre para los mensajes, extensión obligatoria)
+FORMATOS_CONFIG = {
+    'formato_xml': ('XML', '.xml'),
+    'formato_pdf': ('PDF', '.pdf'),
+    'formato_cuv': ('CUV', '.json'),
+    'formato_json': ('JSON Factura', '.json'),
+}
+
+
+def validar_formatos(formatos):
+    """Errores de los formatos de una configuración ({columna: formato}).
+
+    Revisa la extensión, que las llaves estén bien cerradas y que solo se
+    usen variables conocidas (una variable mal escrita quedaría tal cual en
+    el nombre). Los formatos vacíos no se revisan. Lista vacía si todo está bien.
+    """
+    errores = []
+    for columna, (tipo, extension) in FORMATOS_CONFIG.items():
+        formato = (formatos.get(columna) or "").strip()
+        if not formato:
+            continue
+        if not formato.endswith(extension):
+            errores.append(f"Formato {tipo} debe terminar en {extension}: {formato}")
+        try:
+            campos = [campo for _, campo, _, _ in string.Formatter().parse(formato) if campo is not None]
+        except ValueError:
+            errores.append(f"Formato {tipo} tiene llaves sin cerrar: {formato}")
+            continue
+        for campo in campos:
+            if campo not in VARIABLES_FORMATO:
+                errores.append(f"Formato {tipo} usa una variable desconocida {{{campo}}}: {formato}")
+    return errores
+
+
+# -------------------------
+# Nombres finales esperados
+# -------------------------
+TIPOS_ARCHIVO = ('cuv', 'fact', 'xml', 'pdf')
+
+
+class NombresEsperados:
+    """Nombres finales que esta ejecución daría a los archivos de una carpeta.
+
+    Permite saber en O(1), antes de abrir ningún JSON, si un archivo ya está
+    procesado. Se alimenta de dos fuentes: los números de factura ya
+    conocidos (registrar) y, para los nombres aún no vistos, la expresión
+    estricta de cada plantilla, solo si es distintiva (con '{numFactura}.json'
+    un archivo sin procesar pasaría por procesado). El nombre CUV no se
+    reconoce por patrón si lleva {ProcesoId}: la modificación del CUV puede
+    cambiarlo, y el del nombre sería el de antes.
+    """
+
+    def __init__(self, plantillas, contexto_carpeta, nombres_existentes=()):
+        self.plantillas = {tipo: p for tipo, p in plantillas.items() if p}
+        self.contexto = contexto_carpeta
+        self.por_patron = {tipo for tipo, p in self.plantillas.items()
+                           if p.distintiva(contexto_carpeta) and not (tipo == 'cuv' and p.usa('ProcesoId'))}
+        self.existentes = set(nombres_existentes)
+        self._esperados = {}
+        self._por_factura = {}
+
+    def registrar(self, num_factura, proceso_id=None):
+        """Agrega los nombres finales de una factura.
+
+        El nombre CUV solo se calcula si se conoce su ProcesoId (o la
+        plantilla no lo usa); el resto de tipos se renderiza sin ProcesoId,
+        igual que en el renombrado.
+        """
+        num_factura = str(num_factura)
+        nombres = self._por_factura.setdefault(num_factura, {})
+        for tipo, plantilla in self.plantillas.items():
+            if tipo in nombres:
+                continue
+            if tipo == 'cuv':
+                if proceso_id is None and plantilla.usa('ProcesoId'):
+                    continue
+                contexto = dict(self.contexto, numFactura=num_factura, ProcesoId=proceso_id or "")
+            else:
+                contexto = dict(self.contexto, numFactura=num_factura, ProcesoId="")
+            nombre = plantilla.render(contexto)
+            if nombre:
+                nombres[tipo] = nombre
+                self._esperados[nombre] = (tipo, num_factura)
+
+    def identificar(self, nombre, tipos=TIPOS_ARCHIVO):
+        """Devuelve (tipo, num_factura) si nombre ya es un nombre final, o None"""
+        encontrado = self._esperados.get(nombre)
+        if encontrado:
+            return encontrado if encontrado[0] in tipos else None
+        for tipo in tipos:
+            plantilla = self.plantillas.get(tipo)
+            if plantilla is None or tipo not in self.por_patron:
+                continue
+            valores = plantilla.extraer(nombre, self.contexto, estricto=True)
+            if valores and valores.get('numFactura'):
+                self.registrar(valores['numFactura'], "" if tipo == 'cuv' else None)
+                encontrado = self._esperados.get(nombre)
+                if encontrado and encontrado[0] == tipo:
+                    return encontrado
+        return None
+
+    def agregar_existentes(self, nombres):
+        """Nombres de archivo presentes en la carpeta (para completo)"""
+        self.existentes.update(nombres)
+
+    def completo(self, num_factura, tipos):
+        """True si los nombres finales de esos tipos ya existen en la carpeta"""
+        nombres = self._por_factura.get(str(num_factura), {})
+        return all(nombres.get(tipo) in self.existentes for tipo in tipos if tipo in self.plantillas)
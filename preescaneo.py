@@ -0,0 +1,221 @@
+# preescaneo.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from identidad_factura import leer_identidad_json, CAMPO_CUV, CAMPO_FACTURA
+from motor_procesamiento import inventariar_carpeta, ProcesadorCarpeta, ResultadoProcesamiento
+from recorrido_paralelo import RecorridoParalelo, HILOS_RECORRIDO
+
+HILOS_PREESCANEO = 2
+
+
+class PreescaneoCancelado(Exception):
+    """La carpeta se quitó de la lista mientras se preescaneaba"""
+
+
+class ResultadoPreescaneo:
+    """Inventario y contenido leído de una carpeta antes de procesarla.
+
+    firmas guarda la fecha de modificación de cada directorio recorrido,
+    tomada antes de listarlo: si alguna cambió, el inventario ya no vale.
+    leidos es {ruta: (num, proceso_id) o texto del error}, igual que
+    leer_identidades, y firmas_archivos la (fecha de modificación, tamaño)
+    de cada archivo leído, tomada antes de leerlo: editar un JSON sin
+    cambiar su nombre no toca la fecha del directorio.
+    """
+
+    def __init__(self, carpeta, reglas, inventario, firmas, leidos, firmas_archivos=None):
+        self.carpeta = carpeta
+        self.reglas = reglas
+        self.inventario = inventario
+        self.firmas = firmas
+        self.leidos = leidos
+        self.firmas_archivos = firmas_archivos or {}
+
+    def vigente(self):
+        """True si ningún directorio recorrido cambió desde el preescaneo"""
+        directorios = list(self.firmas)
+        with ThreadPoolExecutor(max_workers=HILOS_RECORRIDO) as pool:
+            actuales = pool.map(_firma_directorio, directorios)
+            return all(self.firmas[d] == a for d, a in zip(directorios, actuales))
+
+    def descartar_cambiados(self):
+        """Quita de leidos los archivos que cambiaron después de leerlos (se
+        vuelven a leer al procesar); devuelve cuántos"""
+        archivos = list(self.leidos)
+        with ThreadPoolExecutor(max_workers=HILOS_RECORRIDO) as pool:
+            actuales = list(pool.map(_firma_archivo, archivos))
+        cambiados = 0
+        for archivo, actual in zip(archivos, actuales):
+            if actual is None or self.firmas_archivos.get(archivo) != actual:
+                del self.leidos[archivo]
+                cambiados += 1
+        return cambiados
+
+
+def _firma_directorio(directorio):
+    try:
+        return os.stat(directorio).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _firma_archivo(archivo):
+    try:
+        st = os.stat(archivo)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def _por_leer(inv, opciones):
+    """(archivos, campo) cuyo contenido leería el procesamiento de inv"""
+    if opciones is None or not opciones.renombrar:
+        return (inv.cuv, CAMPO_CUV), (inv.facturas, CAMPO_FACTURA)
+    # Mismo criterio que el renombrado: ni los de nombre final ni los que
+    # se resuelven por el nombre, salvo la muestra de verificación
+    p = ProcesadorCarpeta(inv, opciones, ResultadoProcesamiento())
+    cuv = [a for a in p.cuv_por_resolver() if p.resolutor_cuv.requiere_contenido(a)]
+    facturas = [a for a in p.facturas_por_resolver() if p.resolutor_fact.requiere_contenido(a)]
+    return (cuv, CAMPO_CUV), (facturas, CAMPO_FACTURA)
+
+
+class Preescaneo:
+    """Inventaría y lee en segundo plano las carpetas en cuanto se agregan.
+
+    agregar() lanza el trabajo (inventario y lectura de numFactura/ProcesoId
+    de cada JSON) en un pool pequeño; quitar() lo cancela, también si ya
+    está en curso. Al procesar, tomar() entrega lo preescaneado si las
+    reglas de recorrido coinciden y los directorios no cambiaron; si no,
+    devuelve None y la carpeta se recorre de nuevo como siempre. Lo leído
+    de un archivo que cambió desde entonces se descarta y se vuelve a leer,
+    igual que lo de un CUV que después se modifica (ProcesadorCarpeta).
+
+    Las lecturas se cargan a presupuesto (PresupuestoIO o None), que se
+    puede reemplazar en cualquier momento: al procesar se pasa el de la
+    ejecución para que el preescaneo pendiente no lo sobrepase. Con las
+    opciones de procesamiento, no se abren los archivos que el renombrado
+    resolvería por el nombre (los mismos que salta ProcesadorCarpeta).
+
+    Se usa desde un solo hilo (el de la interfaz); el trabajo corre en el pool.
+    al_terminar(carpeta, resultado, error), si se pasa, se llama desde el
+    hilo del pool al acabar cada carpeta (no si se canceló).
+    """
+
+    def __init__(self, max_hilos=HILOS_PREESCANEO, al_terminar=None, presupuesto=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_hilos)
+        self.al_terminar = al_terminar
+        self.presupuesto = presupuesto
+        self._trabajos = {}   # clave -> (futuro, evento de cancelación, descripción de reglas)
+
+    @staticmethod
+    def _clave(carpeta):
+        return os.path.normcase(os.path.abspath(carpeta))
+
+    def agregar(self, carpeta, reglas=None, opciones=None):
+        """Empieza a preescanear carpeta (si ya estaba con otras reglas, vuelve a empezar).
+        Devuelve True si lanzó un trabajo nuevo.
+
+        opciones (OpcionesProcesamiento con la configuración elegida) solo
+        sirve para no leer lo que se resolverá por el nombre: si al procesar
+        es otra, lo que falte se lee entonces."""
+        clave = self._clave(carpeta)
+        descripcion = reglas.descripcion() if reglas is not None else None
+        trabajo = self._trabajos.get(clave)
+        if trabajo is not None:
+            if trabajo[2] == descripcion:
+                return False
+            self.quitar(carpeta)
+        cancelar = threading.Event()
+        futuro = self._pool.submit(self._ejecutar, carpeta, reglas, opciones, cancelar)
+        self._trabajos[clave] = (futuro, cancelar, descripcion)
+        return True
+
+    def quitar(self, carpeta):
+        trabajo = self._trabajos.pop(self._clave(carpeta), None)
+        if trabajo is not None:
+            futuro, cancelar, _ = trabajo
+            cancelar.set()
+            futuro.cancel()
+
+    def limpiar(self):
+        for clave in list(self._trabajos):
+            self.quitar(clave)
+
+    def estado(self, carpeta):
+        """'pendiente', 'listo', 'error' o None si la carpeta no se preescanea"""
+        trabajo = self._trabajos.get(self._clave(carpeta))
+        if trabajo is None:
+            return None
+        futuro = trabajo[0]
+        if not futuro.done():
+            return 'pendiente'
+        return 'error' if futuro.exception() is not None else 'listo'
+
+    def tomar(self, carpeta, reglas=None):
+        """ResultadoPreescaneo vigente para carpeta, o None.
+
+        Si el preescaneo sigue en curso se espera: es el mismo trabajo que
+        haría el procesamiento. Una vez tomado no se vuelve a entregar (el
+        procesamiento cambia los archivos).
+        """
+        trabajo = self._trabajos.pop(self._clave(carpeta), None)
+        if trabajo is None:
+            return None
+        futuro, _, descripcion = trabajo
+        if descripcion != (reglas.descripcion() if reglas is not None else None):
+            futuro.cancel()
+            return None
+        try:
+            resultado = futuro.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            print(f"Preescaneo descartado para {carpeta}: {e}")
+            return None
+        if not resultado.vigente():
+            print(f"Preescaneo descartado para {carpeta}: la carpeta cambió")
+            return None
+        cambiados = resultado.descartar_cambiados()
+        if cambiados:
+            print(f"Preescaneo de {carpeta}: {cambiados} archivos cambiaron y se volverán a leer")
+        return resultado
+
+    def cerrar(self):
+        self.limpiar()
+        self._pool.shutdown(wait=False)
+
+    # --- Trabajo en segundo plano ---
+    def _ejecutar(self, carpeta, reglas, opciones, cancelar):
+        try:
+            resultado = self._preescanear(os.path.abspath(carpeta), reglas, opciones, cancelar)
+        except PreescaneoCancelado:
+            raise
+        except Exception as e:
+            if self.al_terminar is not None and not cancelar.is_set():
+                self.al_terminar(carpeta, None, e)
+            raise
+        if self.al_terminar is not None and not cancelar.is_set():
+            self.al_terminar(carpeta, resultado, None)
+        return resultado
+
+    def _preescanear(self, carpeta, reglas, opciones, cancelar):
+        firmas = {}
+        inv = inventariar_carpeta(carpeta, RecorridoParalelo(firmas=firmas, cancelar=cancelar), reglas=reglas)
+        leidos = {}
+        firmas_archivos = {}
+        for archivos, campo in _por_leer(inv, opciones):
+            for archivo in archivos:
+                if cancelar.is_set():
+                    raise PreescaneoCancelado(carpeta)
+                # Antes de leer: un cambio durante la lectura también invalida lo leído
+                firmas_archivos[archivo] = _firma_archivo(archivo)
+                try:
+                    leidos[archivo] = leer_identidad_json(archivo, campo, self.presupuesto)
+                except Exception as e:
+                    leidos[archivo] = str(e)
+        if cancelar.is_set():
+            raise PreescaneoCancelado(carpeta)
+        return ResultadoPreescaneo(carpeta, reglas, inv, firmas, leidos, firmas_archivos)
+
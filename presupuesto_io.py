@@ -0,0 +1,219 @@
+# presupuesto_io.py
+import configparser
+import os
+import sys
+import threading
+import time
+
+PRIORIDAD_NORMAL = 'normal'
+PRIORIDAD_SEGUNDO_PLANO = 'segundo_plano'
+
+# En segundo plano se usa esta fracción del presupuesto configurado, o estos
+# valores si no hay ninguno configurado
+FACTOR_SEGUNDO_PLANO = 0.25
+BYTES_SEGUNDO_PLANO = 8 * 1024 * 1024
+OPERACIONES_SEGUNDO_PLANO = 200
+
+SECCION_INI = 'procesamiento'
+
+# SetPriorityClass: modo segundo plano de Windows (baja también la prioridad de E/S)
+_PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+_PROCESS_MODE_BACKGROUND_END = 0x00200000
+
+
+class CuboTokens:
+    """Cubo de tokens: se recarga a tasa tokens/s hasta capacidad.
+
+    Admite saldo negativo: una operación cuyo costo se conoce al terminar
+    (una lectura) se descuenta después con cargar(), y las siguientes
+    esperan a que la deuda se pague. Así el promedio respeta la tasa sin
+    tener que consultar tamaños antes de leer.
+    """
+
+    def __init__(self, tasa, capacidad=None, reloj=time.monotonic):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else tasa)
+        self._reloj = reloj
+        self._tokens = self.capacidad
+        self._ultima = reloj()
+
+    def _recargar(self):
+        ahora = self._reloj()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultima) * self.tasa)
+        self._ultima = ahora
+
+    def espera_para(self, minimo):
+        """Segundos hasta tener al menos minimo tokens (0 si ya los hay).
+
+        Un pedido mayor que la capacidad nunca se llenaría: se espera al cubo
+        lleno y el resto queda como deuda al cargarlo.
+        """
+        self._recargar()
+        minimo = min(minimo, self.capacidad)
+        if self._tokens >= minimo:
+            return 0.0
+        return (minimo - self._tokens) / self.tasa
+
+    def cargar(self, n):
+        self._recargar()
+        self._tokens -= n
+
+
+class PresupuestoIO:
+    """Límite de bytes/s y operaciones/s para la E/S de una ejecución.
+
+    esperar_operacion() antes de cada lectura, escritura o renombrado;
+    consumir_bytes(n) antes de escribir n bytes y cargar_bytes(n) después
+    de leerlos. Los límites en None no se aplican. Se comparte entre hilos;
+    las esperas se hacen sin tener el candado.
+    """
+
+    def __init__(self, bytes_por_segundo=None, operaciones_por_segundo=None, prioridad=PRIORIDAD_NORMAL):
+        self.prioridad = prioridad
+        if prioridad == PRIORIDAD_SEGUNDO_PLANO:
+            bytes_por_segundo = (bytes_por_segundo * FACTOR_SEGUNDO_PLANO if bytes_por_segundo
+                                 else BYTES_SEGUNDO_PLANO)
+            operaciones_por_segundo = (operaciones_por_segundo * FACTOR_SEGUNDO_PLANO if operaciones_por_segundo
+                                       else OPERACIONES_SEGUNDO_PLANO)
+        self.bytes_por_segundo = bytes_por_segundo
+        self.operaciones_por_segundo = operaciones_por_segundo
+        self._bytes = CuboTokens(bytes_por_segundo) if bytes_por_segundo else None
+        self._operaciones = CuboTokens(operaciones_por_segundo) if operaciones_por_segundo else None
+        self._lock = threading.Lock()
+        self.segundos_espera = 0.0
+        self.total_bytes = 0
+        self.total_operaciones = 0
+
+    @property
+    def activo(self):
+        return self._bytes is not None or self._operaciones is not None
+
+    def _esperar(self, tomar):
+        """Duerme hasta que tomar() (llamada con el candado) devuelva 0"""
+        while True:
+            with self._lock:
+                espera = tomar()
+                if espera > 0:
+                    self.segundos_espera += espera
+            if espera <= 0:
+                return
+            time.sleep(espera)
+
+    def esperar_operacion(self, n=1):
+        def tomar():
+            espera = 0.0
+            if self._operaciones is not None:
+                espera = self._operaciones.espera_para(n)
+            if self._bytes is not None:
+                # Con deuda de bytes pendiente tampoco se empieza otra operación
+                espera = max(espera, self._bytes.espera_para(0))
+            if espera <= 0:
+                if self._operaciones is not None:
+                    self._operaciones.cargar(n)
+                self.total_operaciones += n
+            return espera
+        self._esperar(tomar)
+
+    def consumir_bytes(self, n):
+        def tomar():
+            if self._bytes is None:
+                self.total_bytes += n
+                return 0.0
+            espera = self._bytes.espera_para(0)
+            if espera <= 0:
+                self._bytes.cargar(n)
+                self.total_bytes += n
+            return espera
+        self._esperar(tomar)
+
+    def cargar_bytes(self, n):
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes.cargar(n)
+            self.total_bytes += n
+
+    def descripcion(self):
+        partes = []
+        if self.bytes_por_segundo:
+            partes.append(f"{self.bytes_por_segundo / (1024 * 1024):.1f} MB/s")
+        if self.operaciones_por_segundo:
+            partes.append(f"{self.operaciones_por_segundo:.0f} op/s")
+        limite = ", ".join(partes) or "sin límite"
+        return f"{limite}, prioridad {self.prioridad}"
+
+    def resumen(self):
+        return (f"{self.descripcion()}; {self.total_operaciones} operaciones, "
+                f"{self.total_bytes / (1024 * 1024):.1f} MB, {self.segundos_espera:.1f} s en espera")
+
+
+# -------------------------
+# Prioridad del proceso
+# -------------------------
+def iniciar_segundo_plano():
+    """Baja la prioridad de CPU y E/S del proceso (solo Windows). Devuelve
+    True si se aplicó; hay que llamar a terminar_segundo_plano al acabar."""
+    if sys.platform != 'win32':
+        return False
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        return bool(kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), _PROCESS_MODE_BACKGROUND_BEGIN))
+    except Exception as e:
+        print(f"No se pudo activar el modo segundo plano: {e}")
+        return False
+
+
+def terminar_segundo_plano():
+    if sys.platform != 'win32':
+        return
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), _PROCESS_MODE_BACKGROUND_END)
+    except Exception as e:
+        print(f"No se pudo desactivar el modo segundo plano: {e}")
+
+
+# -------------------------
+# Configuración (database.ini)
+# -------------------------
+_SUFIJOS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def _leer_cantidad(texto):
+    """'20M', '512k', '1048576' -> bytes; vacío o 0 -> None"""
+    texto = (texto or '').strip().lower().rstrip('b')
+    if not texto:
+        return None
+    factor = _SUFIJOS.get(texto[-1], 1)
+    if texto[-1] in _SUFIJOS:
+        texto = texto[:-1]
+    valor = float(texto) * factor
+    return valor or None
+
+
+def leer_presupuesto_ini(ruta='database.ini', prioridad=None):
+    """Crea el PresupuestoIO con la sección [procesamiento] de database.ini.
+
+    Claves (todas opcionales):
+        limite_bytes_por_segundo = 20M
+        limite_operaciones_por_segundo = 500
+        prioridad = normal | segundo_plano
+    prioridad, si se pasa, reemplaza la del archivo (elección en la interfaz).
+    """
+    bytes_por_segundo = operaciones_por_segundo = None
+    prioridad_ini = PRIORIDAD_NORMAL
+    if os.path.exists(ruta):
+        config = configparser.ConfigParser()
+        config.read(ruta)
+        if SECCION_INI in config:
+            seccion = config[SECCION_INI]
+            try:
+                bytes_por_segundo = _leer_cantidad(seccion.get('limite_bytes_por_segundo'))
+                operaciones_por_segundo = _leer_cantidad(seccion.get('limite_operaciones_por_segundo'))
+            except ValueError as e:
+                raise Exception(f"Límite de E/S inválido en [{SECCION_INI}] de {ruta}: {e}")
+            prioridad_ini = seccion.get('prioridad', PRIORIDAD_NORMAL).strip() or PRIORIDAD_NORMAL
+            if prioridad_ini not in (PRIORIDAD_NORMAL, PRIORIDAD_SEGUNDO_PLANO):
+                raise Exception(f"Prioridad desconocida en [{SECCION_INI}] de {ruta}: {prioridad_ini}")
+    return PresupuestoIO(bytes_por_segundo, operaciones_por_segundo, prioridad or prioridad_ini)
@@ -0,0 +1,438 @@
+# procesador_cuv.py
+import json
+import mmap
+import os
+import re
+
+from recorrido_paralelo import recorrer_en_serie
+
+# -------------------------
+# Modos de modificación CUV
+# -------------------------
+MODO_ELIMINAR_RECHAZADOS = 'rechazados'
+MODO_VACIAR = 'vaciar'
+
+# Resultados de modificar un CUV
+CUV_MODIFICADO = 'modificado'
+CUV_SIN_CAMBIOS = 'sin_cambios'
+
+# A partir de este tamaño se reescribe el CUV por tramos en lugar de
+# cargar y volver a serializar todo el documento
+UMBRAL_REESCRITURA_PARCIAL = 1024 * 1024
+TAMANO_BLOQUE_COPIA = 1024 * 1024
+
+PATRON_PROCESO_ID = re.compile(r'ProcesoId\s*(\d+)')
+PATRON_CUV_RVG02 = re.compile(r'Ministerio de Salud; CUV (.*?) del Documento', re.DOTALL)
+
+
+def extraer_proceso_id(observaciones):
+    """Extrae el ProcesoId del texto de observaciones"""
+    if not observaciones:
+        return None
+    match = PATRON_PROCESO_ID.search(observaciones)
+    return match.group(1) if match else None
+
+
+def extraer_cuv_rvg02(observaciones):
+    """Extrae el CUV del texto de observaciones de un RVG02 rechazado"""
+    if not observaciones:
+        return None
+    match = PATRON_CUV_RVG02.search(observaciones)
+    return match.group(1).strip() if match else None
+
+
+def es_archivo_cuv(nombre):
+    """Un CUV es un .json cuyo nombre contiene 'cuv'"""
+    nombre_lower = nombre.lower()
+    return 'cuv' in nombre_lower and nombre_lower.endswith('.json')
+
+
+def buscar_archivos_cuv(carpeta, reglas=None):
+    """Busca recursivamente los archivos CUV de una carpeta (sin lo que
+    excluyan las reglas de recorrido)"""
+    archivos_cuv = []
+    for raiz, archivos in recorrer_en_serie(carpeta, reglas):
+        for archivo in archivos:
+            if es_archivo_cuv(archivo):
+                archivos_cuv.append(os.path.join(raiz, archivo))
+    return sorted(archivos_cuv)
+
+
+def _mismo_valor(actual, nuevo):
+    """Compara valores tolerando la diferencia entre 999 y "999" en el JSON"""
+    if actual is None:
+        return nuevo is None
+    return actual == nuevo or str(actual) == str(nuevo)
+
+
+def transformar_cuv(datos_cuv, modo):
+    """Aplica la modificación al CUV en memoria.
+
+    Devuelve True solo si el documento quedó distinto al original; los campos
+    que ya tienen el valor esperado no se tocan, así que un CUV ya limpio no
+    se marca como modificado.
+    """
+    cambios = False
+
+    # EXTRAER Y ACTUALIZAR ProcesoId DESDE OBSERVACIONES
+    for resultado in datos_cuv.get('ResultadosValidacion', []):
+        proceso_id = extraer_proceso_id(resultado.get('Observaciones', ''))
+        if proceso_id:
+            if not _mismo_valor(datos_cuv.get('ProcesoId'), proceso_id):
+                datos_cuv['ProcesoId'] = proceso_id
+                cambios = True
+                print(f"  - Actualizado ProcesoId: {proceso_id}")
+            break  # Solo necesitamos el primero que encontremos
+
+    validaciones = datos_cuv.get('ResultadosValidacion', [])
+
+    if modo == MODO_ELIMINAR_RECHAZADOS:
+        cuv_encontrado = None
+        validaciones_filtradas = []
+        for r in validaciones:
+            if r.get('Clase') == 'RECHAZADO':
+                # Si es rechazado, buscar el CUV si es RVG02
+                if r.get('Codigo') == 'RVG02':
+                    cuv_encontrado = extraer_cuv_rvg02(r.get('Observaciones', '')) or cuv_encontrado
+            else:
+                validaciones_filtradas.append(r)
+
+        if len(validaciones_filtradas) != len(validaciones):
+            datos_cuv['ResultadosValidacion'] = validaciones_filtradas
+            cambios = True
+
+        if cuv_encontrado:
+            if datos_cuv.get('CodigoUnicoValidacion') != cuv_encontrado:
+                datos_cuv['CodigoUnicoValidacion'] = cuv_encontrado
+                cambios = True
+            if datos_cuv.get('ResultState') is not True:
+                datos_cuv['ResultState'] = True
+                cambios = True
+
+    elif modo == MODO_VACIAR:
+        if validaciones or 'ResultadosValidacion' not in datos_cuv:
+            datos_cuv['ResultadosValidacion'] = []
+            cambios = True
+        if datos_cuv.get('ResultState') is not True:
+            datos_cuv['ResultState'] = True
+            cambios = True
+
+    return cambios
+
+
+def _reemplazar(temporal, archivo_cuv, respaldo):
+    """Sustituye el original por el temporal, respaldándolo antes si se pidió.
+
+    Se usa os.replace (nuevo inodo) y no escritura en sitio para que un
+    respaldo hecho con enlace duro no vea el contenido nuevo.
+    """
+    if respaldo is not None:
+        respaldo(archivo_cuv)
+    os.replace(temporal, archivo_cuv)
+
+
+def modificar_cuv(archivo_cuv, modo, parcial=None, respaldo=None, presupuesto=None):
+    """Lee, transforma y reescribe un CUV solo si su contenido cambia.
+
+    Con parcial=None se decide por tamaño: los CUV grandes se reescriben por
+    tramos (ver reescribir_cuv_parcial) y los demás cargando el JSON completo.
+    respaldo es un invocable opcional que recibe la ruta justo antes de
+    sustituir el archivo (ver respaldo_cuv.RespaldoCUV.respaldar).
+    presupuesto (presupuesto_io.PresupuestoIO) limita la lectura y la
+    escritura. Devuelve CUV_MODIFICADO o CUV_SIN_CAMBIOS; los errores de lectura o
+    escritura se propagan para que el llamador los registre.
+    """
+    if parcial is None:
+        parcial = os.path.getsize(archivo_cuv) >= UMBRAL_REESCRITURA_PARCIAL
+    if parcial:
+        try:
+            return reescribir_cuv_parcial(archivo_cuv, modo, respaldo, presupuesto)
+        except EstructuraCUVNoSoportada as e:
+            print(f"  - Reescritura parcial no aplicable a {archivo_cuv} ({e}), se usa la completa")
+
+    if presupuesto is not None:
+        presupuesto.esperar_operacion()
+    with open(archivo_cuv, 'rb') as f:
+        contenido = f.read()
+    if presupuesto is not None:
+        presupuesto.cargar_bytes(len(contenido))
+    datos_cuv = json.loads(contenido.decode('utf-8'))
+
+    if not transformar_cuv(datos_cuv, modo):
+        return CUV_SIN_CAMBIOS
+
+    temporal = archivo_cuv + '.tmp'
+    try:
+        texto = json.dumps(datos_cuv, indent=4, ensure_ascii=False)
+        if presupuesto is not None:
+            presupuesto.esperar_operacion()
+            presupuesto.consumir_bytes(len(texto.encode('utf-8')))
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(texto)
+        _reemplazar(temporal, archivo_cuv, respaldo)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return CUV_MODIFICADO
+
+# -------------------------
+# Reescritura parcial (por tramos de bytes)
+# -------------------------
+class EstructuraCUVNoSoportada(ValueError):
+    """El CUV no tiene la forma esperada para reescribirlo por tramos"""
+
+
+_ESPACIOS = re.compile(rb'[ \t\r\n]*')
+_CADENA = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_ESCALAR = re.compile(rb'[^,\]}\s]+')
+_ESTRUCTURAL = re.compile(rb'[{}\[\]"]')
+
+
+def _saltar_espacios(buf, pos):
+    return _ESPACIOS.match(buf, pos).end()
+
+
+def _fin_cadena(buf, pos):
+    m = _CADENA.match(buf, pos)
+    if not m:
+        raise EstructuraCUVNoSoportada(f"cadena sin cerrar en byte {pos}")
+    return m.end()
+
+
+def _fin_valor(buf, pos):
+    """Devuelve la posición siguiente al valor JSON que empieza en pos"""
+    c = buf[pos:pos + 1]
+    if c == b'"':
+        return _fin_cadena(buf, pos)
+    if c in (b'{', b'['):
+        profundidad = 0
+        while True:
+            m = _ESTRUCTURAL.search(buf, pos)
+            if not m:
+                raise EstructuraCUVNoSoportada("documento truncado")
+            pos = m.start()
+            c = buf[pos:pos + 1]
+            if c == b'"':
+                pos = _fin_cadena(buf, pos)
+                continue
+            profundidad += 1 if c in (b'{', b'[') else -1
+            pos += 1
+            if profundidad == 0:
+                return pos
+    m = _ESCALAR.match(buf, pos)
+    if not m:
+        raise EstructuraCUVNoSoportada(f"valor inesperado en byte {pos}")
+    return m.end()
+
+
+def _indexar_objeto(buf, pos):
+    """Recorre el objeto que empieza en pos.
+
+    Devuelve (miembros, cierre): miembros es una lista de
+    (clave, inicio_valor, fin_valor) y cierre la posición de la llave '}'.
+    """
+    miembros = []
+    pos = _saltar_espacios(buf, pos + 1)
+    if buf[pos:pos + 1] == b'}':
+        return miembros, pos
+    while True:
+        fin_clave = _fin_cadena(buf, pos)
+        clave = json.loads(buf[pos:fin_clave])
+        pos = _saltar_espacios(buf, fin_clave)
+        if buf[pos:pos + 1] != b':':
+            raise EstructuraCUVNoSoportada(f"se esperaba ':' en byte {pos}")
+        inicio = _saltar_espacios(buf, pos + 1)
+        fin = _fin_valor(buf, inicio)
+        miembros.append((clave, inicio, fin))
+        pos = _saltar_espacios(buf, fin)
+        c = buf[pos:pos + 1]
+        if c == b',':
+            pos = _saltar_espacios(buf, pos + 1)
+        elif c == b'}':
+            return miembros, pos
+        else:
+            raise EstructuraCUVNoSoportada(f"se esperaba ',' o '}}' en byte {pos}")
+
+
+def _indexar_arreglo(buf, pos):
+    """Devuelve (elementos, cierre) del arreglo que empieza en pos"""
+    elementos = []
+    pos = _saltar_espacios(buf, pos + 1)
+    if buf[pos:pos + 1] == b']':
+        return elementos, pos
+    while True:
+        fin = _fin_valor(buf, pos)
+        elementos.append((pos, fin))
+        pos = _saltar_espacios(buf, fin)
+        c = buf[pos:pos + 1]
+        if c == b',':
+            pos = _saltar_espacios(buf, pos + 1)
+        elif c == b']':
+            return elementos, pos
+        else:
+            raise EstructuraCUVNoSoportada(f"se esperaba ',' o ']' en byte {pos}")
+
+
+def _valor_json(valor):
+    return json.dumps(valor, ensure_ascii=False).encode('utf-8')
+
+
+def _escribir(destino, datos, presupuesto):
+    if presupuesto is not None:
+        presupuesto.consumir_bytes(len(datos))
+    destino.write(datos)
+
+
+def _copiar_rango(buf, inicio, fin, destino, presupuesto=None):
+    while inicio < fin:
+        tope = min(fin, inicio + TAMANO_BLOQUE_COPIA)
+        _escribir(destino, buf[inicio:tope], presupuesto)
+        inicio = tope
+
+
+def reescribir_cuv_parcial(archivo_cuv, modo, respaldo=None, presupuesto=None):
+    """Aplica transformar_cuv copiando sin tocar los bytes no afectados.
+
+    El CUV se recorre una sola vez sobre un mmap; cada elemento de
+    ResultadosValidacion se decodifica por separado y los que se conservan se
+    copian con su formato original. Solo se emiten de nuevo el arreglo
+    filtrado y los campos escalares que cambian, de modo que la memoria no
+    depende del tamaño del archivo. Con presupuesto, la lectura del mmap se
+    carga completa y la escritura del temporal se limita bloque a bloque.
+    """
+    if presupuesto is not None:
+        presupuesto.esperar_operacion()
+    with open(archivo_cuv, 'rb') as f:
+        tamano = os.fstat(f.fileno()).st_size
+        if tamano == 0:
+            raise EstructuraCUVNoSoportada("archivo vacío")
+        if presupuesto is not None:
+            presupuesto.cargar_bytes(tamano)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            ediciones = _planificar_ediciones(buf, modo)
+            if not ediciones:
+                return CUV_SIN_CAMBIOS
+
+            temporal = archivo_cuv + '.tmp'
+            if presupuesto is not None:
+                presupuesto.esperar_operacion()
+            try:
+                with open(temporal, 'wb') as out:
+                    pos = 0
+                    for inicio, fin, partes in ediciones:
+                        _copiar_rango(buf, pos, inicio, out, presupuesto)
+                        for parte in partes:
+                            if isinstance(parte, tuple):
+                                _copiar_rango(buf, parte[0], parte[1], out, presupuesto)
+                            else:
+                                _escribir(out, parte, presupuesto)
+                        pos = fin
+                    _copiar_rango(buf, pos, len(buf), out, presupuesto)
+            except Exception:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+                raise
+
+    # El mmap y el original ya están cerrados (necesario en Windows)
+    try:
+        _reemplazar(temporal, archivo_cuv, respaldo)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return CUV_MODIFICADO
+
+
+def _planificar_ediciones(buf, modo):
+    """Calcula los reemplazos (inicio, fin, partes) que equivalen a transformar_cuv"""
+    pos = _saltar_espacios(buf, 0)
+    if buf[pos:pos + 1] != b'{':
+        raise EstructuraCUVNoSoportada("el CUV no es un objeto JSON")
+    miembros, _ = _indexar_objeto(buf, pos)
+    if not miembros:
+        raise EstructuraCUVNoSoportada("objeto vacío")
+    spans = {clave: (inicio, fin) for clave, inicio, fin in miembros}
+
+    def actual(clave):
+        if clave not in spans:
+            return None
+        inicio, fin = spans[clave]
+        return json.loads(buf[inicio:fin])
+
+    elementos, lead, trail = [], None, None
+    if 'ResultadosValidacion' in spans:
+        inicio_arr, fin_arr = spans['ResultadosValidacion']
+        if buf[inicio_arr:inicio_arr + 1] != b'[':
+            raise EstructuraCUVNoSoportada("ResultadosValidacion no es un arreglo")
+        elementos, cierre = _indexar_arreglo(buf, inicio_arr)
+        if elementos:
+            lead = (inicio_arr + 1, elementos[0][0])
+            trail = (elementos[-1][1], cierre)
+
+    proceso_id = None
+    cuv_encontrado = None
+    conservados = []
+    for inicio, fin in elementos:
+        r = json.loads(buf[inicio:fin])
+        if not isinstance(r, dict):
+            conservados.append((inicio, fin))
+            continue
+        if proceso_id is None:
+            proceso_id = extraer_proceso_id(r.get('Observaciones', ''))
+        if modo == MODO_ELIMINAR_RECHAZADOS and r.get('Clase') == 'RECHAZADO':
+            if r.get('Codigo') == 'RVG02':
+                cuv_encontrado = extraer_cuv_rvg02(r.get('Observaciones', '')) or cuv_encontrado
+        else:
+            conservados.append((inicio, fin))
+
+    nuevos = {}
+    if proceso_id and not _mismo_valor(actual('ProcesoId'), proceso_id):
+        nuevos['ProcesoId'] = [_valor_json(proceso_id)]
+        print(f"  - Actualizado ProcesoId: {proceso_id}")
+
+    poner_result_state = False
+    if modo == MODO_ELIMINAR_RECHAZADOS:
+        if len(conservados) != len(elementos):
+            partes = [b'[']
+            if conservados:
+                separador = (elementos[0][1], elementos[1][0]) if len(elementos) > 1 else b', '
+                partes.append(lead)
+                for i, rango in enumerate(conservados):
+                    if i:
+                        partes.append(separador)
+                    partes.append(rango)
+                partes.append(trail)
+            partes.append(b']')
+            nuevos['ResultadosValidacion'] = partes
+        if cuv_encontrado:
+            if actual('CodigoUnicoValidacion') != cuv_encontrado:
+                nuevos['CodigoUnicoValidacion'] = [_valor_json(cuv_encontrado)]
+            poner_result_state = True
+    elif modo == MODO_VACIAR:
+        if elementos or 'ResultadosValidacion' not in spans:
+            nuevos['ResultadosValidacion'] = [b'[]']
+        poner_result_state = True
+
+    if poner_result_state and actual('ResultState') is not True:
+        nuevos['ResultState'] = [b'true']
+
+    ediciones = []
+    faltantes = []
+    for clave, partes in nuevos.items():
+        if clave in spans:
+            inicio, fin = spans[clave]
+            ediciones.append((inicio, fin, partes))
+        else:
+            faltantes.append((clave, partes))
+
+    if faltantes:
+        # Las claves nuevas van tras el último miembro, con su misma sangría
+        sangria = buf[pos + 1:_saltar_espacios(buf, pos + 1)]
+        fin_ultimo = miembros[-1][2]
+        partes = []
+        for clave, valor in faltantes:
+            partes.append(b',' + sangria + _valor_json(clave) + b': ')
+            partes.extend(valor)
+        ediciones.append((fin_ultimo, fin_ultimo, partes))
+
+    ediciones.sort(key=lambda e: e[0])
+    return ediciones
@@ -0,0 +1,343 @@
+# recorrido_paralelo.py
+import configparser
+import fnmatch
+import functools
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+HILOS_RECORRIDO = 16
+
+SECCION_INI = 'procesamiento'
+# Sugerencia para la interfaz cuando database.ini no define exclusiones:
+# los respaldos que deja SERAF dentro de las carpetas de entrega
+EXCLUSIONES_PREDETERMINADAS = 'Respaldo_CUV_*'
+
+_ATRIBUTOS_OCULTOS = stat.FILE_ATTRIBUTE_HIDDEN | stat.FILE_ATTRIBUTE_SYSTEM
+
+
+# -------------------------
+# Reglas de poda
+# -------------------------
+class ReglasRecorrido:
+    """Qué partes del árbol no se recorren.
+
+    excluir son patrones glob sin distinguir mayúsculas: sin barra se
+    comparan con el nombre de cada carpeta o archivo ('Enviados', '*.bak',
+    '.git'); con barra, con la ruta relativa a la carpeta raíz
+    ('2024/Enviados'). profundidad_maxima limita los niveles de subcarpetas
+    bajo la raíz (0: solo la raíz). omitir_ocultos salta lo que empieza por
+    punto y, en Windows, lo marcado como oculto o de sistema (cuarentenas de
+    antivirus, desktop.ini). Las carpetas excluidas no se llegan a listar;
+    quedan anotadas en omitidos para el registro.
+    """
+
+    def __init__(self, excluir=(), profundidad_maxima=None, omitir_ocultos=False):
+        self.excluir = [p.strip().replace('\\', '/').strip('/') for p in excluir if p and p.strip()]
+        self.profundidad_maxima = profundidad_maxima
+        self.omitir_ocultos = omitir_ocultos
+        self._por_nombre = [p.lower() for p in self.excluir if '/' not in p]
+        self._por_ruta = [p.lower() for p in self.excluir if '/' in p]
+        self.omitidos = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_texto(cls, texto, profundidad_maxima=None, omitir_ocultos=False):
+        """Patrones separados por ';', ',' o saltos de línea"""
+        patrones = (texto or '').replace(',', ';').replace('\n', ';').split(';')
+        return cls(patrones, profundidad_maxima, omitir_ocultos)
+
+    @property
+    def activas(self):
+        return bool(self.excluir) or self.profundidad_maxima is not None or self.omitir_ocultos
+
+    def texto_exclusiones(self):
+        return "; ".join(self.excluir)
+
+    def _excluida(self, entrada, raiz):
+        if self.omitir_ocultos and _es_oculto(entrada):
+            return True
+        nombre = entrada.name.lower()
+        if any(fnmatch.fnmatchcase(nombre, p) for p in self._por_nombre):
+            return True
+        if self._por_ruta:
+            relativa = os.path.relpath(entrada.path, raiz).replace('\\', '/').lower()
+            return any(fnmatch.fnmatchcase(relativa, p) for p in self._por_ruta)
+        return False
+
+    def _omitir(self, ruta, motivo):
+        with self._lock:
+            self.omitidos.append((ruta, motivo))
+
+    def descripcion(self):
+        partes = []
+        if self.excluir:
+            partes.append(f"excluir {self.texto_exclusiones()}")
+        if self.profundidad_maxima is not None:
+            partes.append(f"profundidad máxima {self.profundidad_maxima}")
+        if self.omitir_ocultos:
+            partes.append("sin ocultos")
+        return ", ".join(partes) or "sin reglas"
+
+    def cubre_subcarpeta(self, raiz, relativa):
+        """True si al recorrer raiz con estas reglas se llega a su subcarpeta
+        relativa (por ejemplo 'Octubre' o 'a/b').
+
+        Con profundidad máxima, la subcarpeta se recorre hasta el límite
+        contado desde raiz (no desde ella): unida a raiz, la profundidad se
+        mide desde la carpeta de más arriba.
+        """
+        partes = [p for p in relativa.replace('\\', '/').split('/') if p]
+        if self.profundidad_maxima is not None and len(partes) > self.profundidad_maxima:
+            return False
+        for i, parte in enumerate(partes):
+            nombre = parte.lower()
+            if self.omitir_ocultos and _es_oculto(os.path.join(raiz, *partes[:i + 1])):
+                return False
+            if any(fnmatch.fnmatchcase(nombre, p) for p in self._por_nombre):
+                return False
+            prefijo = '/'.join(partes[:i + 1]).lower()
+            if any(fnmatch.fnmatchcase(prefijo, p) for p in self._por_ruta):
+                return False
+        return True
+
+
+def _es_oculto(entrada):
+    """entrada es un os.DirEntry del recorrido o una ruta"""
+    if isinstance(entrada, str):
+        nombre, leer_stat = os.path.basename(entrada), functools.partial(os.stat, entrada)
+    else:
+        nombre, leer_stat = entrada.name, entrada.stat
+    if nombre.startswith('.'):
+        return True
+    try:
+        # En Windows scandir ya trae los atributos: no cuesta otra llamada
+        return bool(getattr(leer_stat(follow_symlinks=False), 'st_file_attributes', 0) & _ATRIBUTOS_OCULTOS)
+    except OSError:
+        return False
+
+
+def leer_reglas_ini(ruta='database.ini'):
+    """Reglas de la sección [procesamiento] de database.ini (todas opcionales):
+        excluir = Respaldo_CUV_*; Enviados; .git
+        profundidad_maxima = 3
+        omitir_ocultos = si
+    Sin la clave excluir se sugieren EXCLUSIONES_PREDETERMINADAS.
+    """
+    excluir = EXCLUSIONES_PREDETERMINADAS
+    profundidad_maxima = None
+    omitir_ocultos = False
+    if os.path.exists(ruta):
+        config = configparser.ConfigParser()
+        config.read(ruta)
+        if SECCION_INI in config:
+            seccion = config[SECCION_INI]
+            excluir = seccion.get('excluir', excluir)
+            try:
+                texto = seccion.get('profundidad_maxima', '').strip()
+                profundidad_maxima = int(texto) if texto else None
+            except ValueError as e:
+                raise Exception(f"Regla de recorrido inválida en [{SECCION_INI}] de {ruta}: {e}")
+            omitir_ocultos = seccion.get('omitir_ocultos', '').strip().lower() in ('1', 'si', 'sí', 'true', 'yes')
+    return ReglasRecorrido.desde_texto(excluir, profundidad_maxima, omitir_ocultos)
+
+
+# -------------------------
+# Raíces: carpetas repetidas o anidadas
+# -------------------------
+def _identidad(ruta, cache):
+    """(dispositivo, inodo) de ruta; None si no se puede obtener o el
+    sistema de archivos no da inodos (algunos recursos de red devuelven 0)"""
+    if ruta not in cache:
+        try:
+            st = os.stat(ruta)
+            cache[ruta] = (st.st_dev, st.st_ino) if st.st_ino else None
+        except OSError:
+            cache[ruta] = None
+    return cache[ruta]
+
+
+def normalizar_raices(carpetas, reglas=None):
+    """Quita las carpetas que ya quedan cubiertas por otra de la lista.
+
+    Dos carpetas son la misma si coinciden su ruta real (enlaces simbólicos
+    resueltos) o su dispositivo e inodo (unidades mapeadas, rutas UNC). Una
+    carpeta dentro de otra de la lista se absorbe en la de arriba, salvo que
+    las reglas de recorrido la dejarían fuera al recorrer la de arriba.
+    Las que no existen se dejan tal cual (el procesamiento informa el error).
+
+    Devuelve (raices, fusiones): raices en el orden original y fusiones una
+    lista de (carpeta, carpeta_que_la_cubre, motivo) para el registro.
+    """
+    cache = {}
+    candidatas = []   # (carpeta, ruta real normalizada, identidad)
+    for carpeta in carpetas:
+        real = os.path.normcase(os.path.realpath(os.path.abspath(carpeta)))
+        candidatas.append((carpeta, real, _identidad(real, cache) if os.path.isdir(real) else None))
+
+    por_real = {}
+    por_identidad = {}
+    fusiones = []
+    unicas = []
+    for carpeta, real, identidad in candidatas:
+        if not os.path.isdir(real):
+            unicas.append((carpeta, real, identidad))
+            continue
+        igual = por_real.get(real) or (por_identidad.get(identidad) if identidad else None)
+        if igual is not None:
+            fusiones.append((carpeta, igual, "misma carpeta"))
+            continue
+        por_real[real] = carpeta
+        if identidad:
+            por_identidad[identidad] = carpeta
+        unicas.append((carpeta, real, identidad))
+
+    # De la menos a la más profunda: solo absorbe una carpeta que quedó como
+    # raíz (con profundidad máxima, estar dentro de otra no es transitivo)
+    raiz_por_real = {}
+    raiz_por_identidad = {}
+    ancestros = {}
+    for carpeta, real, identidad in sorted(unicas, key=lambda c: c[1].count(os.sep)):
+        ancestro = None
+        if os.path.isdir(real):
+            # Se sube por los padres: por ruta real y por inodo (alias de la misma unidad)
+            actual = real
+            while ancestro is None:
+                padre = os.path.dirname(actual)
+                if padre == actual:
+                    break
+                candidato = raiz_por_real.get(padre)
+                if candidato is None:
+                    ident_padre = _identidad(padre, cache) if raiz_por_identidad else None
+                    candidato = raiz_por_identidad.get(ident_padre) if ident_padre else None
+                if candidato is not None and candidato != carpeta and (
+                        reglas is None or reglas.cubre_subcarpeta(padre, os.path.relpath(real, padre))):
+                    ancestro = candidato
+                actual = padre
+        if ancestro is not None:
+            ancestros[carpeta] = ancestro
+        else:
+            raiz_por_real[real] = carpeta
+            if identidad:
+                raiz_por_identidad[identidad] = carpeta
+
+    raices = []
+    for carpeta, real, identidad in unicas:
+        if carpeta in ancestros:
+            fusiones.append((carpeta, ancestros[carpeta], "incluida en otra carpeta de la lista"))
+        else:
+            raices.append(carpeta)
+    return raices, fusiones
+
+
+# -------------------------
+# Recorrido
+# -------------------------
+def listar_directorio(directorio, reglas=None, raiz=None, profundidad=0):
+    """Una sola pasada de os.scandir: devuelve (archivos, subdirectorios).
+
+    archivos son nombres y subdirectorios rutas completas. Igual que
+    os.walk, los enlaces a directorios no se recorren y un directorio que no
+    se puede leer se trata como vacío. Con reglas, lo excluido no se
+    devuelve; las subcarpetas más allá de la profundidad máxima tampoco.
+    """
+    archivos, subdirectorios = [], []
+    podar = reglas is not None and reglas.activas
+    try:
+        with os.scandir(directorio) as entradas:
+            for entrada in entradas:
+                try:
+                    es_dir = entrada.is_dir()
+                except OSError:
+                    es_dir = False
+                if podar and reglas._excluida(entrada, raiz or directorio):
+                    if es_dir:
+                        reglas._omitir(entrada.path, "regla")
+                    continue
+                if not es_dir:
+                    archivos.append(entrada.name)
+                elif not entrada.is_symlink():
+                    if podar and reglas.profundidad_maxima is not None and profundidad >= reglas.profundidad_maxima:
+                        reglas._omitir(entrada.path, "profundidad")
+                    else:
+                        subdirectorios.append(entrada.path)
+    except OSError:
+        pass
+    return archivos, subdirectorios
+
+
+def recorrer_en_serie(raiz, reglas=None):
+    """Mismo contrato que RecorridoParalelo.recorrer, un directorio a la vez
+    (en el orden de os.walk)"""
+    pendientes = [(raiz, 0)]
+    while pendientes:
+        directorio, profundidad = pendientes.pop()
+        archivos, subdirectorios = listar_directorio(directorio, reglas, raiz, profundidad)
+        yield directorio, archivos
+        pendientes.extend((sub, profundidad + 1) for sub in reversed(subdirectorios))
+
+
+class RecorridoParalelo:
+    """Recorre un árbol listando varios directorios a la vez.
+
+    En un recurso SMB cada listado cuesta al menos un viaje de red y
+    os.walk los hace de uno en uno; aquí cada subdirectorio encontrado se
+    envía al pool en cuanto aparece, así los hermanos se listan en paralelo.
+    recorrer() entrega (directorio, archivos) a medida que termina cada
+    listado, en el orden en que llegan (no el de os.walk): quien necesite un
+    orden estable debe ordenar lo recibido. Con reglas (ReglasRecorrido)
+    las carpetas excluidas ni se envían al pool. Si se deja de consumir el
+    generador, los listados pendientes se cancelan.
+
+    firmas, si se pasa un dict, recibe la fecha de modificación de cada
+    directorio tomada justo antes de listarlo. cancelar (threading.Event)
+    detiene el recorrido desde otro hilo; lo entregado queda incompleto.
+    """
+
+    def __init__(self, max_hilos=HILOS_RECORRIDO, presupuesto=None, firmas=None, cancelar=None):
+        self.max_hilos = max_hilos
+        self.presupuesto = presupuesto
+        self.firmas = firmas
+        self.cancelar = cancelar
+        self.directorios_listados = 0
+        self.segundos = 0.0
+        # Varias carpetas se pueden recorrer a la vez con el mismo objeto
+        self._lock = threading.Lock()
+
+    def _listar(self, directorio, reglas, raiz, profundidad):
+        if self.cancelar is not None and self.cancelar.is_set():
+            return directorio, profundidad, ([], [])
+        if self.presupuesto is not None:
+            self.presupuesto.esperar_operacion()
+        if self.firmas is not None:
+            try:
+                self.firmas[directorio] = os.stat(directorio).st_mtime_ns
+            except OSError:
+                self.firmas[directorio] = None
+        return directorio, profundidad, listar_directorio(directorio, reglas, raiz, profundidad)
+
+    def recorrer(self, raiz, reglas=None):
+        inicio = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=self.max_hilos)
+        pendientes = {pool.submit(self._listar, raiz, reglas, raiz, 0)}
+        try:
+            while pendientes:
+                listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    directorio, profundidad, (archivos, subdirectorios) = futuro.result()
+                    for sub in subdirectorios:
+                        pendientes.add(pool.submit(self._listar, sub, reglas, raiz, profundidad + 1))
+                    with self._lock:
+                        self.directorios_listados += 1
+                    yield directorio, archivos
+        finally:
+            for futuro in pendientes:
+                futuro.cancel()
+            pool.shutdown(wait=True)
+            with self._lock:
+                self.segundos += time.monotonic() - inicio
+
+    def resumen(self):
+        return f"{self.directorios_listados} directorios listados en {self.segundos:.2f} s ({self.max_hilos} hilos)"
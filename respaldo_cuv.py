@@ -0,0 +1,186 @@
+# respaldo_cuv.py
+import argparse
+import datetime
+import json
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no hay FICLONE, se usa enlace duro o copia
+    fcntl = None
+
+# ioctl FICLONE de Linux (_IOW(0x94, 9, int)): clona el archivo compartiendo bloques
+FICLONE = 0x40049409
+
+METODO_REFLINK = 'reflink'
+METODO_ENLACE = 'enlace'
+METODO_COPIA = 'copia'
+
+ARCHIVO_MANIFIESTO = 'manifiesto.jsonl'
+TAMANO_BLOQUE_COPIA = 1024 * 1024
+
+
+def _clonar_reflink(origen, destino):
+    """Clona con FICLONE; solo funciona en Btrfs/XFS/OCFS2 dentro del mismo volumen"""
+    if fcntl is None:
+        return False
+    try:
+        with open(origen, 'rb') as fr, open(destino, 'wb') as fw:
+            fcntl.ioctl(fw.fileno(), FICLONE, fr.fileno())
+        shutil.copystat(origen, destino)
+        return True
+    except OSError:
+        if os.path.exists(destino):
+            os.remove(destino)
+        return False
+
+
+def _enlazar(origen, destino):
+    """Crea un enlace duro. Es seguro porque la modificación reemplaza el
+    original con os.replace en lugar de escribir sobre el mismo inodo."""
+    try:
+        os.link(origen, destino)
+        return True
+    except (OSError, AttributeError, NotImplementedError):
+        return False
+
+
+def _copiar(origen, destino):
+    with open(origen, 'rb') as fr, open(destino, 'wb') as fw:
+        shutil.copyfileobj(fr, fw, TAMANO_BLOQUE_COPIA)
+    shutil.copystat(origen, destino)
+
+
+def clonar_archivo(origen, destino):
+    """Duplica origen en destino con el método más barato disponible.
+
+    Devuelve el método usado: reflink, enlace duro o copia por bloques.
+    """
+    if _clonar_reflink(origen, destino):
+        return METODO_REFLINK
+    if _enlazar(origen, destino):
+        return METODO_ENLACE
+    _copiar(origen, destino)
+    return METODO_COPIA
+
+
+class RespaldoCUV:
+    """Instantánea de los CUV que se modifican en una ejecución.
+
+    Cada archivo se respalda justo antes de cambiarlo y queda anotado en un
+    manifiesto (una línea JSON por archivo) para poder revertir la ejecución
+    completa con restaurar_respaldo. Si luego la misma ejecución renombra el
+    CUV, anotar_renombrado agrega otra línea con el nombre nuevo.
+    """
+
+    def __init__(self, directorio_base):
+        marca = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.directorio = os.path.join(directorio_base, f"Respaldo_CUV_{marca}")
+        os.makedirs(self.directorio, exist_ok=True)
+        self.metodos = {METODO_REFLINK: 0, METODO_ENLACE: 0, METODO_COPIA: 0}
+        self._respaldados = set()
+        self._actual = {}   # ruta actual de cada CUV respaldado -> ruta original
+        # respaldar se llama desde varios hilos en el procesamiento paralelo
+        self._lock = threading.Lock()
+
+    def respaldar(self, archivo):
+        """Respalda archivo si aún no se respaldó en esta ejecución"""
+        original = os.path.abspath(archivo)
+        with self._lock:
+            if original in self._respaldados:
+                return None
+            nombre = f"{len(self._respaldados) + 1:06d}_{os.path.basename(original)}"
+            metodo = clonar_archivo(original, os.path.join(self.directorio, nombre))
+            self.metodos[metodo] += 1
+            self._respaldados.add(original)
+            self._actual[original] = original
+            self._anotar({'original': original, 'respaldo': nombre, 'metodo': metodo})
+        return metodo
+
+    def anotar_renombrado(self, origen, destino):
+        """Anota que un CUV respaldado pasó a llamarse destino"""
+        with self._lock:
+            original = self._actual.pop(os.path.abspath(origen), None)
+            if original is None:
+                return
+            destino = os.path.abspath(destino)
+            self._actual[destino] = original
+            self._anotar({'original': original, 'renombrado': destino})
+
+    def _anotar(self, entrada):
+        with open(os.path.join(self.directorio, ARCHIVO_MANIFIESTO), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+
+    @property
+    def total(self):
+        return len(self._respaldados)
+
+
+def restaurar_respaldo(directorio_respaldo):
+    """Devuelve cada CUV de la instantánea a su ruta original.
+
+    Si la ejecución además lo renombró, primero se quita el archivo con el
+    nombre nuevo: la carpeta queda como estaba, sin el CUV duplicado.
+    Devuelve (restaurados, errores). El respaldo se conserva, por lo que la
+    restauración se puede repetir.
+    """
+    manifiesto = os.path.join(directorio_respaldo, ARCHIVO_MANIFIESTO)
+    if not os.path.exists(manifiesto):
+        raise Exception(f"No se encontró {ARCHIVO_MANIFIESTO} en {directorio_respaldo}")
+
+    respaldos = []
+    renombrados = {}   # original -> último nombre que le dio la ejecución
+    with open(manifiesto, 'r', encoding='utf-8') as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            entrada = json.loads(linea)
+            if 'renombrado' in entrada:
+                renombrados[entrada['original']] = entrada['renombrado']
+            else:
+                respaldos.append(entrada)
+
+    restaurados = 0
+    errores = []
+    originales = {os.path.normcase(e['original']) for e in respaldos}
+    for original, renombrado in renombrados.items():
+        # Si el nombre nuevo es el original de otro CUV, lo reemplaza su restauración
+        if os.path.normcase(renombrado) in originales:
+            continue
+        try:
+            if os.path.exists(renombrado):
+                os.remove(renombrado)
+        except OSError as e:
+            errores.append(f"Error quitando {renombrado} (nombre nuevo de {original}): {e}")
+
+    for entrada in respaldos:
+        original = entrada['original']
+        respaldo = os.path.join(directorio_respaldo, entrada['respaldo'])
+        temporal = original + '.restaurando'
+        try:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            clonar_archivo(respaldo, temporal)
+            os.replace(temporal, original)
+            restaurados += 1
+        except Exception as e:
+            errores.append(f"Error restaurando {original}: {e}")
+            if os.path.exists(temporal):
+                os.remove(temporal)
+    return restaurados, errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restaurar los CUV de una ejecución desde su respaldo")
+    parser.add_argument("directorio", help="Carpeta Respaldo_CUV_AAAAMMDD_HHMMSS generada por SERAF")
+    args = parser.parse_args()
+
+    restaurados, errores = restaurar_respaldo(args.directorio)
+    print(f"Archivos CUV restaurados: {restaurados}")
+    for e in errores:
+        print(e)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# conftest.py
+import os
+import sys
+
+import pytest
+
+# Los módulos de SERAF están en la raíz del repositorio (sin paquete)
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_REPO not in sys.path:
+    sys.path.insert(0, RAIZ_REPO)
+
+INI_SQLITE = "[database]\nmotor = sqlite\ndatabase = seraf.db\n"
+
+
+@pytest.fixture
+def bd_sqlite(tmp_path, monkeypatch):
+    """Carpeta de trabajo con un database.ini que usa SQLite (sin Firebird)"""
+    from database_manager import DatabaseManager
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "database.ini").write_text(INI_SQLITE, encoding="utf-8")
+    # El singleton no debe arrastrar la conexión de otra prueba
+    monkeypatch.setattr(DatabaseManager, "_instance", None)
+    yield tmp_path
+    if DatabaseManager._instance is not None:
+        DatabaseManager._instance.close_connection()
@@ -0,0 +1,151 @@
+# test_cola_trabajo.py
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import cola_trabajo
+from cola_trabajo import ColaTrabajo, ESTADO_EN_CURSO, ESTADO_ERROR, ESTADO_HECHO, ESTADO_PENDIENTE
+
+# Reservas cortas para que las pruebas no esperen DURACION_RESERVA
+DURACION = 1
+LATIDO = 0.2
+
+
+def _carpetas(raiz, n):
+    carpetas = []
+    for i in range(n):
+        carpeta = raiz / "entrega" / f"F{i:02d}"
+        carpeta.mkdir(parents=True)
+        carpetas.append(str(carpeta))
+    return carpetas
+
+
+def _trabajar(nombre, carpeta_bd, salida):
+    """Proceso trabajador: toma carpetas hasta vaciar la cola y anota cuáles"""
+    os.chdir(carpeta_bd)
+    cola = ColaTrabajo("prueba", trabajador=nombre, duracion=DURACION, intervalo_latido=LATIDO)
+    tomadas = []
+    try:
+        while True:
+            tarea = cola.tomar()
+            if tarea is None:
+                break
+            time.sleep(0.05)   # que el otro proceso tenga ocasión de pelear por la misma
+            tomadas.append((tarea.id, tarea.carpeta, cola.terminar(tarea)))
+    finally:
+        cola.cerrar()
+    salida.put((nombre, tomadas))
+
+
+def _tomar_y_caer(carpeta_bd):
+    """Proceso que reserva una carpeta y muere sin terminarla ni liberarla"""
+    os.chdir(carpeta_bd)
+    cola = ColaTrabajo("prueba", trabajador="caido", duracion=DURACION, intervalo_latido=LATIDO)
+    cola.tomar()
+    os._exit(1)
+
+
+@pytest.fixture
+def cola(bd_sqlite):
+    cola = ColaTrabajo("prueba", trabajador="local", duracion=DURACION, intervalo_latido=LATIDO)
+    yield cola
+    cola.cerrar()
+
+
+def test_encolar_une_repetidas_y_anidadas(cola, bd_sqlite):
+    carpetas = _carpetas(bd_sqlite, 3)
+    anidada = os.path.join(carpetas[0], "Octubre")
+    os.mkdir(anidada)
+    assert cola.encolar(carpetas + [carpetas[1], anidada], config_id=7) == 3
+    # Ya en la cola (también como subcarpeta de una pendiente): no se agrega otra vez
+    assert cola.encolar([carpetas[2], anidada]) == 0
+    # Una carpeta que contiene las pendientes las reemplaza
+    assert cola.encolar([str(bd_sqlite / "entrega")]) == 1
+    assert cola.resumen() == {ESTADO_PENDIENTE: 1}
+    tarea = cola.tomar()
+    assert tarea.carpeta == str(bd_sqlite / "entrega")
+    assert tarea.config_id is None
+
+
+def test_dos_procesos_no_toman_la_misma_carpeta(cola, bd_sqlite):
+    carpetas = _carpetas(bd_sqlite, 20)
+    assert cola.encolar(carpetas) == 20
+
+    contexto = multiprocessing.get_context("spawn")
+    salida = contexto.Queue()
+    procesos = [contexto.Process(target=_trabajar, args=(f"equipo{i}", str(bd_sqlite), salida)) for i in range(2)]
+    for proceso in procesos:
+        proceso.start()
+    tomadas = dict(salida.get(timeout=60) for _ in procesos)
+    for proceso in procesos:
+        proceso.join(timeout=30)
+        assert proceso.exitcode == 0
+
+    ids = [id_ for lista in tomadas.values() for id_, _, _ in lista]
+    assert len(ids) == len(set(ids)) == 20
+    assert sorted(c for lista in tomadas.values() for _, c, _ in lista) == sorted(carpetas)
+    assert all(terminada for lista in tomadas.values() for _, _, terminada in lista)
+    assert cola.resumen() == {ESTADO_HECHO: 20}
+
+
+def test_latidos_mantienen_la_reserva(cola, bd_sqlite):
+    cola.encolar(_carpetas(bd_sqlite, 1))
+    tarea = cola.tomar()
+    otra = ColaTrabajo("prueba", trabajador="otro", duracion=DURACION, intervalo_latido=LATIDO)
+    try:
+        # Bastante más que la duración de la reserva: sin latidos ya habría vencido
+        time.sleep(DURACION * 2.5)
+        assert otra.tomar() is None
+        assert cola.vigente(tarea)
+        assert cola.terminar(tarea)
+        assert cola.resumen() == {ESTADO_HECHO: 1}
+    finally:
+        otra.cerrar()
+
+
+def test_reserva_vencida_pasa_a_otro_equipo(cola, bd_sqlite):
+    carpeta, = _carpetas(bd_sqlite, 1)
+    cola.encolar([carpeta])
+
+    proceso = multiprocessing.get_context("spawn").Process(target=_tomar_y_caer, args=(str(bd_sqlite),))
+    proceso.start()
+    proceso.join(timeout=30)
+    assert cola.resumen() == {ESTADO_EN_CURSO: 1}
+    # Mientras la reserva del equipo caído no vence, nadie la toma
+    assert cola.tomar() is None
+
+    time.sleep(DURACION * 2.5)
+    tarea = cola.tomar()
+    assert tarea is not None and tarea.carpeta == carpeta
+    assert tarea.intentos == 2
+    assert cola.terminar(tarea)
+
+
+def test_sin_latidos_la_reserva_se_pierde(cola, bd_sqlite):
+    cola.encolar(_carpetas(bd_sqlite, 1))
+    lenta = ColaTrabajo("prueba", trabajador="lento", duracion=DURACION, intervalo_latido=60)
+    try:
+        tarea = lenta.tomar()
+        time.sleep(DURACION * 2.5)
+        retomada = cola.tomar()
+        assert retomada is not None and retomada.id == tarea.id
+        # El equipo lento ya no puede cerrarla: ahora es de otro
+        assert not lenta.terminar(tarea)
+        assert cola.terminar(retomada)
+    finally:
+        lenta.cerrar()
+
+
+def test_abandonada_tras_max_intentos(cola, bd_sqlite, monkeypatch):
+    monkeypatch.setattr(cola_trabajo, "MAX_INTENTOS", 1)
+    cola.encolar(_carpetas(bd_sqlite, 1))
+    lenta = ColaTrabajo("prueba", trabajador="lento", duracion=DURACION, intervalo_latido=60)
+    try:
+        assert lenta.tomar() is not None
+        time.sleep(DURACION * 2.5)
+        assert cola.tomar() is None
+        assert cola.resumen() == {ESTADO_ERROR: 1}
+    finally:
+        lenta.cerrar()
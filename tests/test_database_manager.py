@@ -0,0 +1,67 @@
+# test_database_manager.py
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from conftest import RAIZ_REPO, INI_SQLITE
+
+# sys.modules[nombre] = None hace fallar el import como si no estuviera instalado
+SIN_FIREBIRDSQL = "import sys\nsys.modules['firebirdsql'] = None\n"
+
+
+def _ejecutar_sin_firebirdsql(codigo, carpeta):
+    """Ejecuta codigo en otro intérprete (en carpeta) sin firebirdsql disponible"""
+    entorno = dict(os.environ, PYTHONPATH=RAIZ_REPO)
+    return subprocess.run([sys.executable, "-c", SIN_FIREBIRDSQL + textwrap.dedent(codigo)],
+                          cwd=carpeta, env=entorno, capture_output=True, text=True, timeout=60)
+
+
+def test_modulos_cargan_sin_firebirdsql(tmp_path):
+    (tmp_path / "database.ini").write_text(INI_SQLITE, encoding="utf-8")
+    proceso = _ejecutar_sin_firebirdsql("""
+        import cola_trabajo, config_manager, configuracion_offline, historial_procesamiento, motor_procesamiento
+        from database_manager import DatabaseManager, DATOS_IPS_POR_DEFECTO, obtener_datos_ips
+        sentencias = DatabaseManager().sentencias()
+        assert sentencias.ejecutar(sentencias.motor.SQL_PRUEBA).fetchone()[0] == 1
+        assert obtener_datos_ips() == DATOS_IPS_POR_DEFECTO
+        print("motor", sentencias.motor.nombre)
+    """, tmp_path)
+    assert proceso.returncode == 0, proceso.stderr
+    assert "motor sqlite" in proceso.stdout
+
+
+def test_firebird_sin_controlador_explica_como_seguir(tmp_path):
+    proceso = _ejecutar_sin_firebirdsql("""
+        from database_manager import MotorFirebird
+        try:
+            MotorFirebird().conectar({'host': 'localhost', 'port': 3050})
+        except Exception as e:
+            print(e)
+    """, tmp_path)
+    assert proceso.returncode == 0, proceso.stderr
+    assert "falta el controlador firebirdsql" in proceso.stdout
+    assert "motor = sqlite" in proceso.stdout
+
+
+def test_sqlite_sin_datos_ips(bd_sqlite):
+    from database_manager import DATOS_IPS_POR_DEFECTO, leer_datos_ips, obtener_datos_ips
+    assert leer_datos_ips() is None
+    assert obtener_datos_ips() == DATOS_IPS_POR_DEFECTO
+
+
+def test_sqlite_con_datos_ips(bd_sqlite):
+    from database_manager import DatabaseManager, leer_datos_ips
+    sentencias = DatabaseManager().sentencias()
+    sentencias.ejecutar("INSERT INTO LST_IPS (COD_IPS, NRO_IDENT) VALUES (?, ?)", ("123456", "800111222"))
+    sentencias.conexion.commit()
+    assert leer_datos_ips() == {'codigo_ips': "123456", 'nit': "800111222"}
+
+
+def test_motor_desconocido(bd_sqlite):
+    from database_manager import DatabaseManager
+    (bd_sqlite / "database.ini").write_text("[database]\nmotor = oracle\n", encoding="utf-8")
+    with pytest.raises(Exception, match="no soportado"):
+        DatabaseManager().get_db_params()
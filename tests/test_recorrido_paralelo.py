@@ -0,0 +1,79 @@
+# test_recorrido_paralelo.py
+import os
+
+import pytest
+
+from recorrido_paralelo import ReglasRecorrido, normalizar_raices
+
+INCLUIDA = "incluida en otra carpeta de la lista"
+
+
+@pytest.fixture
+def arbol(tmp_path):
+    for ruta in ("2025/Octubre/Semana1", "2025/Enviados", "2025/.cuarentena", "otra"):
+        (tmp_path / ruta).mkdir(parents=True)
+    return tmp_path
+
+
+def test_repetidas(arbol):
+    raiz = str(arbol / "2025")
+    raices, fusiones = normalizar_raices([raiz, raiz + os.sep, os.path.join(raiz, "Octubre", "..")])
+    assert raices == [raiz]
+    assert [(c, r, m) for c, r, m in fusiones] == [
+        (raiz + os.sep, raiz, "misma carpeta"),
+        (os.path.join(raiz, "Octubre", ".."), raiz, "misma carpeta"),
+    ]
+
+
+def test_anidadas_en_cualquier_orden(arbol):
+    anio = str(arbol / "2025")
+    octubre = str(arbol / "2025" / "Octubre")
+    semana = str(arbol / "2025" / "Octubre" / "Semana1")
+    otra = str(arbol / "otra")
+    raices, fusiones = normalizar_raices([semana, otra, anio, octubre])
+    assert raices == [otra, anio]
+    # Se unen a la raíz que queda, no a la intermedia que también se unió
+    assert sorted(fusiones) == sorted([(semana, anio, INCLUIDA), (octubre, anio, INCLUIDA)])
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="sin enlaces simbólicos")
+def test_enlace_a_la_misma_carpeta(arbol):
+    enlace = arbol / "enlace2025"
+    try:
+        os.symlink(arbol / "2025", enlace, target_is_directory=True)
+    except OSError:
+        pytest.skip("sin permiso para crear enlaces simbólicos")
+    anio = str(arbol / "2025")
+    raices, fusiones = normalizar_raices([anio, str(enlace), str(enlace / "Octubre")])
+    assert raices == [anio]
+    assert fusiones == [(str(enlace), anio, "misma carpeta"), (str(enlace / "Octubre"), anio, INCLUIDA)]
+
+
+def test_inexistentes_se_conservan(arbol):
+    falta = str(arbol / "no_existe")
+    raices, fusiones = normalizar_raices([falta, str(arbol / "otra"), falta])
+    assert raices == [falta, str(arbol / "otra"), falta]
+    assert fusiones == []
+
+
+def test_reglas_dejan_fuera_la_anidada(arbol):
+    anio = str(arbol / "2025")
+    enviados = str(arbol / "2025" / "Enviados")
+    cuarentena = str(arbol / "2025" / ".cuarentena")
+    octubre = str(arbol / "2025" / "Octubre")
+    reglas = ReglasRecorrido(["Enviados"], omitir_ocultos=True)
+    raices, fusiones = normalizar_raices([anio, enviados, cuarentena, octubre], reglas)
+    assert raices == [anio, enviados, cuarentena]
+    assert fusiones == [(octubre, anio, INCLUIDA)]
+
+
+def test_profundidad_maxima(arbol):
+    anio = str(arbol / "2025")
+    octubre = str(arbol / "2025" / "Octubre")
+    semana = str(arbol / "2025" / "Octubre" / "Semana1")
+    # Semana1 está a dos niveles de 2025: con máximo 1 no se llega a ella
+    raices, fusiones = normalizar_raices([anio, octubre, semana], ReglasRecorrido(profundidad_maxima=1))
+    assert raices == [anio, semana]
+    assert fusiones == [(octubre, anio, INCLUIDA)]
+    raices, _ = normalizar_raices([anio, octubre, semana], ReglasRecorrido(profundidad_maxima=2))
+    assert raices == [anio]